@@ -21,6 +21,7 @@ from neutron.agent.common import config
 from neutron.agent.linux import external_process
 from neutron.agent.linux import interface
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import iptables_coordinator
 from neutron.agent.linux import iptables_manager
 from neutron.agent.linux import ovs_lib  # noqa
 from neutron.agent import rpc as agent_rpc
@@ -98,7 +99,8 @@ class L3PluginApi(proxy.RpcProxy):
 
 class RouterInfo(object):
 
-    def __init__(self, router_id, root_helper, use_namespaces, router):
+    def __init__(self, router_id, root_helper, use_namespaces, router,
+                 iptables_coordinator=None):
         self.router_id = router_id
         self.ex_gw_port = None
         self._snat_enabled = None
@@ -113,7 +115,8 @@ class RouterInfo(object):
         self.iptables_manager = iptables_manager.IptablesManager(
             root_helper=root_helper,
             #FIXME(danwent): use_ipv6=True,
-            namespace=self.ns_name)
+            namespace=self.ns_name,
+            coordinator=iptables_coordinator)
         self.routes = []
 
     @property
@@ -186,6 +189,15 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
                    default='$state_path/metadata_proxy',
                    help=_('Location of Metadata Proxy UNIX domain '
                           'socket')),
+        cfg.IntOpt('iptables_apply_workers', default=16,
+                   help=_("Maximum number of iptables-save and "
+                          "iptables-restore commands the routers run at the "
+                          "same time.")),
+        cfg.BoolOpt('iptables_apply_helper', default=False,
+                    help=_("Run the iptables commands of all the routers "
+                           "in batches, through one long-lived helper "
+                           "started with the root helper, instead of "
+                           "starting the root helper for each command.")),
     ]
 
     def __init__(self, host, conf=None):
@@ -195,6 +207,10 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
             self.conf = cfg.CONF
         self.root_helper = config.get_root_helper(self.conf)
         self.router_info = {}
+        self.iptables_coordinator = (
+            iptables_coordinator.IptablesApplyCoordinator(
+                self.root_helper, self.conf.iptables_apply_workers,
+                self.conf.iptables_apply_helper))
 
         self._check_config_params()
 
@@ -338,7 +354,8 @@ class L3NATAgent(firewall_l3_agent.FWaaSL3AgentRpcCallback, manager.Manager):
 
     def _router_added(self, router_id, router):
         ri = RouterInfo(router_id, self.root_helper,
-                        self.conf.use_namespaces, router)
+                        self.conf.use_namespaces, router,
+                        self.iptables_coordinator)
         self.router_info[router_id] = ri
         if self.conf.use_namespaces:
             self._create_router_namespace(ri)
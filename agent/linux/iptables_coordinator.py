@@ -0,0 +1,192 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Runs the iptables commands of the IptablesManagers of many namespaces.
+
+The L3 agent processes its routers in parallel, and every router applies
+its own IptablesManager, each apply running iptables-save and
+iptables-restore through the root helper in the router namespace. The
+coordinator bounds how many of these commands run at the same time.
+
+Optionally, the commands are sent to one long-lived privileged helper,
+started through the root helper, instead of starting the root helper for
+each of them. The commands queued by all the routers while the helper is
+busy are sent to it as one batch, so that a full resync of many routers
+costs a few round trips to the helper.
+
+The helper reads batches, one JSON list of requests per line, and writes
+one JSON list of [exit code, stdout, stderr] per batch. It only runs
+iptables-save, iptables-restore and their ip6tables counterparts:
+
+    python -m neutron.agent.linux.iptables_coordinator
+"""
+
+import re
+import subprocess
+import sys
+
+import eventlet
+from eventlet import event
+
+from neutron.agent.linux import utils as linux_utils
+from neutron.openstack.common import jsonutils
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+HELPER_COMMANDS = frozenset(['iptables-save', 'iptables-restore',
+                             'ip6tables-save', 'ip6tables-restore'])
+HELPER_OPTIONS = frozenset(['-c', '--noflush'])
+
+_NAMESPACE = re.compile(r'^[\w.-]+$')
+
+
+class IptablesApplyCoordinator(object):
+    """Runs iptables commands for IptablesManagers.
+
+    @param root_helper: root helper to run the commands, or the helper, with
+    @param workers: most commands run at the same time without the helper
+    @param use_helper: send the commands to the long-lived helper
+    @param batch_size: most commands sent to the helper at once
+    """
+
+    def __init__(self, root_helper=None, workers=16, use_helper=False,
+                 batch_size=64):
+        self.root_helper = root_helper
+        self.use_helper = use_helper
+        self.batch_size = batch_size
+        self._pool = eventlet.GreenPool(workers)
+        self._queue = []
+        self._dispatcher = None
+        self._helper = None
+
+    def execute(self, namespace, args, process_input=None):
+        """Run an iptables command in a namespace.
+
+        @param namespace: network namespace, None for the root one
+        @param args: command and options, e.g. ['iptables-save', '-c']
+        @param process_input: standard input of the command
+        @return: standard output of the command
+        @raise RuntimeError: the command failed, as linux_utils.execute()
+        """
+        if self.use_helper:
+            result = event.Event()
+            self._queue.append(({'namespace': namespace, 'args': args,
+                                 'input': process_input}, result))
+            if self._dispatcher is None:
+                self._dispatcher = eventlet.spawn(self._dispatch)
+            return result.wait()
+
+        if namespace:
+            args = ['ip', 'netns', 'exec', namespace] + args
+        return self._pool.spawn(linux_utils.execute, args,
+                                root_helper=self.root_helper,
+                                process_input=process_input).wait()
+
+    def stop(self):
+        """Stop the helper, if started."""
+        if self._helper is not None:
+            self._helper.stdin.close()
+            self._helper.wait()
+            self._helper = None
+
+    def _dispatch(self):
+        try:
+            # Let the other routers queue their commands first
+            eventlet.sleep(0)
+            while self._queue:
+                batch = self._queue[:self.batch_size]
+                del self._queue[:self.batch_size]
+                try:
+                    results = self._run_batch(
+                        [request for request, result in batch])
+                except Exception as e:
+                    LOG.exception(_('iptables helper failed'))
+                    for request, result in batch:
+                        result.send_exception(RuntimeError(str(e)))
+                    continue
+                for (request, result), (code, stdout, stderr) in zip(
+                        batch, results):
+                    if code:
+                        result.send_exception(RuntimeError(
+                            _("\nCommand: %(cmd)s\nExit code: %(code)s\n"
+                              "Stdout: %(stdout)r\nStderr: %(stderr)r") %
+                            {'cmd': request['args'], 'code': code,
+                             'stdout': stdout, 'stderr': stderr}))
+                    else:
+                        result.send(stdout)
+        finally:
+            self._dispatcher = None
+
+    def _run_batch(self, requests):
+        if self._helper is None or self._helper.poll() is not None:
+            self._helper = linux_utils.create_process(
+                [sys.executable, '-m', __name__],
+                root_helper=self.root_helper)[0]
+        try:
+            self._helper.stdin.write(jsonutils.dumps(requests) + '\n')
+            self._helper.stdin.flush()
+            line = self._helper.stdout.readline()
+            if not line:
+                raise RuntimeError(_('iptables helper exited: %s') %
+                                   self._helper.stderr.read())
+            return jsonutils.loads(line)
+        except Exception:
+            self._helper.kill()
+            self._helper = None
+            raise
+
+
+def run_batch(requests):
+    """Run the iptables commands of a batch, in the helper.
+
+    @param requests: list of dicts with the 'namespace', 'args' and 'input'
+        of each command
+    @return: list of [exit code, stdout, stderr], one per request
+    """
+    results = []
+    for request in requests:
+        args = request['args']
+        namespace = request.get('namespace')
+        if (not args or args[0] not in HELPER_COMMANDS or
+                not HELPER_OPTIONS.issuperset(args[1:]) or
+                (namespace and not _NAMESPACE.match(namespace))):
+            results.append([1, '', 'Command not allowed: %s' % args])
+            continue
+        if namespace:
+            args = ['ip', 'netns', 'exec', namespace] + args
+        try:
+            proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            process_input = request.get('input')
+            if process_input is not None:
+                process_input = process_input.encode('utf-8')
+            stdout, stderr = proc.communicate(process_input)
+            results.append([proc.returncode, stdout, stderr])
+        except OSError as e:
+            results.append([1, '', str(e)])
+    return results
+
+
+def main(stdin=sys.stdin, stdout=sys.stdout):
+    for line in iter(stdin.readline, ''):
+        stdout.write(jsonutils.dumps(run_batch(jsonutils.loads(line))) +
+                     '\n')
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
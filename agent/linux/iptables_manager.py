@@ -21,14 +21,31 @@
 
 """Implements iptables rules using linux utilities."""
 
+import collections
 import inspect
 import os
+import time
+
+from oslo.config import cfg
 
 from neutron.agent.linux import utils as linux_utils
 from neutron.common import utils
 from neutron.openstack.common import lockutils
 from neutron.openstack.common import log as logging
 
+OPTS = [
+    cfg.BoolOpt('iptables_incremental_apply', default=False,
+                help=_('Apply iptables changes as iptables-restore '
+                       '--noflush deltas of the changed chains, from the '
+                       'state written by the previous apply, instead of '
+                       'saving and restoring the whole tables every time')),
+    cfg.IntOpt('iptables_resync_interval', default=300,
+               help=_('Seconds after which an incremental apply saves and '
+                      'restores the whole tables again, to repair any '
+                      'change made behind its back')),
+]
+cfg.CONF.register_opts(OPTS)
+
 LOG = logging.getLogger(__name__)
 
 
@@ -48,6 +65,66 @@ MAX_CHAIN_LEN_WRAP = 11
 MAX_CHAIN_LEN_NOWRAP = 28
 
 
+def _strip_packets_bytes(line):
+    # strip any [packet:byte] counts at start or end of lines
+    if line.startswith(':'):
+        # it's a chain, for example, ":neutron-billing - [0:0]"
+        line = line.split(':')[1]
+        line = line.split(' - [', 1)[0]
+    elif line.startswith('['):
+        # it's a rule, for example, "[0:0] -A neutron-billing..."
+        line = line.split('] ', 1)[1]
+    line = line.strip()
+    return line
+
+
+def _entry_key(line):
+    # the chain (":neutron-billing") or the rule ("-A neutron-billing...")
+    # of an iptables-save line, without its [packet:byte] counts
+    if line.startswith(':'):
+        return line.split(' ', 1)[0]
+    elif line.startswith('['):
+        return line.split('] ', 1)[-1]
+    return line
+
+
+def _unique_last(entries):
+    # the entries without duplicates, the last occurrence of each one
+    # being kept as iptables_manager._modify_rules() does
+    seen = set()
+    unique = []
+    for entry in reversed(entries):
+        if entry not in seen:
+            seen.add(entry)
+            unique.append(entry)
+    unique.reverse()
+    return tuple(unique)
+
+
+def _chain_delta(chain, old, new):
+    # the commands turning the rules of chain old into new, deleting and
+    # inserting single rules so that the counters of the others are kept
+    new_rules = set(new)
+    old_rules = set(old)
+    if ([rule for rule in old if rule in new_rules] !=
+            [rule for rule in new if rule in old_rules]):
+        # The rules were reordered, rewrite the whole chain
+        return (['-F %s' % chain] +
+                ['-A %s %s' % (chain, rule) for rule in new])
+
+    lines = ['-D %s %s' % (chain, rule) for rule in old
+             if rule not in new_rules]
+    length = len(old) - len(lines)
+    for index, rule in enumerate(new):
+        if rule not in old_rules:
+            if index == length:
+                lines.append('-A %s %s' % (chain, rule))
+            else:
+                lines.append('-I %s %d %s' % (chain, index + 1, rule))
+            length += 1
+    return lines
+
+
 def get_chain_name(chain_name, wrap=True):
     if wrap:
         return chain_name[:MAX_CHAIN_LEN_WRAP]
@@ -273,7 +350,7 @@ class IptablesManager(object):
 
     def __init__(self, _execute=None, state_less=False,
                  root_helper=None, use_ipv6=False, namespace=None,
-                 binary_name=binary_name):
+                 binary_name=binary_name, coordinator=None):
         if _execute:
             self.execute = _execute
         else:
@@ -282,9 +359,19 @@ class IptablesManager(object):
         self.use_ipv6 = use_ipv6
         self.root_helper = root_helper
         self.namespace = namespace
+        # An iptables_coordinator.IptablesApplyCoordinator running the
+        # iptables-save and iptables-restore of apply()
+        self.coordinator = coordinator
         self.iptables_apply_deferred = False
         self.wrap_name = binary_name[:16]
 
+        self.incremental_apply = cfg.CONF.iptables_incremental_apply
+        self.resync_interval = cfg.CONF.iptables_resync_interval
+        # The state of the tables written by the last apply, per command,
+        # and when the tables were last saved and restored as a whole
+        self._snapshots = {}
+        self._synced_at = {}
+
         self.ipv4 = {'filter': IptablesTable(binary_name=self.wrap_name)}
         self.ipv6 = {'filter': IptablesTable(binary_name=self.wrap_name)}
 
@@ -377,29 +464,141 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        With incremental_apply, only the chains changed since the previous
+        apply are updated, unless the tables are due for a resync.
+
         """
         s = [('iptables', self.ipv4)]
         if self.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
-            args = ['%s-save' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            all_tables = self.execute(args, root_helper=self.root_helper)
-            all_lines = all_tables.split('\n')
-            for table_name, table in tables.iteritems():
-                start, end = self._find_table(all_lines, table_name)
-                all_lines[start:end] = self._modify_rules(
-                    all_lines[start:end], table, table_name)
-
-            args = ['%s-restore' % (cmd,), '-c']
-            if self.namespace:
-                args = ['ip', 'netns', 'exec', self.namespace] + args
-            self.execute(args, process_input='\n'.join(all_lines),
-                         root_helper=self.root_helper)
+            if not self._apply_incremental(cmd, tables):
+                self._apply_full(cmd, tables)
         LOG.debug(_("IPTablesManager.apply completed with success"))
 
+    def _apply_full(self, cmd, tables):
+        states = dict((table_name, self._table_state(table))
+                      for table_name, table in tables.iteritems())
+        # Until this apply succeeds, the tables are in an unknown state
+        self._snapshots.pop(cmd, None)
+
+        all_tables = self._execute(['%s-save' % (cmd,), '-c'])
+        all_lines = all_tables.split('\n')
+        for table_name, table in tables.iteritems():
+            start, end = self._find_table(all_lines, table_name)
+            all_lines[start:end] = self._modify_rules(
+                all_lines[start:end], table, table_name)
+
+        self._execute(['%s-restore' % (cmd,), '-c'],
+                      process_input='\n'.join(all_lines))
+
+        if self.incremental_apply:
+            self._snapshots[cmd] = states
+            self._synced_at[cmd] = time.time()
+
+    def _apply_incremental(self, cmd, tables):
+        """Apply the changes since the previous apply, if possible.
+
+        Returns False when the tables have to be saved and restored as a
+        whole instead: without incremental_apply, on the first apply or
+        when a resync is due, when chains or rules not wrapped changed, and
+        when the deltas fail to apply.
+
+        """
+        snapshot = self._snapshots.get(cmd)
+        if (snapshot is None or
+                time.time() - self._synced_at[cmd] >= self.resync_interval):
+            return False
+
+        states = {}
+        lines = []
+        for table_name, table in sorted(tables.iteritems()):
+            if (table_name not in snapshot or table.remove_chains or
+                    table.remove_rules):
+                return False
+            states[table_name] = self._table_state(table)
+            delta = self._table_delta(snapshot[table_name],
+                                      states[table_name])
+            if delta is None:
+                return False
+            if delta:
+                lines += ['*%s' % table_name] + delta + ['COMMIT']
+
+        if lines:
+            try:
+                self._execute(['%s-restore' % (cmd,), '--noflush'],
+                              process_input='\n'.join(lines + ['']))
+            except RuntimeError:
+                LOG.warn(_('Incremental %(cmd)s apply failed, resyncing '
+                           'the tables of namespace %(namespace)s'),
+                         {'cmd': cmd, 'namespace': self.namespace})
+                return False
+
+        self._snapshots[cmd] = states
+        return True
+
+    def _execute(self, args, process_input=None):
+        if self.coordinator:
+            return self.coordinator.execute(self.namespace, args,
+                                            process_input=process_input)
+        if self.namespace:
+            args = ['ip', 'netns', 'exec', self.namespace] + args
+        if process_input is None:
+            return self.execute(args, root_helper=self.root_helper)
+        return self.execute(args, process_input=process_input,
+                            root_helper=self.root_helper)
+
+    def _table_state(self, table):
+        """Return the chains and rules of a table, as applied.
+
+        The state is a tuple of a dict of each wrapped chain to the tuple
+        of its rules, and of a tuple of the chains and rules not wrapped,
+        all of them in the order _modify_rules() writes them.
+
+        """
+        chains = dict(('%s-%s' % (self.wrap_name, name), [])
+                      for name in table.chains)
+        unwrapped = [':%s' % name for name in sorted(table.unwrapped_chains)]
+        for top in (True, False):
+            for rule in table.rules:
+                if rule.top != top:
+                    continue
+                if rule.wrap:
+                    chains['%s-%s' % (self.wrap_name, rule.chain)].append(
+                        rule.rule)
+                else:
+                    unwrapped.append(str(rule))
+        return (dict((chain, _unique_last(rules))
+                     for chain, rules in chains.iteritems()),
+                _unique_last(unwrapped))
+
+    def _table_delta(self, old, new):
+        """Return the iptables-restore --noflush lines from old to new.
+
+        old and new are states returned by _table_state(). Only wrapped
+        chains are owned by this manager: None is returned when chains or
+        rules not wrapped changed.
+
+        """
+        old_chains, old_unwrapped = old
+        new_chains, new_unwrapped = new
+        if old_unwrapped != new_unwrapped:
+            return None
+
+        declared, changed, removed = [], [], []
+        for chain in sorted(new_chains):
+            rules = new_chains[chain]
+            if chain not in old_chains:
+                declared.append(':%s - [0:0]' % chain)
+                changed += ['-A %s %s' % (chain, rule) for rule in rules]
+            elif old_chains[chain] != rules:
+                changed += _chain_delta(chain, old_chains[chain], rules)
+        for chain in sorted(set(old_chains) - set(new_chains)):
+            removed += ['-F %s' % chain, '-X %s' % chain]
+        # Rules jumping to removed chains are deleted before the chains
+        return declared + changed + removed
+
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
             # length only <2 when fake iptables
@@ -429,13 +628,6 @@ class IptablesManager(object):
 
         return rules_index
 
-    def _find_last_entry(self, filter_list, match_str):
-        # find a matching entry, starting from the bottom
-        for s in reversed(filter_list):
-            s = s.strip()
-            if match_str in s:
-                return s
-
     def _modify_rules(self, current_lines, table, table_name):
         unwrapped_chains = table.unwrapped_chains
         chains = table.chains
@@ -459,6 +651,21 @@ class IptablesManager(object):
 
         rules_index = self._find_rules_index(new_filter)
 
+        # Index both filters once by chain or rule, the last entry of a
+        # chain or rule being the one whose [packet:byte] count is kept.
+        old_entries = dict((_entry_key(line), line) for line in old_filter)
+        new_entries = dict((_entry_key(line), line) for line in new_filter)
+        # Chains and rules to take out of new_filter
+        taken = set()
+
+        def _find_entry(entry_str):
+            old = old_entries.get(entry_str)
+            dup = None
+            if not old and entry_str not in taken:
+                dup = new_entries.get(entry_str)
+            taken.add(entry_str)
+            return old, dup
+
         all_chains = [':%s' % name for name in unwrapped_chains]
         all_chains += [':%s-%s' % (self.wrap_name, name) for name in chains]
 
@@ -468,10 +675,7 @@ class IptablesManager(object):
         for chain in all_chains:
             chain_str = str(chain).strip()
 
-            old = self._find_last_entry(old_filter, chain_str)
-            if not old:
-                dup = self._find_last_entry(new_filter, chain_str)
-            new_filter = [s for s in new_filter if chain_str not in s.strip()]
+            old, dup = _find_entry(chain_str)
 
             # if no old or duplicates, use original chain
             if old or dup:
@@ -491,10 +695,7 @@ class IptablesManager(object):
             # Further down, we weed out duplicates from the bottom of the
             # list, so here we remove the dupes ahead of time.
 
-            old = self._find_last_entry(old_filter, rule_str)
-            if not old:
-                dup = self._find_last_entry(new_filter, rule_str)
-            new_filter = [s for s in new_filter if rule_str not in s.strip()]
+            old, dup = _find_entry(rule_str)
 
             # if no old or duplicates, use original rule
             if old or dup:
@@ -514,63 +715,36 @@ class IptablesManager(object):
 
         our_rules += bot_rules
 
+        new_filter = [line for line in new_filter
+                      if _entry_key(line) not in taken]
         new_filter[rules_index:rules_index] = our_rules
         new_filter[rules_index:rules_index] = our_chains
 
-        def _strip_packets_bytes(line):
-            # strip any [packet:byte] counts at start or end of lines
-            if line.startswith(':'):
-                # it's a chain, for example, ":neutron-billing - [0:0]"
-                line = line.split(':')[1]
-                line = line.split(' - [', 1)[0]
-            elif line.startswith('['):
-                # it's a rule, for example, "[0:0] -A neutron-billing..."
-                line = line.split('] ', 1)[1]
-            line = line.strip()
-            return line
-
         seen_chains = set()
+        seen_rules = set()
+        remove_counts = collections.defaultdict(int)
+        for rule in remove_rules:
+            remove_counts[_strip_packets_bytes(str(rule))] += 1
 
-        def _weed_out_duplicate_chains(line):
-            # ignore [packet:byte] counts at end of lines
+        def _keep(line):
             if line.startswith(':'):
+                # ignore [packet:byte] counts at end of lines
                 line = _strip_packets_bytes(line)
                 if line in seen_chains:
                     return False
-                else:
-                    seen_chains.add(line)
-
-            # Leave it alone
-            return True
-
-        seen_rules = set()
-
-        def _weed_out_duplicate_rules(line):
-            if line.startswith('['):
-                line = _strip_packets_bytes(line)
-                if line in seen_rules:
+                seen_chains.add(line)
+                # We need to find exact matches here
+                if line in remove_chains:
+                    remove_chains.remove(line)
                     return False
-                else:
-                    seen_rules.add(line)
-
-            # Leave it alone
-            return True
-
-        def _weed_out_removes(line):
-            # We need to find exact matches here
-            if line.startswith(':'):
-                line = _strip_packets_bytes(line)
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
             elif line.startswith('['):
                 line = _strip_packets_bytes(line)
-                for rule in remove_rules:
-                    rule_str = _strip_packets_bytes(str(rule))
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+                if line in seen_rules:
+                    return False
+                seen_rules.add(line)
+                if remove_counts[line]:
+                    remove_counts[line] -= 1
+                    return False
 
             # Leave it alone
             return True
@@ -580,16 +754,12 @@ class IptablesManager(object):
         # non-zero [packet:byte] count we want to preserve.  We also filter
         # out anything in the "remove" list.
         new_filter.reverse()
-        new_filter = [line for line in new_filter
-                      if _weed_out_duplicate_chains(line) and
-                      _weed_out_duplicate_rules(line) and
-                      _weed_out_removes(line)]
+        new_filter = [line for line in new_filter if _keep(line)]
         new_filter.reverse()
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
 
         return new_filter
 
@@ -20,6 +20,7 @@ import re
 from oslo.config import cfg
 
 from neutron.agent.linux import ip_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.common import exceptions
 from neutron.openstack.common import excutils
@@ -35,9 +36,23 @@ OPTS = [
     cfg.IntOpt('ovs_vsctl_timeout',
                default=DEFAULT_OVS_VSCTL_TIMEOUT,
                help=_('Timeout in seconds for ovs-vsctl commands')),
+    cfg.StrOpt('ovsdb_interface', default='vsctl',
+               choices=['vsctl', 'native'],
+               help=_("How the ports of the bridges are read: 'vsctl' runs "
+                      "ovs-vsctl for every query, 'native' answers them "
+                      "from an in-process replica of ovsdb, kept up to "
+                      "date through ovsdb_connection")),
+    cfg.StrOpt('ovsdb_connection',
+               default='unix:/var/run/openvswitch/db.sock',
+               help=_("The 'unix:<path>' or 'tcp:<ip>:<port>' connection "
+                      "to ovsdb-server used by the native ovsdb_interface. "
+                      "The agent user must be allowed to open it")),
 ]
 cfg.CONF.register_opts(OPTS)
 
+# Connections whose replica was already waited for
+_ovsdb_waited = set()
+
 LOG = logging.getLogger(__name__)
 
 
@@ -56,6 +71,27 @@ class VifPort:
                 self.switch.br_name)
 
 
+def get_ovsdb_replica():
+    """Return the synchronized native OVSDB client, if configured.
+
+    None is returned with the vsctl ovsdb_interface, or when the replica
+    is not synchronized. Only the first call waits for the replica, up to
+    ovs_vsctl_timeout seconds.
+    """
+    if cfg.CONF.ovsdb_interface != 'native':
+        return None
+    connection = cfg.CONF.ovsdb_connection
+    client = ovsdb_client.get_client(connection)
+    if client.synced:
+        return client
+    if connection not in _ovsdb_waited:
+        _ovsdb_waited.add(connection)
+        if client.wait_synced(cfg.CONF.ovs_vsctl_timeout):
+            return client
+        LOG.warn(_('OVSDB replica of %s not synchronized, using ovs-vsctl '
+                   'until it is'), connection)
+
+
 class BaseOVS(object):
 
     def __init__(self, root_helper):
@@ -283,6 +319,12 @@ class OVSBridge(BaseOVS):
         return ret
 
     def get_port_name_list(self):
+        ovsdb = get_ovsdb_replica()
+        if ovsdb:
+            port_names = ovsdb.get_port_names(self.br_name)
+            if port_names is None:
+                raise RuntimeError(_('No bridge named %s') % self.br_name)
+            return port_names
         res = self.run_vsctl(["list-ports", self.br_name], check_error=True)
         if res:
             return res.strip().split("\n")
@@ -306,11 +348,22 @@ class OVSBridge(BaseOVS):
     def get_vif_ports(self):
         edge_ports = []
         port_names = self.get_port_name_list()
+        ovsdb = get_ovsdb_replica()
+        if ovsdb:
+            interfaces = ovsdb.get_rows('Interface', port_names)
         for name in port_names:
-            external_ids = self.db_get_map("Interface", name, "external_ids",
-                                           check_error=True)
-            ofport = self.db_get_val("Interface", name, "ofport",
-                                     check_error=True)
+            if ovsdb:
+                if name not in interfaces:
+                    continue
+                external_ids = interfaces[name]['external_ids']
+                # as ovs-vsctl get formats it
+                ofport = str(interfaces[name]['ofport'])
+            else:
+                external_ids = self.db_get_map("Interface", name,
+                                               "external_ids",
+                                               check_error=True)
+                ofport = self.db_get_val("Interface", name, "ofport",
+                                         check_error=True)
             if "iface-id" in external_ids and "attached-mac" in external_ids:
                 p = VifPort(name, ofport, external_ids["iface-id"],
                             external_ids["attached-mac"], self)
@@ -326,23 +379,32 @@ class OVSBridge(BaseOVS):
 
         return edge_ports
 
-    def get_vif_port_set(self):
-        port_names = self.get_port_name_list()
-        edge_ports = set()
+    def _list_interfaces(self, port_names):
+        """Return the name, external_ids and ofport of bridge interfaces.
+
+        ofport is an integer, or a list when not yet assigned.
+        """
+        ovsdb = get_ovsdb_replica()
+        if ovsdb:
+            return [(name, row['external_ids'], row['ofport']) for name, row
+                    in ovsdb.get_rows('Interface', port_names).items()]
         args = ['--format=json', '--', '--columns=name,external_ids,ofport',
                 'list', 'Interface']
         result = self.run_vsctl(args, check_error=True)
         if not result:
-            return edge_ports
-        for row in jsonutils.loads(result)['data']:
-            name = row[0]
-            if name not in port_names:
-                continue
-            external_ids = dict(row[1][1])
+            return []
+        return [(name, dict(external_ids[1]), ofport)
+                for name, external_ids, ofport in jsonutils.loads(
+                    result)['data'] if name in port_names]
+
+    def get_vif_port_set(self):
+        port_names = self.get_port_name_list()
+        edge_ports = set()
+        for row in self._list_interfaces(port_names):
+            name, external_ids, ofport = row
             # Do not consider VIFs which aren't yet ready
             # This can happen when ofport values are either [] or ["set", []]
             # We will therefore consider only integer values for ofport
-            ofport = row[2]
             try:
                 int_ofport = int(ofport)
             except (ValueError, TypeError):
@@ -380,6 +442,10 @@ class OVSBridge(BaseOVS):
 
         """
         port_names = self.get_port_name_list()
+        ovsdb = get_ovsdb_replica()
+        if ovsdb:
+            return dict((name, row['tag']) for name, row in
+                        ovsdb.get_rows('Port', port_names).items())
         args = ['--format=json', '--', '--columns=name,tag', 'list', 'Port']
         result = self.run_vsctl(args, check_error=True)
         port_tag_dict = {}
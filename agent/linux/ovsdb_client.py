@@ -0,0 +1,239 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-process replica of the Bridge, Port and Interface tables of OVSDB.
+
+OvsdbClient speaks the OVSDB JSON-RPC protocol (RFC 7047) to ovsdb-server
+and monitors the columns of these tables that ovs_lib queries. The
+initial reply and the following update notifications keep an in-memory
+copy of the rows, so that the agents read the ports of their bridges
+without running ovs-vsctl, and learn about interface changes as soon as
+ovsdb-server notifies them.
+
+The client reconnects, and monitors again, whenever the connection is
+lost. Until the replica is synchronized again, synced is False and the
+callers go back to ovs-vsctl.
+"""
+
+import json
+
+import eventlet
+from eventlet import event
+from eventlet.green import socket
+from eventlet import timeout as eventlet_timeout
+
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+DATABASE = 'Open_vSwitch'
+# The columns monitored in each table
+MONITORED = {'Bridge': ['name', 'ports'],
+             'Port': ['name', 'interfaces', 'tag'],
+             'Interface': ['name', 'ofport', 'external_ids']}
+
+_MONITOR_ID = 'neutron'
+_clients = {}
+
+
+def decode(value):
+    """Return the Python value of an OVSDB JSON value.
+
+    Sets become lists, maps dicts, and UUIDs their string.
+    """
+    if isinstance(value, list):
+        kind, data = value
+        if kind == 'set':
+            return [decode(item) for item in data]
+        if kind == 'map':
+            return dict((decode(key), decode(item)) for key, item in data)
+        return data
+    return value
+
+
+def _as_list(value):
+    # a set of one element is sent as the element itself
+    return value if isinstance(value, list) else [value]
+
+
+class OvsdbClient(object):
+    """Monitors the tables ovs_lib reads from an ovsdb-server.
+
+    @param connection: 'unix:<path>' or 'tcp:<ip>:<port>' of the server
+    @param retry_interval: seconds between two connection attempts
+    """
+
+    def __init__(self, connection, retry_interval=2):
+        self.connection = connection
+        self.retry_interval = retry_interval
+        self.tables = dict((table, {}) for table in MONITORED)
+        self._sock = None
+        self._thread = None
+        self._synced = event.Event()
+        self._updated = True
+
+    @property
+    def synced(self):
+        return self._synced.ready()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+        self._close()
+
+    def wait_synced(self, timeout):
+        """Wait for the replica to be synchronized.
+
+        @return: True if synchronized within timeout seconds
+        """
+        if not self.synced:
+            with eventlet_timeout.Timeout(timeout, False):
+                self._synced.wait()
+        return self.synced
+
+    def consume_updates(self):
+        """Tell whether interfaces changed since the previous call.
+
+        Fails open: True is returned while the replica is not synchronized.
+        """
+        updated = self._updated or not self.synced
+        self._updated = False
+        return updated
+
+    def get_port_names(self, bridge):
+        """Return the sorted port names of a bridge, but its local port.
+
+        @return: list of names, as ovs-vsctl list-ports, None if the bridge
+            does not exist
+        """
+        ports = self.tables['Port']
+        for row in self.tables['Bridge'].values():
+            if row.get('name') == bridge:
+                return sorted(ports[uuid]['name']
+                              for uuid in _as_list(row.get('ports', []))
+                              if uuid in ports and
+                              ports[uuid]['name'] != bridge)
+
+    def get_rows(self, table, names):
+        """Return the rows of a table whose name is one of names.
+
+        @return: dict of name to row, a dict of the monitored columns
+        """
+        return dict((row['name'], row) for row in self.tables[table].values()
+                    if row.get('name') in names)
+
+    def _run(self):
+        while True:
+            try:
+                self._connect()
+                self._read()
+            except (socket.error, ValueError, RuntimeError) as e:
+                LOG.warn(_('Lost the OVSDB connection %(connection)s: '
+                           '%(error)s'), {'connection': self.connection,
+                                          'error': e})
+            self._close()
+            eventlet.sleep(self.retry_interval)
+
+    def _connect(self):
+        kind, _sep, address = self.connection.partition(':')
+        if kind == 'unix':
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        elif kind == 'tcp':
+            host, _sep, port = address.rpartition(':')
+            address = (host, int(port))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        else:
+            raise ValueError(_('Invalid OVSDB connection %s') %
+                             self.connection)
+        sock.connect(address)
+        self._sock = sock
+        self._send({'method': 'monitor', 'id': _MONITOR_ID,
+                    'params': [DATABASE, _MONITOR_ID, dict(
+                        (table, {'columns': columns})
+                        for table, columns in MONITORED.items())]})
+
+    def _close(self):
+        if self._synced.ready():
+            self._synced = event.Event()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _send(self, message):
+        self._sock.sendall(json.dumps(message))
+
+    def _read(self):
+        decoder = json.JSONDecoder()
+        buf = ''
+        while True:
+            data = self._sock.recv(65536)
+            if not data:
+                raise RuntimeError(_('connection closed by ovsdb-server'))
+            buf += data
+            while True:
+                buf = buf.lstrip()
+                try:
+                    message, end = decoder.raw_decode(buf)
+                except ValueError:
+                    # Wait for the rest of the message
+                    break
+                buf = buf[end:]
+                self._handle(message)
+
+    def _handle(self, message):
+        method = message.get('method')
+        if method == 'echo':
+            self._send({'id': message['id'], 'result': message['params'],
+                        'error': None})
+        elif method == 'update':
+            self._update(message['params'][1])
+        elif message.get('id') == _MONITOR_ID:
+            if message.get('error'):
+                raise RuntimeError(_('OVSDB monitor failed: %s') %
+                                   message['error'])
+            for rows in self.tables.values():
+                rows.clear()
+            self._update(message['result'])
+            # Changes may have been missed while disconnected
+            self._updated = True
+            self._synced.send()
+
+    def _update(self, table_updates):
+        for table, row_updates in table_updates.items():
+            rows = self.tables[table]
+            for uuid, row_update in row_updates.items():
+                new = row_update.get('new')
+                if new is None:
+                    rows.pop(uuid, None)
+                else:
+                    row = dict(rows.get(uuid, {}))
+                    row.update((column, decode(value))
+                               for column, value in new.items())
+                    rows[uuid] = row
+            if table == 'Interface':
+                self._updated = True
+
+
+def get_client(connection):
+    """Return the started client of a connection, shared by the process."""
+    if connection not in _clients:
+        _clients[connection] = OvsdbClient(connection)
+        _clients[connection].start()
+    return _clients[connection]
@@ -18,6 +18,7 @@ import contextlib
 
 import eventlet
 
+from neutron.agent.linux import ovs_lib
 from neutron.agent.linux import ovsdb_monitor
 from neutron.plugins.openvswitch.common import constants
 
@@ -27,7 +28,10 @@ def get_polling_manager(minimize_polling=False,
                         root_helper=None,
                         ovsdb_monitor_respawn_interval=(
                             constants.DEFAULT_OVSDBMON_RESPAWN)):
-    if minimize_polling:
+    ovsdb = minimize_polling and ovs_lib.get_ovsdb_replica()
+    if ovsdb:
+        pm = OvsdbReplicaPollingMinimizer(ovsdb)
+    elif minimize_polling:
         pm = InterfacePollingMinimizer(
             root_helper=root_helper,
             ovsdb_monitor_respawn_interval=ovsdb_monitor_respawn_interval)
@@ -112,3 +116,25 @@ class InterfacePollingMinimizer(BasePollingManager):
         # collect output.
         eventlet.sleep()
         return self._monitor.has_updates
+
+
+class OvsdbReplicaPollingMinimizer(BasePollingManager):
+    """Relies on the native OVSDB replica to determine when polling is
+    required.
+    """
+
+    def __init__(self, client):
+        super(OvsdbReplicaPollingMinimizer, self).__init__()
+        self._client = client
+
+    def start(self):
+        # The replica is shared by the process and already started
+        pass
+
+    def stop(self):
+        pass
+
+    def _is_polling_required(self):
+        # Let the replica process the pending update notifications
+        eventlet.sleep()
+        return self._client.consume_updates()
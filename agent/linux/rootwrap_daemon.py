@@ -0,0 +1,322 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long-lived root helper running the privileged commands of an agent.
+
+Every privileged command of the agents normally starts the root helper,
+e.g. sudo neutron-rootwrap, whose Python startup dominates the cost of
+the command. With the root_helper_daemon option of the [AGENT] section
+set, linux_utils.execute() runs them through this daemon instead:
+
+    root_helper_daemon = sudo python -m \\
+        neutron.agent.linux.rootwrap_daemon /etc/neutron/rootwrap.conf
+
+The agent starts the daemon on its first privileged command. The daemon
+loads the rootwrap configuration and filters once, creates a UNIX socket
+in a directory only the agent user can access, writes its path on its
+standard output, and exits when its standard input is closed, i.e. when
+the agent goes away.
+
+Every connection is served by its own thread, running one command at a
+time: the client opens as many connections as it runs commands at the
+same time. A request is one JSON line with the command 'cmd' and its
+standard 'input'. The daemon checks the command against the rootwrap
+filters, exactly as neutron-rootwrap, then streams one JSON line per
+chunk of 'stdout' or 'stderr' as the command writes them, and a last
+line with its 'exit' code. Data is carried as latin-1 text to keep any
+byte intact.
+"""
+
+import ConfigParser
+import json
+import os
+import shlex
+import shutil
+import signal
+import socket
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
+
+from eventlet.green import subprocess as green_subprocess
+from oslo.config import cfg
+from oslo.rootwrap import wrapper
+
+from neutron.common import utils
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# neutron-rootwrap exit codes
+RC_UNAUTHORIZED = 99
+RC_NOEXECFOUND = 96
+
+_CHUNK_SIZE = 65536
+_clients = {}
+
+
+def _to_wire(data):
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return data.decode('latin-1')
+
+
+def _from_wire(text):
+    return text.encode('latin-1')
+
+
+class RootwrapDaemonClient(object):
+    """Runs commands through a daemon it starts on its first command.
+
+    @param daemon_cmd: command starting the daemon, as root
+    """
+
+    def __init__(self, daemon_cmd):
+        self.daemon_cmd = daemon_cmd
+        self._daemon = None
+        self._socket_path = None
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def execute(self, cmd, process_input=None, addl_env=None):
+        """Run a command as root.
+
+        @param cmd: command and its arguments
+        @param process_input: standard input of the command
+        @param addl_env: dict of environment variables of the command,
+            passed through env as rootwrap EnvFilters expect
+        @return: (exit code, stdout, stderr)
+        @raise RuntimeError: the daemon could not be reached or exited
+            while the command was running
+        """
+        if addl_env:
+            cmd = (['env'] + ['%s=%s' % pair for pair in addl_env.items()] +
+                   cmd)
+        request = json.dumps({'cmd': cmd,
+                              'input': (_to_wire(process_input)
+                                        if process_input else None)})
+        conn = self._get_connection()
+        try:
+            conn.sendall(request + '\n')
+            stdout, stderr = [], []
+            reader = conn.makefile('r')
+            while True:
+                line = reader.readline()
+                if not line:
+                    raise RuntimeError(_('Root helper daemon closed the '
+                                         'connection running %s') % cmd)
+                response = json.loads(line)
+                if 'stdout' in response:
+                    stdout.append(_from_wire(response['stdout']))
+                elif 'stderr' in response:
+                    stderr.append(_from_wire(response['stderr']))
+                else:
+                    break
+        except Exception:
+            conn.close()
+            raise
+        self._idle.append(conn)
+        return response['exit'], ''.join(stdout), ''.join(stderr)
+
+    def _get_connection(self):
+        with self._lock:
+            if self._daemon is None or self._daemon.poll() is not None:
+                self._start_daemon()
+        if self._idle:
+            return self._idle.pop()
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self._socket_path)
+        except socket.error as e:
+            conn.close()
+            raise RuntimeError(_('Unable to connect to the root helper '
+                                 'daemon: %s') % e)
+        return conn
+
+    def _start_daemon(self):
+        for conn in self._idle:
+            conn.close()
+        del self._idle[:]
+        LOG.info(_('Starting root helper daemon: %s'), self.daemon_cmd)
+        self._daemon = utils.subprocess_popen(
+            shlex.split(self.daemon_cmd), stdin=green_subprocess.PIPE,
+            stdout=green_subprocess.PIPE)
+        self._socket_path = self._daemon.stdout.readline().strip()
+        if not self._socket_path:
+            self._daemon = None
+            raise RuntimeError(_('Root helper daemon failed to start: %s') %
+                               self.daemon_cmd)
+
+    def stop(self):
+        """Stop the daemon, if started."""
+        if self._daemon is not None:
+            for conn in self._idle:
+                conn.close()
+            del self._idle[:]
+            self._daemon.stdin.close()
+            self._daemon.wait()
+            self._daemon = None
+
+
+def get_client():
+    """Return the client of the configured daemon, None if not configured.
+
+    @return: RootwrapDaemonClient shared by the whole agent, or None
+    """
+    try:
+        daemon_cmd = cfg.CONF.AGENT.root_helper_daemon
+    except cfg.NoSuchOptError:
+        return None
+    if not daemon_cmd:
+        return None
+    if daemon_cmd not in _clients:
+        _clients[daemon_cmd] = RootwrapDaemonClient(daemon_cmd)
+    return _clients[daemon_cmd]
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        lock = threading.Lock()
+
+        def send(**response):
+            with lock:
+                self.wfile.write(json.dumps(response) + '\n')
+                self.wfile.flush()
+
+        for line in iter(self.rfile.readline, ''):
+            request = json.loads(line)
+            send(exit=self.server.run(request['cmd'], request.get('input'),
+                                      send))
+
+
+class RootwrapDaemon(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    """Runs the commands its clients send, if the filters allow them.
+
+    @param socket_path: path of the UNIX socket to listen on
+    @param config: oslo.rootwrap wrapper.RootwrapConfig
+    @param filters: filters loaded by oslo.rootwrap wrapper.load_filters()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, config, filters):
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               _RequestHandler)
+        self.config = config
+        self.filters = filters
+
+    def run(self, userargs, process_input, send):
+        """Run a command, streaming its output through send.
+
+        @return: exit code of the command
+        """
+        try:
+            filtermatch = wrapper.match_filter(
+                self.filters, userargs, exec_dirs=self.config.exec_dirs)
+        except wrapper.FilterMatchNotExecutable as exc:
+            send(stderr='Executable not found: %s (filter match = %s)\n' %
+                 (exc.match.exec_path, exc.match.name))
+            return RC_NOEXECFOUND
+        except wrapper.NoFilterMatched:
+            send(stderr='Unauthorized command: %s (no filter matched)\n' %
+                 ' '.join(userargs))
+            return RC_UNAUTHORIZED
+
+        command = filtermatch.get_command(userargs,
+                                          exec_dirs=self.config.exec_dirs)
+        try:
+            obj = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, close_fds=True,
+                                   preexec_fn=_subprocess_setup,
+                                   env=filtermatch.get_environment(userargs))
+        except OSError as e:
+            send(stderr='%s\n' % e)
+            return RC_NOEXECFOUND
+
+        threads = [threading.Thread(target=_write_input,
+                                    args=(obj.stdin, process_input)),
+                   threading.Thread(target=_stream,
+                                    args=(obj.stderr, 'stderr', send))]
+        for thread in threads:
+            thread.start()
+        _stream(obj.stdout, 'stdout', send)
+        for thread in threads:
+            thread.join()
+        return obj.wait()
+
+
+def _subprocess_setup():
+    # Python installs a SIGPIPE handler by default. This is usually not what
+    # non-Python subprocesses expect.
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+def _write_input(pipe, process_input):
+    try:
+        if process_input:
+            pipe.write(_from_wire(process_input))
+    except IOError:
+        # The command exited without reading all its input
+        pass
+    finally:
+        pipe.close()
+
+
+def _stream(pipe, name, send):
+    for chunk in iter(lambda: os.read(pipe.fileno(), _CHUNK_SIZE), ''):
+        send(**{name: _to_wire(chunk)})
+    pipe.close()
+
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+    if len(argv) != 2:
+        sys.exit('Usage: %s <rootwrap configuration file>' % argv[0])
+    rawconfig = ConfigParser.RawConfigParser()
+    rawconfig.read(argv[1])
+    config = wrapper.RootwrapConfig(rawconfig)
+    filters = wrapper.load_filters(config.filters_path)
+
+    socket_dir = tempfile.mkdtemp(prefix='neutron-rootwrap-')
+    try:
+        socket_path = os.path.join(socket_dir, 'rootwrap.sock')
+        server = RootwrapDaemon(socket_path, config, filters)
+        # Only the user who started the daemon through sudo may connect
+        if 'SUDO_UID' in os.environ:
+            for path in (socket_dir, socket_path):
+                os.chown(path, int(os.environ['SUDO_UID']),
+                         int(os.environ['SUDO_GID']))
+
+        def wait_for_agent():
+            sys.stdin.read()
+            server.shutdown()
+        watcher = threading.Thread(target=wait_for_agent)
+        watcher.daemon = True
+        watcher.start()
+
+        sys.stdout.write(socket_path + '\n')
+        sys.stdout.flush()
+        server.serve_forever()
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
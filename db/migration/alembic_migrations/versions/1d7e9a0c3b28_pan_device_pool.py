@@ -0,0 +1,58 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""pan_device_pool
+
+Revision ID: 1d7e9a0c3b28
+Revises: 4b3c2d1e5f60
+Create Date: 2014-06-17 15:40:11.302884
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1d7e9a0c3b28'
+down_revision = '4b3c2d1e5f60'
+
+# Change to ['*'] if this migration applies to all plugins
+
+migration_for_plugins = ['*']
+
+from alembic import op
+import sqlalchemy as sa
+
+from neutron.db import migration
+
+
+def upgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    # Free devices of the pool are kept with a NULL router_id
+    op.alter_column('pan_device_reservations', 'router_id',
+                    existing_type=sa.String(36), nullable=True)
+    op.create_index('ix_pan_device_reservations_router_id',
+                    'pan_device_reservations', ['router_id'])
+
+
+def downgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+    op.drop_index('ix_pan_device_reservations_router_id',
+                  'pan_device_reservations')
+    op.execute("DELETE FROM pan_device_reservations WHERE router_id IS NULL")
+    op.alter_column('pan_device_reservations', 'router_id',
+                    existing_type=sa.String(36), nullable=False)
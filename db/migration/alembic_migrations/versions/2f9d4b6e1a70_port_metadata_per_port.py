@@ -0,0 +1,104 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""port_metadata one row per port
+
+Revision ID: 2f9d4b6e1a70
+Revises: 52f0c1a8e6d4
+Create Date: 2014-07-01 16:25:03.540118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2f9d4b6e1a70'
+down_revision = '52f0c1a8e6d4'
+
+# Change to ['*'] if this migration applies to all plugins
+
+migration_for_plugins = [
+    'neutron.plugins.ml2.plugin.Ml2Plugin'
+]
+
+from alembic import op
+import sqlalchemy as sa
+
+from neutron.db import migration
+from neutron.openstack.common import jsonutils
+from neutron.openstack.common import uuidutils
+
+
+def _create_table(name):
+    op.create_table(
+        name,
+        sa.Column('port_id', sa.String(36), nullable=False),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['port_id'], ['ports.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('port_id')
+    )
+
+
+def upgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    bind = op.get_bind()
+    # Merge the tag rows of every port into a single JSON list
+    tags = {}
+    for port_id, data in bind.execute(
+            "SELECT port_id, data FROM port_metadata"):
+        tags.setdefault(port_id, []).append(data)
+
+    _create_table('port_metadata_new')
+    if tags:
+        table = sa.sql.table('port_metadata_new',
+                             sa.sql.column('port_id', sa.String),
+                             sa.sql.column('data', sa.Text))
+        op.bulk_insert(table, [{'port_id': port_id,
+                                'data': jsonutils.dumps(port_tags)}
+                               for port_id, port_tags in tags.iteritems()])
+    op.drop_table('port_metadata')
+    op.rename_table('port_metadata_new', 'port_metadata')
+
+
+def downgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    rows = op.get_bind().execute(
+        "SELECT port_id, data FROM port_metadata").fetchall()
+    op.drop_table('port_metadata')
+    op.create_table(
+        'port_metadata',
+        sa.Column('id', sa.String(36), nullable=False),
+        sa.Column('port_id', sa.String(36), nullable=False),
+        sa.Column('data', sa.String(1024), nullable=False),
+        sa.ForeignKeyConstraint(['port_id'], ['ports.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    if not rows:
+        return
+    table = sa.sql.table('port_metadata',
+                         sa.sql.column('id', sa.String),
+                         sa.sql.column('port_id', sa.String),
+                         sa.sql.column('data', sa.String))
+    op.bulk_insert(table, [{'id': uuidutils.generate_uuid(),
+                            'port_id': port_id,
+                            'data': tag}
+                           for port_id, data in rows
+                           for tag in jsonutils.loads(data)])
@@ -0,0 +1,61 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright 2014 OpenStack Foundation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""pan_interface_mappings
+
+Revision ID: 52f0c1a8e6d4
+Revises: 1d7e9a0c3b28
+Create Date: 2014-06-24 10:12:56.817403
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '52f0c1a8e6d4'
+down_revision = '1d7e9a0c3b28'
+
+# Change to ['*'] if this migration applies to all plugins
+
+migration_for_plugins = ['*']
+
+from alembic import op
+import sqlalchemy as sa
+
+from neutron.db import migration
+
+
+def upgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+
+    op.create_table(
+        u'pan_interface_mappings',
+        sa.Column('port_id', sa.String(36), nullable=False),
+        sa.Column('device_sn', sa.String(16), nullable=False),
+        sa.Column('unit', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('segmentation_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['port_id'], ['ports.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('port_id'),
+        sa.UniqueConstraint('device_sn', 'unit')
+    )
+
+
+def downgrade(active_plugins=None, options=None):
+    if not migration.should_run(active_plugins, migration_for_plugins):
+        return
+    op.drop_table('pan_interface_mappings')
@@ -19,9 +19,13 @@ import sqlalchemy as sa
 from neutron.common import constants
 from neutron.db.l3_db import Router
 from neutron.db import model_base
-from neutron.db.models_v2 import HasId, Network, Port
+from neutron.extensions import portbindings
+from neutron.db.models_v2 import IPAllocation, Network, Port, Subnet
+from neutron.openstack.common import jsonutils
 from neutron.openstack.common import log
 from neutron.plugins.ml2 import driver_api
+from neutron.plugins.ml2.drivers import nova_instance_cache
+from neutron.services.l3_router.drivers.pan.connector import fanout
 from neutron.services.l3_router.drivers.pan.connector import pan_connector
 from neutron.services.l3_router.drivers.pan import db as pan_db
 
@@ -42,17 +46,30 @@ nova_opts = [
                help=''),
     cfg.StrOpt('nova_admin_auth_url',
                default=None,
-               help='')
+               help=''),
+    cfg.IntOpt('nova_instance_cache_ttl',
+               default=300,
+               help='Seconds Nova instance attributes used for port tags '
+                    'are cached'),
+    cfg.IntOpt('nova_instance_cache_size',
+               default=1000,
+               help='Maximum number of Nova instances cached'),
+    cfg.IntOpt('nova_instance_prefetch_interval',
+               default=10,
+               help='Minimum seconds between two listings of recently '
+                    'changed Nova instances made on cache misses; 0 '
+                    'disables listings')
 ]
 
 
-class PortMetadata(model_base.BASEV2, HasId):
-    """Represents a metadata for port on a Neutron v2 network."""
+class PortMetadata(model_base.BASEV2):
+    """Represents the tags of a port on a Neutron v2 network."""
     __tablename__ = 'port_metadata'
     port_id = sa.Column(sa.String(36), sa.ForeignKey('ports.id',
                                                      ondelete="CASCADE"),
-                        nullable=False)
-    data = sa.Column(sa.String(1024))
+                        primary_key=True)
+    # JSON list of tags
+    data = sa.Column(sa.Text, nullable=False)
 
 
 class PanoramaMechanismDriver(driver_api.MechanismDriver):
@@ -64,14 +81,20 @@ class PanoramaMechanismDriver(driver_api.MechanismDriver):
             except cfg.DuplicateOptError:
                 pass
         self.connector = pan_connector.PANConnector()
-        self.pan_db = pan_db.PanDbApi()
+        self.executor = fanout.DeviceExecutor(
+            max_workers=cfg.CONF.pan_fanout_workers,
+            per_device=cfg.CONF.pan_fanout_per_device)
         self.nova_client = nova_client.Client(
             cfg.CONF.nova_admin_username,
             cfg.CONF.nova_admin_password,
             cfg.CONF.nova_admin_tenant_name,
             cfg.CONF.nova_admin_auth_url,
             no_cache=True)
-        self.nova_client.authenticate()
+        self.instance_cache = nova_instance_cache.InstanceCache(
+            self.nova_client,
+            ttl=cfg.CONF.nova_instance_cache_ttl,
+            max_size=cfg.CONF.nova_instance_cache_size,
+            prefetch_interval=cfg.CONF.nova_instance_prefetch_interval)
         self._params = None
 
     @property
@@ -89,75 +112,96 @@ class PanoramaMechanismDriver(driver_api.MechanismDriver):
         if 'compute' in context._port['device_owner']:
             ip = self._get_port_ip(context, context._port)
             tags = self._collect_instance_tags(context)
-            routers = self._get_routers(context)
+            devices = self._get_router_devices(context)
             self._save_tags_to_db(context, tags)
-            self._add_address_for_dynamic_group(context, ip, tags, routers)
+            self._add_address_for_dynamic_group(ip, tags, devices)
+            self._commit_devices(devices)
         elif (constants.DEVICE_OWNER_ROUTER_INTF
               == context._port['device_owner']):
 
-            network_filter = {'network_id': [context._port['network_id']]}
-            ports = context._plugin.get_ports(context._plugin_context,
-                                              filters=network_filter)
-            routers = self._get_routers(context)
-            for port in ports:
-                tags = self._get_tags_from_db(context, port['id'])
-                if tags:
-                    ip = self._get_port_ip(context, port)
-                    self._add_address_for_dynamic_group(
-                        context, ip, tags, routers)
+            devices = self._get_router_devices(context)
+            for port_id, ip, tags in self._get_network_port_tags(
+                    context, context._port['network_id']):
+                self._add_address_for_dynamic_group(ip, tags, devices,
+                                                    flush=False)
+            self._flush_devices(devices)
+            self._commit_devices(devices)
+
+    def update_port_postcommit(self, context):
+        if (context.original is not None and
+                'compute' in context.current['device_owner'] and
+                context.current.get(portbindings.HOST_ID) !=
+                context.original.get(portbindings.HOST_ID)):
+            # Migrated or resized: the cached host, flavor and image are
+            # stale
+            self.instance_cache.invalidate(context.current['device_id'])
 
     def delete_port_precommit(self, context):
         if 'compute' in context._port['device_owner']:
             ip = self._get_port_ip(context, context._port)
-            routers = self._get_routers(context)
-            devices = self._remove_address_from_dynamic_group(
-                context, ip, routers)
+            devices = self._get_router_devices(context)
+            self._remove_address_from_dynamic_group(ip, devices)
             self._params = devices
         elif (constants.DEVICE_OWNER_ROUTER_INTF
               == context._port['device_owner']):
 
-            network_filter = {'network_id': [context._port['network_id']]}
-            ports = context._plugin.get_ports(context._plugin_context,
-                                              filters=network_filter)
-            routers = self._get_routers(context)
-            for port in ports:
-                tags = self._get_tags_from_db(context, port['id'])
-                if tags:
-                    ip = self._get_port_ip(context, port)
-                    devices = self._remove_address_from_dynamic_group(
-                        context, ip, routers)
-                    self._params = devices
+            devices = self._get_router_devices(context)
+            for port_id, ip, tags in self._get_network_port_tags(
+                    context, context._port['network_id']):
+                self._remove_address_from_dynamic_group(ip, devices,
+                                                        flush=False)
+            self._flush_devices(devices)
+            self._params = devices
 
     def delete_port_postcommit(self, context):
         if self._params:
-            for device in self._params:
-                self.connector.commit_configuration(device)
+            self._commit_devices(self._params)
         self._params = None
 
-    def _add_address_for_dynamic_group(self, context, ip, tags, routers):
-        for router in routers:
-            dev_res = self.pan_db.get_device_reservation(
-                context._plugin_context, router['id'])
-            self.connector.register_ip_address(dev_res['device_sn'],
-                                               ip,
-                                               tags)
-            self.connector.commit_configuration(dev_res['device_sn'])
-
-    def _remove_address_from_dynamic_group(self, context, ip, routers):
-        devices = []
-        for router in routers:
-            dev_res = self.pan_db.get_device_reservation(
-                context._plugin_context, router['id'])
-            self.connector.unregister_ip_address(dev_res['device_sn'],
-                                                 ip)
-            devices.append(dev_res['device_sn'])
-        return devices
+    def _flush_devices(self, devices):
+        self.executor.map(self.connector.flush_user_id, devices)
+
+    def _commit_devices(self, devices):
+        # Schedule all commits first so that they run concurrently and join
+        # the batches of concurrent requests for the same devices.
+        futures = [self.connector.commit_configuration(device, wait=False)
+                   for device in devices]
+        if not cfg.CONF.pan_commit_wait:
+            return
+        for future in futures:
+            if future is not None:
+                future.wait()
+
+    def _add_address_for_dynamic_group(self, ip, tags, devices,
+                                       flush=True):
+        if not flush:
+            # Only buffered, nothing to wait for
+            for device_sn in devices:
+                self.connector.register_ip_address(device_sn, ip, tags,
+                                                   flush=False)
+            return
+        self.executor.map(self.connector.register_ip_address, devices,
+                          ip, tags, flush=True)
+
+    def _remove_address_from_dynamic_group(self, ip, devices, flush=True):
+        if not flush:
+            for device_sn in devices:
+                self.connector.unregister_ip_address(device_sn, ip,
+                                                     flush=False)
+            return
+        self.executor.map(self.connector.unregister_ip_address, devices,
+                          ip, flush=True)
 
     def _collect_instance_tags(self, context):
         tags = []
 
         ip = context._port['fixed_ips'][0]
-        host = self.nova_client.servers.get(context._port['device_id'])
+        host = self.instance_cache.get(context._port['device_id'])
+        binding_host = context._port.get(portbindings.HOST_ID)
+        if binding_host and binding_host != host['host']:
+            # The instance moved since it was cached
+            self.instance_cache.invalidate(context._port['device_id'])
+            host = self.instance_cache.get(context._port['device_id'])
 
         tags.append("openstack_tenant-%s" % context._port['tenant_id'])
 
@@ -172,14 +216,13 @@ class PanoramaMechanismDriver(driver_api.MechanismDriver):
 
         tags.append("openstack_vm-%s" % context._port['device_id'])
 
-        tags.append("openstack_vm_image-%s" % host.image['id'])
+        tags.append("openstack_vm_image-%s" % host['image_id'])
 
-        tags.append("openstack_vm_flavor-%s" % host.flavor['id'])
+        tags.append("openstack_vm_flavor-%s" % host['flavor_id'])
 
-        tags.append("openstack_vm_host-%s"
-                    % host.__getattr__('OS-EXT-SRV-ATTR:host'))
+        tags.append("openstack_vm_host-%s" % host['host'])
 
-        tags.append("openstack_vm_user-%s" % host.user_id)
+        tags.append("openstack_vm_user-%s" % host['user_id'])
 
         for sg in context._port['security_groups']:
             tags.append("openstack_security_group-%s" % sg)
@@ -193,25 +236,45 @@ class PanoramaMechanismDriver(driver_api.MechanismDriver):
         return "%s/%s" % (ip['ip_address'],
                           IPNetwork(subnet['cidr']).prefixlen)
 
-    def _get_routers(self, context):
-        query = context._plugin_context.session.query(Router)
-        query = query.join(pan_db.PanDeviceReservation,
+    def _get_router_devices(self, context):
+        """Return the PAN devices of the routers attached to the network of
+        the port.
+        """
+        query = context._plugin_context.session.query(
+            pan_db.PanDeviceReservation.device_sn)
+        query = query.join(Router,
                            Router.id == pan_db.PanDeviceReservation.router_id)
         query = query.join(Port, Router.id == Port.device_id)
         query = query.join(Network, Port.network_id == Network.id)
         query = query.filter(Network.id == context._port['network_id'])
 
-        routers = query.all()
-        return routers
+        return [device_sn for (device_sn,) in query.distinct()]
+
+    def _get_network_port_tags(self, context, network_id):
+        """Yield (port id, ip/prefixlen, tags) of the tagged ports of a
+        network, using a single query.
+        """
+        query = context._plugin_context.session.query(
+            PortMetadata.port_id, IPAllocation.ip_address, Subnet.cidr,
+            PortMetadata.data)
+        query = query.join(Port, Port.id == PortMetadata.port_id)
+        query = query.join(IPAllocation, IPAllocation.port_id == Port.id)
+        query = query.join(Subnet, Subnet.id == IPAllocation.subnet_id)
+        query = query.filter(Port.network_id == network_id)
+        query = query.order_by(PortMetadata.port_id)
+
+        last_port_id = None
+        for port_id, ip_address, cidr, data in query.yield_per(500):
+            # Like _get_port_ip, only the first fixed ip of a port is used
+            if port_id == last_port_id:
+                continue
+            last_port_id = port_id
+            yield (port_id,
+                   "%s/%s" % (ip_address, IPNetwork(cidr).prefixlen),
+                   jsonutils.loads(data))
 
     def _save_tags_to_db(self, context, tags):
         with context._plugin_context.session.begin(subtransactions=True):
-            for tag in tags:
-                ref = PortMetadata(port_id=context._port['id'],
-                                   data=tag)
-                context._plugin_context.session.add(ref)
-
-    def _get_tags_from_db(self, context, port_id):
-        result = context._plugin_context.session.query(PortMetadata).\
-            filter(PortMetadata.port_id == port_id).all()
-        return [item['data'] for item in result]
+            ref = PortMetadata(port_id=context._port['id'],
+                               data=jsonutils.dumps(tags))
+            context._plugin_context.session.merge(ref)
@@ -0,0 +1,139 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Cache of the Nova instance attributes used to tag ports.
+
+On a miss, InstanceCache first lists the servers changed since its last
+listing (all tenants), so that a burst of instance boots is served by one
+Nova request, and only then falls back to a single servers.get(). The
+client is authenticated on first use and again whenever Nova rejects its
+token.
+"""
+
+import collections
+import datetime
+import time
+
+from novaclient import exceptions as nova_exc
+
+from neutron.openstack.common import log
+from neutron.openstack.common import timeutils
+
+LOG = log.getLogger(__name__)
+
+HOST_ATTR = 'OS-EXT-SRV-ATTR:host'
+
+
+def server_info(server):
+    """Extract the attributes used for port tags from a Nova server."""
+    return {'image_id': server.image['id'] if server.image else '',
+            'flavor_id': server.flavor['id'],
+            'host': getattr(server, HOST_ATTR, None),
+            'user_id': server.user_id}
+
+
+class InstanceCache(object):
+    """LRU cache of Nova instance attributes with expiry.
+
+    @param client: novaclient Client
+    @param ttl: seconds an instance stays cached
+    @param max_size: number of instances kept; the least recently used are
+        evicted first
+    @param prefetch_interval: minimum seconds between two server listings;
+        0 disables listings
+    """
+
+    def __init__(self, client, ttl=300, max_size=1000, prefetch_interval=10):
+        self._client = client
+        self._ttl = ttl
+        self._max_size = max_size
+        self._prefetch_interval = prefetch_interval
+        self._entries = collections.OrderedDict()
+        self._last_prefetch = None
+        self._authenticated = False
+
+    def get(self, instance_id):
+        """Return the attributes of an instance, see server_info()."""
+        info = self._lookup(instance_id)
+        if info is None:
+            self.prefetch()
+            info = self._lookup(instance_id)
+        if info is None:
+            info = server_info(self._call(self._client.servers.get,
+                                          instance_id))
+            self._store(instance_id, info)
+        return info
+
+    def prefetch(self):
+        """Cache the instances changed since the previous listing."""
+        if self._prefetch_interval <= 0:
+            return
+        now = time.time()
+        if (self._last_prefetch is not None and
+                now - self._last_prefetch < self._prefetch_interval):
+            return
+
+        since = self._last_prefetch or now - self._ttl
+        search_opts = {'all_tenants': True,
+                       'changes-since': timeutils.isotime(
+                           datetime.datetime.utcfromtimestamp(since))}
+        try:
+            servers = self._call(self._client.servers.list,
+                                 search_opts=search_opts)
+        except Exception:
+            LOG.exception(_('Failed to list Nova servers'))
+            return
+        self._last_prefetch = now
+
+        for server in servers:
+            if getattr(server, 'status', None) == 'DELETED':
+                self._entries.pop(server.id, None)
+            else:
+                self._store(server.id, server_info(server))
+
+    def invalidate(self, instance_id):
+        self._entries.pop(instance_id, None)
+
+    def _lookup(self, instance_id):
+        entry = self._entries.pop(instance_id, None)
+        if entry is None:
+            return None
+        info, expires = entry
+        if time.time() >= expires:
+            return None
+        # Re-inserting keeps the entries ordered from least to most
+        # recently used.
+        self._entries[instance_id] = entry
+        return info
+
+    def _store(self, instance_id, info):
+        if not info['host']:
+            # Not scheduled yet; the host tag would be wrong
+            return
+        self._entries.pop(instance_id, None)
+        self._entries[instance_id] = (info, time.time() + self._ttl)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def _call(self, func, *args, **kwargs):
+        if not self._authenticated:
+            self._client.authenticate()
+            self._authenticated = True
+        try:
+            return func(*args, **kwargs)
+        except nova_exc.Unauthorized:
+            LOG.debug(_('Nova token rejected, re-authenticating'))
+            self._client.authenticate()
+            return func(*args, **kwargs)
@@ -0,0 +1,231 @@
+# Copyright 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""FWaaS driver enforcing firewall policies on PAN devices.
+
+Routers of L3RouterPANDriver run on a PAN device reserved for them. This
+driver compiles the firewall rules of a tenant into a PAN security
+rulebase with its address and service objects, and writes it to the
+devices of the tenant routers with one configuration request and one
+commit per device. The devices are looked up in the Neutron database, so
+the agent running the driver needs the [database] connection option.
+
+The policy applied on every device is remembered; later updates only
+send the rules and objects that changed, as computed by rule_diff. The
+full policy is written again after a restart or a failed update.
+"""
+
+import hashlib
+import re
+
+from neutron import context as neutron_context
+from neutron.extensions import firewall as fw_ext
+from neutron.openstack.common import log as logging
+from neutron.services.firewall.drivers import fwaas_base
+from neutron.services.firewall.drivers import rule_diff
+from neutron.services.l3_router.drivers.pan.connector import pan_connector
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+from neutron.services.l3_router.drivers.pan import db as pan_db
+
+LOG = logging.getLogger(__name__)
+FWAAS_DRIVER_NAME = 'Fwaas PAN driver'
+
+# Every rule and object written by the driver has this name prefix
+PREFIX = 'os-'
+DEFAULT_DENY_RULE = PREFIX + 'default-deny'
+# Maximum length of PAN-OS rule and object names
+MAX_NAME_LEN = 31
+
+ANY = 'any'
+APPLICATION_DEFAULT = 'application-default'
+ICMP_APPLICATIONS = {4: 'icmp', 6: 'ipv6-icmp'}
+
+
+def object_name(kind, value):
+    """Name of the shared address or service object holding value.
+
+    Names are derived from the value, so rules matching the same address
+    or service share one object.
+    """
+    name = '%s%s-%s' % (PREFIX, kind, re.sub(r'[^\w.-]', '_', value))
+    if len(name) > MAX_NAME_LEN:
+        digest = hashlib.sha1(value.encode('utf-8')).hexdigest()
+        name = '%s%s-%s' % (PREFIX, kind,
+                            digest[:MAX_NAME_LEN - len(PREFIX) - len(kind)
+                                   - 1])
+    return name
+
+
+def rule_name(rule):
+    return (PREFIX + rule['id'])[:MAX_NAME_LEN]
+
+
+def _port_range(port):
+    # Neutron port ranges are min:max, PAN-OS ones min-max
+    return port.replace(':', '-') if port else None
+
+
+def build_security_policy(firewall):
+    """Compile a firewall into a policy for set_security_policy().
+
+    @param firewall: firewall dict with 'firewall_rule_list', as built by
+        FirewallPlugin._make_firewall_dict_with_rules()
+    @return: policy dict, see PANConnector.set_security_policy()
+    """
+    addresses = {}
+    services = {}
+    rules = []
+
+    for fw_rule in firewall['firewall_rule_list']:
+        rule = {'name': rule_name(fw_rule),
+                'action': 'allow' if fw_rule['action'] == 'allow' else 'deny',
+                'enabled': fw_rule['enabled'],
+                'source': ANY,
+                'destination': ANY,
+                'application': ANY,
+                'service': ANY,
+                'description': fw_rule.get('name')}
+
+        for key, ip_key in (('source', 'source_ip_address'),
+                            ('destination', 'destination_ip_address')):
+            if fw_rule.get(ip_key):
+                name = object_name('net', fw_rule[ip_key])
+                addresses[name] = fw_rule[ip_key]
+                rule[key] = name
+
+        protocol = fw_rule.get('protocol')
+        if protocol == 'icmp':
+            rule['application'] = ICMP_APPLICATIONS[fw_rule['ip_version']]
+            rule['service'] = APPLICATION_DEFAULT
+        elif protocol:
+            service = {'protocol': protocol,
+                       'source_port': _port_range(fw_rule.get('source_port')),
+                       'destination_port': _port_range(
+                           fw_rule.get('destination_port'))}
+            name = object_name('svc', '%s-%s-%s' % (
+                protocol, service['source_port'] or ANY,
+                service['destination_port'] or ANY))
+            services[name] = service
+            rule['service'] = name
+
+        rules.append(rule)
+
+    rules.append(default_deny_rule())
+    return {'prefix': PREFIX,
+            'addresses': addresses,
+            'services': services,
+            'rules': rules}
+
+
+def default_deny_rule():
+    return {'name': DEFAULT_DENY_RULE,
+            'action': 'deny',
+            'enabled': True,
+            'source': ANY,
+            'destination': ANY,
+            'application': ANY,
+            'service': ANY,
+            'description': None}
+
+
+class PanFwaasDriver(fwaas_base.FwaasDriverBase):
+    """PAN-OS driver for Firewall As A Service."""
+
+    def __init__(self):
+        LOG.debug(_("Initializing fwaas PAN driver"))
+        self._connector = pan_connector.PANConnector()
+        self._db = pan_db.PanDbApi()
+        # device_sn -> policy dict applied last
+        self._applied = {}
+
+    def create_firewall(self, apply_list, firewall):
+        LOG.debug(_('Creating firewall %(fw_id)s for tenant %(tid)s'),
+                  {'fw_id': firewall['id'], 'tid': firewall['tenant_id']})
+        return self.update_firewall(apply_list, firewall)
+
+    def update_firewall(self, apply_list, firewall):
+        LOG.debug(_('Updating firewall %(fw_id)s for tenant %(tid)s'),
+                  {'fw_id': firewall['id'], 'tid': firewall['tenant_id']})
+        if not firewall['admin_state_up']:
+            return self.apply_default_policy(apply_list, firewall)
+        self._apply(apply_list, firewall, build_security_policy(firewall))
+
+    def delete_firewall(self, apply_list, firewall):
+        LOG.debug(_('Deleting firewall %(fw_id)s for tenant %(tid)s'),
+                  {'fw_id': firewall['id'], 'tid': firewall['tenant_id']})
+        self._apply(apply_list, firewall, None)
+
+    def apply_default_policy(self, apply_list, firewall):
+        LOG.debug(_('Applying default policy on firewall %(fw_id)s for '
+                    'tenant %(tid)s'),
+                  {'fw_id': firewall['id'], 'tid': firewall['tenant_id']})
+        self._apply(apply_list, firewall,
+                    {'prefix': PREFIX, 'addresses': {}, 'services': {},
+                     'rules': [default_deny_rule()]})
+
+    def _apply(self, apply_list, firewall, policy):
+        devices = []
+        try:
+            devices = self._get_devices(apply_list)
+            changed = [device_sn for device_sn in devices
+                       if self._apply_device(device_sn, policy)]
+            # Commit all devices at once, then wait for every commit
+            commits = [self._connector.commit_configuration(device_sn,
+                                                            wait=False)
+                       for device_sn in changed]
+            for future in commits:
+                if future is not None:
+                    future.wait()
+        except (xapi.PanXapiError, pan_db.PanDeviceReservationNotFound):
+            LOG.exception(_("Failed to apply firewall %s on PAN devices"),
+                          firewall['id'])
+            # The device state is unknown, write the full policy next time
+            for device_sn in devices:
+                self._applied.pop(device_sn, None)
+            raise fw_ext.FirewallInternalDriverError(driver=FWAAS_DRIVER_NAME)
+
+    def _apply_device(self, device_sn, policy):
+        # Returns whether the device configuration was changed
+        old_policy = self._applied.pop(device_sn, None)
+        if policy is None:
+            self._connector.clear_security_policy(device_sn, PREFIX)
+            return True
+
+        if old_policy is None:
+            self._connector.set_security_policy(device_sn, policy)
+        else:
+            changes = rule_diff.diff_rules(old_policy['rules'],
+                                           policy['rules'],
+                                           key=lambda rule: rule['name'])
+            if not changes and old_policy == policy:
+                self._applied[device_sn] = policy
+                return False
+            LOG.debug(_('Applying %(count)d rule changes on %(device)s'),
+                      {'count': len(changes), 'device': device_sn})
+            self._connector.update_security_policy(device_sn, old_policy,
+                                                   policy, changes)
+        self._applied[device_sn] = policy
+        return True
+
+    def _get_devices(self, apply_list):
+        context = neutron_context.get_admin_context()
+        devices = []
+        for router_info in apply_list:
+            dev_res = self._db.get_device_reservation(context,
+                                                      router_info.router_id)
+            if dev_res['device_sn'] not in devices:
+                devices.append(dev_res['device_sn'])
+        return devices
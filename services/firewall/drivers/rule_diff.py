@@ -0,0 +1,101 @@
+# Copyright 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Difference between two ordered firewall rule lists.
+
+The plugin always sends the complete rule list of a firewall. Drivers of
+backends able to change single rules keep the list they applied last and
+use diff_rules() to turn the new one into the few operations that differ:
+inserting a rule in a 2000 rule policy gives one insert, not 2000 rules.
+
+The rules kept in place are the longest subsequence of rules found in
+both lists in the same order; every other rule present in both lists is
+moved, which gives the fewest moves possible.
+"""
+
+import bisect
+
+DELETE = 'delete'
+INSERT = 'insert'
+MOVE = 'move'
+UPDATE = 'update'
+
+
+def _stable_indexes(positions):
+    """Indexes of a longest increasing subsequence of positions."""
+    tails = []      # tails[n]: smallest last position of a run of n + 1
+    tail_idx = []   # index in positions of tails[n]
+    previous = [None] * len(positions)
+    for i, position in enumerate(positions):
+        n = bisect.bisect_left(tails, position)
+        if n == len(tails):
+            tails.append(position)
+            tail_idx.append(i)
+        else:
+            tails[n] = position
+            tail_idx[n] = i
+        previous[i] = tail_idx[n - 1] if n else None
+
+    result = set()
+    i = tail_idx[-1] if tail_idx else None
+    while i is not None:
+        result.add(i)
+        i = previous[i]
+    return result
+
+
+def diff_rules(old, new, key=lambda rule: rule['id']):
+    """Compute the operations turning rule list old into new.
+
+    Operations are (action, key, rule, before) tuples, to be applied in
+    the order returned:
+    - (DELETE, key, None, None): remove the rule
+    - (UPDATE, key, rule, None): replace the content of the rule in place
+    - (INSERT, key, rule, before): add the rule just before the rule with
+      key before, or at the end of the list if before is None
+    - (MOVE, key, rule, before): move the rule just before before, or to
+      the end of the list
+
+    @param old: ordered list of the rules applied last
+    @param new: ordered list of the rules to apply
+    @param key: function giving the identity of a rule
+    @return: list of operations
+    """
+    old_index = dict((key(rule), i) for i, rule in enumerate(old))
+    new_keys = [key(rule) for rule in new]
+    new_set = set(new_keys)
+
+    ops = [(DELETE, key(rule), None, None)
+           for rule in old if key(rule) not in new_set]
+
+    common = [i for i, k in enumerate(new_keys) if k in old_index]
+    stable = set(common[j] for j in _stable_indexes(
+        [old_index[new_keys[i]] for i in common]))
+
+    for i in common:
+        if new[i] != old[old_index[new_keys[i]]]:
+            ops.append((UPDATE, new_keys[i], new[i], None))
+
+    # Placing rules from the last one, each just before its successor,
+    # leaves every rule after the current one already in its final order.
+    placements = []
+    for i in range(len(new) - 1, -1, -1):
+        if i in stable:
+            continue
+        before = new_keys[i + 1] if i + 1 < len(new) else None
+        action = MOVE if new_keys[i] in old_index else INSERT
+        placements.append((action, new_keys[i], new[i], before))
+    return ops + placements
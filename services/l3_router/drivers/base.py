@@ -24,6 +24,10 @@ import six
 @six.add_metaclass(abc.ABCMeta)
 class L3RouterBaseDriver(object):
 
+    def create_router_prepare(self, context, r_ctx):
+        # Called before the transaction, the router is not created yet
+        pass
+
     @abc.abstractmethod
     def create_router_precommit(self, context, r_ctx):
         pass
@@ -56,6 +60,10 @@ class L3RouterBaseDriver(object):
     def add_router_interface_postcommit(self, context, rp_ctx):
         pass
 
+    def remove_router_interface_prepare(self, context, rp_ctx):
+        # Called in the transaction, before the router port is deleted
+        pass
+
     @abc.abstractmethod
     def remove_router_interface_precommit(self, context, rp_ctx):
         pass
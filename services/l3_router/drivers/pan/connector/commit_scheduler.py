@@ -0,0 +1,101 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Coalescing of PAN-OS commits.
+
+A PAN-OS commit takes tens of seconds and applies every pending candidate
+configuration change of the target, so one commit can serve all callers
+that changed the same device in the meantime. CommitScheduler collects
+commit requests per device serial during a debounce window and issues a
+single commit for the whole batch; every caller gets the same CommitFuture.
+"""
+
+import eventlet
+from eventlet import event
+from eventlet import semaphore
+
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class CommitFuture(object):
+    """Result of a scheduled commit shared by all callers of a batch."""
+
+    def __init__(self, device_sn):
+        self.device_sn = device_sn
+        self.requests = 0
+        self._event = event.Event()
+
+    def done(self):
+        return self._event.ready()
+
+    def wait(self):
+        """Block until the commit finished; re-raise its error, if any."""
+        return self._event.wait()
+
+    def _set_result(self, result):
+        self._event.send(result)
+
+    def _set_exception(self, exc):
+        self._event.send_exception(exc)
+
+
+class CommitScheduler(object):
+    """Issue at most one commit per device serial per debounce window.
+
+    @param commit_func: callable(device_sn) performing the actual commit
+    @param window: debounce window in seconds
+    """
+
+    def __init__(self, commit_func, window):
+        self._commit_func = commit_func
+        self._window = window
+        self._pending = {}
+        self._locks = {}
+
+    def schedule(self, device_sn=None):
+        """Request a commit of device_sn (None: Panorama).
+
+        @return: CommitFuture of the batch the request joined
+        """
+        future = self._pending.get(device_sn)
+        if future is None:
+            future = CommitFuture(device_sn)
+            self._pending[device_sn] = future
+            eventlet.spawn_after(self._window, self._run, device_sn)
+        future.requests += 1
+        return future
+
+    def _run(self, device_sn):
+        lock = self._locks.setdefault(device_sn, semaphore.Semaphore())
+        with lock:
+            # Requests arriving while a previous commit of this device was
+            # still running joined the batch; close it only now.
+            future = self._pending.pop(device_sn, None)
+            if future is None:
+                return
+            LOG.debug(_('Committing %(device)s for %(count)d request(s)'),
+                      {'device': device_sn or 'Panorama',
+                       'count': future.requests})
+            try:
+                result = self._commit_func(device_sn)
+            except Exception as e:
+                LOG.exception(_('Commit of %s failed'),
+                              device_sn or 'Panorama')
+                future._set_exception(e)
+            else:
+                future._set_result(result)
@@ -0,0 +1,67 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Local mirror of parts of the PAN-OS candidate configuration.
+
+The connector reads a few config subtrees (security zones, ethernet1/2
+layer3 units, virtual-router interfaces) only to decide what to write.
+ConfigCache keeps what was read or written per device for ttl seconds, so
+that repeated operations on the same device need no show request. The
+connector updates it with its own writes and drops the entries of a
+device whenever a change to it fails.
+"""
+
+import time
+
+MISSING = object()
+
+
+class ConfigCache(object):
+    """Per-device key/value cache with expiry.
+
+    @param ttl: seconds an entry stays valid; 0 disables the cache
+    """
+
+    def __init__(self, ttl=300):
+        self._ttl = ttl
+        self._devices = {}
+
+    def get(self, device_sn, key):
+        """Return the cached value of key, or MISSING."""
+        entry = self._devices.get(device_sn, {}).get(key)
+        if entry is None:
+            return MISSING
+        value, expires = entry
+        if time.time() >= expires:
+            del self._devices[device_sn][key]
+            return MISSING
+        return value
+
+    def put(self, device_sn, key, value):
+        if self._ttl <= 0:
+            return
+        self._devices.setdefault(device_sn, {})[key] = (
+            value, time.time() + self._ttl)
+
+    def discard(self, device_sn, key):
+        self._devices.get(device_sn, {}).pop(key, None)
+
+    def invalidate(self, device_sn=MISSING):
+        """Drop the entries of device_sn, or of every device."""
+        if device_sn is MISSING:
+            self._devices.clear()
+        else:
+            self._devices.pop(device_sn, None)
@@ -0,0 +1,98 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Concurrent execution of the same operation on several PAN devices.
+
+A port on a network shared by several routers must be registered on the
+device of every router. DeviceExecutor runs such independent per-device
+calls in green threads, so the operation takes about as long as on the
+slowest device. The number of calls in flight is bounded overall and per
+device, and the errors of all devices are reported together once every
+call finished.
+"""
+
+import collections
+
+import eventlet
+from eventlet import semaphore
+
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class FanoutError(Exception):
+    """Some of the calls made by DeviceExecutor.map() failed.
+
+    @ivar errors: dict of device serial number to exception
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(FanoutError, self).__init__(
+            '; '.join('%s: %s' % (device_sn, errors[device_sn])
+                      for device_sn in sorted(errors)))
+
+
+class DeviceExecutor(object):
+    """Run per-device calls concurrently.
+
+    @param max_workers: calls in flight for all devices together
+    @param per_device: calls in flight for the same device
+    """
+
+    def __init__(self, max_workers=16, per_device=1):
+        self._pool = eventlet.GreenPool(max_workers)
+        self._per_device = per_device
+        self._device_locks = collections.defaultdict(
+            lambda: semaphore.Semaphore(self._per_device))
+
+    def map(self, func, devices, *args, **kwargs):
+        """Call func(device_sn, *args, **kwargs) for every device.
+
+        @param func: callable, its first argument is a device serial number
+        @param devices: device serial numbers
+        @return: dict of device serial number to the result of its call
+        @raise FanoutError: once all calls returned, if any of them failed
+        """
+        devices = list(devices)
+        if len(devices) == 1:
+            # Not worth a green thread
+            pile = [self._call(func, devices[0], args, kwargs)]
+        else:
+            pile = eventlet.GreenPile(self._pool)
+            for device_sn in devices:
+                pile.spawn(self._call, func, device_sn, args, kwargs)
+
+        results = {}
+        errors = {}
+        for device_sn, failed, value in pile:
+            if failed:
+                errors[device_sn] = value
+            else:
+                results[device_sn] = value
+        if errors:
+            raise FanoutError(errors)
+        return results
+
+    def _call(self, func, device_sn, args, kwargs):
+        with self._device_locks[device_sn]:
+            try:
+                return device_sn, False, func(device_sn, *args, **kwargs)
+            except Exception as e:
+                LOG.exception(_('Operation on PAN device %s failed'),
+                              device_sn)
+                return device_sn, True, e
@@ -0,0 +1,186 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Asynchronous tracking of PAN-OS jobs.
+
+PanXapi.commit(sync=True) and PanXapi.log() block their caller until the
+job is finished. JobPoller instead tracks any number of jobs, on any number
+of devices, from a single greenthread. Each job is polled with exponential
+backoff and completes a JobHandle, which can be waited on or given
+callbacks.
+"""
+
+import time
+
+import eventlet
+from eventlet import event
+
+from neutron.openstack.common import log as logging
+from neutron.services.l3_router.drivers.pan.connector import metrics
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+
+LOG = logging.getLogger(__name__)
+
+COMMIT = 'commit'
+LOG_QUERY = 'log'
+
+_NO_METRICS = metrics.NoopMetrics()
+
+
+class JobHandle(object):
+    """Pending PAN-OS job; completed by JobPoller."""
+
+    def __init__(self, device_sn, job_id, kind, interval, timeout):
+        self.device_sn = device_sn
+        self.job_id = job_id
+        self.kind = kind
+        self.result = None
+        self.exception = None
+        self.started = time.time()
+        self._interval = interval
+        self._deadline = time.time() + timeout if timeout else None
+        self._next_poll = time.time() + interval
+        self._callbacks = []
+        self._event = event.Event()
+
+    def done(self):
+        return self._event.ready()
+
+    def wait(self):
+        """Block until the job finished; re-raise its error, if any."""
+        return self._event.wait()
+
+    def add_done_callback(self, fn):
+        """Call fn(handle) once the job finished (at once if it already is)."""
+        if self.done():
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def _finish(self, result=None, exception=None):
+        self.result = result
+        self.exception = exception
+        if exception is not None:
+            self._event.send_exception(exception)
+        else:
+            self._event.send(result)
+        for fn in self._callbacks:
+            try:
+                fn(self)
+            except Exception:
+                LOG.exception(_('Callback for PAN-OS job %s failed'),
+                              self.job_id)
+        self._callbacks = []
+
+
+class JobPoller(object):
+    """Poll many PAN-OS jobs from one greenthread.
+
+    @param registry: ClientRegistry used to query the jobs
+    @param interval: initial delay between two polls of a job
+    @param max_interval: upper bound for the delay between two polls
+    @param backoff: factor applied to the delay after every poll
+    @param timeout: seconds after which a job is failed; 0 waits forever
+    @param metrics: metrics backend the job durations are reported to
+    """
+
+    def __init__(self, registry, interval=0.5, max_interval=10.0,
+                 backoff=2.0, timeout=0, metrics=None):
+        self._registry = registry
+        self._metrics = metrics or _NO_METRICS
+        self._interval = interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._timeout = timeout
+        self._jobs = []
+        self._thread = None
+
+    def track(self, device_sn, job_id, kind=COMMIT):
+        """Start tracking a job.
+
+        @param device_sn: PAN device serial number (None: Panorama)
+        @param job_id: job id returned by commit(sync=False) or
+            log(sync=False)
+        @param kind: COMMIT for jobs queried with 'show jobs', LOG_QUERY for
+            type=log jobs
+        @return: JobHandle
+        """
+        handle = JobHandle(device_sn, job_id, kind, self._interval,
+                           self._timeout)
+        self._jobs.append(handle)
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+        return handle
+
+    def _run(self):
+        try:
+            while self._jobs:
+                now = time.time()
+                delay = min(job._next_poll for job in self._jobs) - now
+                if delay > 0:
+                    eventlet.sleep(delay)
+                    continue
+                for job in [job for job in self._jobs
+                            if job._next_poll <= now]:
+                    self._poll(job)
+                    if job.done() and self._metrics.enabled:
+                        self._record(job)
+                self._jobs = [job for job in self._jobs if not job.done()]
+        finally:
+            self._thread = None
+
+    def _poll(self, job):
+        try:
+            with self._registry.client(job.device_sn) as api:
+                status = api.job_status(job.job_id,
+                                        log=(job.kind == LOG_QUERY))
+                if status == 'FIN':
+                    job._finish(result=self._job_result(api, job))
+                    return
+        except Exception as e:
+            job._finish(exception=e)
+            return
+
+        LOG.debug(_('PAN-OS job %(job)s on %(device)s: %(status)s'),
+                  {'job': job.job_id,
+                   'device': job.device_sn or 'Panorama',
+                   'status': status})
+        now = time.time()
+        if job._deadline is not None and now > job._deadline:
+            job._finish(exception=xapi.PanXapiError(
+                'timeout waiting for job %s completion' % job.job_id))
+            return
+        job._interval = min(job._interval * self._backoff,
+                            max(job._interval, self._max_interval))
+        job._next_poll = now + job._interval
+
+    def _record(self, job):
+        tags = (job.kind, job.device_sn or 'panorama')
+        self._metrics.timing('job.time', time.time() - job.started, tags)
+        if job.exception is not None:
+            self._metrics.increment('job.errors', tags)
+
+    def _job_result(self, api, job):
+        if job.kind == LOG_QUERY:
+            return api.xml_result()
+
+        result = api.element_root.find('./result/job/result')
+        if result is not None and result.text == 'FAIL':
+            details = [line.text for line in api.element_root.findall(
+                './result/job/details/line') if line.text]
+            raise xapi.PanXapiError('job %s failed: %s'
+                                    % (job.job_id, '\n'.join(details)))
+        return result.text if result is not None else None
@@ -0,0 +1,204 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Counters and timings of the PAN XML API usage.
+
+The connector reports, through one of the backends below:
+
+- api.requests, api.errors, api.bytes_sent, api.bytes_received and the
+  api.request_time timing, per request type, action and target
+  (device serial number or 'panorama')
+- connector.calls, connector.errors and the connector.time timing, per
+  PANConnector method
+- commit.requests (commit_configuration calls) and commit.jobs (commits
+  actually started), per target
+- job.errors and the job.time timing of finished jobs, per job kind and
+  target
+
+A series is named after the metric followed by its tags, dot separated,
+e.g. api.request_time.config.set.panorama. NoopMetrics, the default, has
+enabled set to False and callers skip measuring altogether.
+"""
+
+import collections
+import functools
+import re
+import socket
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+NOOP = 'noop'
+MEMORY = 'memory'
+STATSD = 'statsd'
+
+_INVALID_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+_backends = {}
+
+
+def series_name(name, tags):
+    """Return the series name of a metric and its tags."""
+    if not tags:
+        return name
+    return '.'.join([name] + [_INVALID_CHARS.sub('_', str(tag or '_'))
+                              for tag in tags])
+
+
+class NoopMetrics(object):
+    """Backend dropping everything."""
+
+    enabled = False
+
+    def increment(self, name, tags=(), value=1):
+        pass
+
+    def timing(self, name, seconds, tags=()):
+        pass
+
+
+class InMemoryMetrics(object):
+    """Backend keeping counters and timing statistics in memory.
+
+    @param samples: number of most recent samples per timing series used
+        to compute its percentiles
+    """
+
+    enabled = True
+
+    def __init__(self, samples=1024):
+        self._samples = samples
+        self._counters = collections.defaultdict(int)
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, tags=(), value=1):
+        key = series_name(name, tags)
+        with self._lock:
+            self._counters[key] += value
+
+    def timing(self, name, seconds, tags=()):
+        key = series_name(name, tags)
+        with self._lock:
+            timing = self._timings.get(key)
+            if timing is None:
+                timing = self._timings[key] = {
+                    'count': 0, 'sum': 0.0, 'min': seconds, 'max': seconds,
+                    'samples': collections.deque(maxlen=self._samples)}
+            timing['count'] += 1
+            timing['sum'] += seconds
+            timing['min'] = min(timing['min'], seconds)
+            timing['max'] = max(timing['max'], seconds)
+            timing['samples'].append(seconds)
+
+    def snapshot(self):
+        """Return the current values.
+
+        @return: dict with 'counters', a dict of series name to value, and
+            'timings', a dict of series name to dict with 'count', 'sum',
+            'min', 'max', 'p50', 'p90' and 'p99' (seconds)
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            timings = dict((key, dict(timing, samples=sorted(
+                timing['samples']))) for key, timing in
+                self._timings.items())
+        for timing in timings.values():
+            samples = timing.pop('samples')
+            for pct in (50, 90, 99):
+                rank = max(int(round(pct / 100.0 * len(samples))), 1)
+                timing['p%d' % pct] = samples[rank - 1]
+        return {'counters': counters, 'timings': timings}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+class StatsdMetrics(object):
+    """Backend sending every value to a statsd daemon over UDP.
+
+    @param host: statsd host
+    @param port: statsd UDP port
+    @param prefix: prepended to every series name
+    """
+
+    enabled = True
+
+    def __init__(self, host='localhost', port=8125, prefix='neutron.pan'):
+        self._address = (host, port)
+        self._prefix = prefix + '.' if prefix else ''
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def increment(self, name, tags=(), value=1):
+        self._send('%s%s:%d|c' % (self._prefix, series_name(name, tags),
+                                  value))
+
+    def timing(self, name, seconds, tags=()):
+        self._send('%s%s:%.3f|ms' % (self._prefix, series_name(name, tags),
+                                     seconds * 1000))
+
+    def _send(self, data):
+        try:
+            self._socket.sendto(data, self._address)
+        except socket.error as e:
+            # Metrics must never fail the operation being measured
+            LOG.debug(_('Failed to send metric to statsd: %s'), e)
+
+
+def get_backend(backend=NOOP, statsd_host='localhost', statsd_port=8125,
+                statsd_prefix='neutron.pan'):
+    """Return the backend shared by every connector of the process.
+
+    @param backend: NOOP, MEMORY or STATSD
+    @return: NoopMetrics, InMemoryMetrics or StatsdMetrics
+    """
+    key = (backend, statsd_host, statsd_port, statsd_prefix)
+    if key not in _backends:
+        if backend == NOOP:
+            _backends[key] = NoopMetrics()
+        elif backend == MEMORY:
+            _backends[key] = InMemoryMetrics()
+        elif backend == STATSD:
+            _backends[key] = StatsdMetrics(statsd_host, statsd_port,
+                                           statsd_prefix)
+        else:
+            raise ValueError(_('Unknown metrics backend %s') % backend)
+    return _backends[key]
+
+
+def instrumented(func):
+    """Count and time the calls of a method of an object with _metrics."""
+    tags = (func.__name__,)
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        metrics = self._metrics
+        if not metrics.enabled:
+            return func(self, *args, **kwargs)
+        start = time.time()
+        metrics.increment('connector.calls', tags)
+        try:
+            return func(self, *args, **kwargs)
+        except Exception:
+            metrics.increment('connector.errors', tags)
+            raise
+        finally:
+            metrics.timing('connector.time', time.time() - start, tags)
+    return wrapper
@@ -14,11 +14,21 @@
 #    under the License.
 #
 
-import copy
+import contextlib
+from xml.sax import saxutils
+
 from oslo.config import cfg
 
 from neutron.common import exceptions as neutron_exc
 from neutron.openstack.common import log as logging
+from neutron.services.l3_router.drivers.pan.connector import commit_scheduler
+from neutron.services.l3_router.drivers.pan.connector import config_cache
+from neutron.services.l3_router.drivers.pan.connector import job_poller
+from neutron.services.l3_router.drivers.pan.connector import metrics
+from neutron.services.l3_router.drivers.pan.connector import pool
+from neutron.services.l3_router.drivers.pan.connector import registry
+from neutron.services.l3_router.drivers.pan.connector import transaction
+from neutron.services.l3_router.drivers.pan.connector import uid_writer
 from neutron.services.l3_router.drivers.pan.connector.xml_api import commit
 from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
 
@@ -70,6 +80,117 @@ OPTS = [
         default=None,
         help=_("PAN device virtual router next hop ip address for default"
                " route.")),
+    cfg.IntOpt(
+        'pan_connection_pool_size',
+        default=4,
+        help=_("Maximum number of idle keep-alive connections kept per"
+               " PAN-OS host. 0 disables connection pooling.")),
+    cfg.IntOpt(
+        'pan_connection_idle_timeout',
+        default=60,
+        help=_("Seconds after which an idle pooled connection to PAN-OS is"
+               " closed.")),
+    cfg.IntOpt(
+        'pan_api_key_lifetime',
+        default=0,
+        help=_("Seconds an API key generated from pan_username and"
+               " pan_password is reused before a new one is generated."
+               " 0 reuses it until PAN-OS rejects it.")),
+    cfg.FloatOpt(
+        'pan_commit_window',
+        default=1.0,
+        help=_("Seconds during which commit requests for the same PAN"
+               " device are collected and served by a single commit."
+               " 0 commits immediately on every request.")),
+    cfg.BoolOpt(
+        'pan_commit_wait',
+        default=True,
+        help=_("Wait for PAN-OS commits to finish before returning from"
+               " router and port operations. When False, commit results"
+               " are only logged.")),
+    cfg.FloatOpt(
+        'pan_job_poll_interval',
+        default=0.5,
+        help=_("Initial delay in seconds between two status queries of a"
+               " PAN-OS job. The delay doubles after every query.")),
+    cfg.FloatOpt(
+        'pan_job_poll_max_interval',
+        default=10.0,
+        help=_("Maximum delay in seconds between two status queries of a"
+               " PAN-OS job.")),
+    cfg.IntOpt(
+        'pan_uid_batch_size',
+        default=500,
+        help=_("Maximum number of register/unregister entries sent in one"
+               " User-ID message.")),
+    cfg.FloatOpt(
+        'pan_uid_flush_interval',
+        default=1.0,
+        help=_("Seconds after which buffered User-ID updates are sent to"
+               " the device.")),
+    cfg.BoolOpt(
+        'pan_multi_config',
+        default=True,
+        help=_("Send the configuration changes of a connector operation as"
+               " a single multi-config request. Disabled automatically if"
+               " PAN-OS rejects multi-config requests.")),
+    cfg.IntOpt(
+        'pan_config_cache_ttl',
+        default=300,
+        help=_("Seconds the security zones, VLAN interfaces and virtual"
+               " router interfaces read from or written to a PAN device are"
+               " cached. 0 disables the cache.")),
+    cfg.IntOpt(
+        'pan_device_sync_interval',
+        default=300,
+        help=_("Seconds between two synchronizations of the PAN device pool"
+               " with the members of pan_device_group. 0 synchronizes only"
+               " when the pool has no free device left.")),
+    cfg.IntOpt(
+        'pan_reconcile_interval',
+        default=600,
+        help=_("Seconds between two checks of the reserved PAN devices"
+               " against the Neutron database; differences are repaired."
+               " 0 disables the checks.")),
+    cfg.IntOpt(
+        'pan_reconcile_workers',
+        default=4,
+        help=_("Number of PAN devices checked concurrently.")),
+    cfg.IntOpt(
+        'pan_reconcile_device_interval',
+        default=60,
+        help=_("Minimum seconds between two checks of the same PAN"
+               " device.")),
+    cfg.IntOpt(
+        'pan_fanout_workers',
+        default=16,
+        help=_("Maximum number of concurrent requests made when the same"
+               " operation is applied to several PAN devices.")),
+    cfg.IntOpt(
+        'pan_fanout_per_device',
+        default=1,
+        help=_("Maximum number of those concurrent requests made to the"
+               " same PAN device.")),
+    cfg.StrOpt(
+        'pan_metrics_backend',
+        default=metrics.NOOP,
+        choices=[metrics.NOOP, metrics.MEMORY, metrics.STATSD],
+        help=_("Where counters and timings of the PAN XML API requests,"
+               " connector operations and commits are reported: 'noop'"
+               " (disabled), 'memory' (kept in the server process) or"
+               " 'statsd'.")),
+    cfg.StrOpt(
+        'pan_statsd_host',
+        default='localhost',
+        help=_("statsd host the PAN metrics are sent to.")),
+    cfg.IntOpt(
+        'pan_statsd_port',
+        default=8125,
+        help=_("statsd UDP port the PAN metrics are sent to.")),
+    cfg.StrOpt(
+        'pan_statsd_prefix',
+        default='neutron.pan',
+        help=_("Prefix of the PAN metric names sent to statsd.")),
 ]
 cfg.CONF.register_opts(OPTS)
 LOG = logging.getLogger(__name__)
@@ -90,7 +211,8 @@ class PANConnector(object):
                 raise neutron_exc.InvalidConfigurationOption(
                     opt_name=opt_name, opt_value=opt_value)
 
-        self._params = {'hostname': cfg.CONF.pan_host}
+        self._params = {'hostname': cfg.CONF.pan_host,
+                        'keep_document': False}
 
         if 'pan_api_key' in opts:
             self._params['api_key'] = cfg.CONF.pan_api_key
@@ -101,6 +223,42 @@ class PANConnector(object):
         if cfg.CONF.pan_port:
             self._params['port'] = cfg.CONF.pan_port
 
+        self._metrics = metrics.get_backend(
+            cfg.CONF.pan_metrics_backend,
+            statsd_host=cfg.CONF.pan_statsd_host,
+            statsd_port=cfg.CONF.pan_statsd_port,
+            statsd_prefix=cfg.CONF.pan_statsd_prefix)
+        if self._metrics.enabled:
+            self._params['metrics'] = self._metrics
+
+        self._pool = None
+        if cfg.CONF.pan_connection_pool_size > 0:
+            self._pool = pool.HTTPConnectionPool(
+                maxsize=cfg.CONF.pan_connection_pool_size,
+                idle_timeout=cfg.CONF.pan_connection_idle_timeout)
+        self._registry = registry.ClientRegistry(
+            self._params,
+            pool=self._pool,
+            key_lifetime=cfg.CONF.pan_api_key_lifetime,
+            max_idle=cfg.CONF.pan_connection_pool_size)
+        self._job_poller = job_poller.JobPoller(
+            self._registry,
+            interval=cfg.CONF.pan_job_poll_interval,
+            max_interval=cfg.CONF.pan_job_poll_max_interval,
+            metrics=self._metrics)
+        self._commit_scheduler = None
+        if cfg.CONF.pan_commit_window > 0:
+            self._commit_scheduler = commit_scheduler.CommitScheduler(
+                self._commit, cfg.CONF.pan_commit_window)
+        self._uid_writer = uid_writer.UserIdWriter(
+            self._send_uid_message,
+            max_entries=cfg.CONF.pan_uid_batch_size,
+            flush_interval=cfg.CONF.pan_uid_flush_interval)
+        self._multi_config = cfg.CONF.pan_multi_config
+        self._config_cache = config_cache.ConfigCache(
+            cfg.CONF.pan_config_cache_ttl)
+
+    @metrics.instrumented
     def add_external_ip(self, device_sn, ip_dict):
         """Add ip address to the device external interface.
 
@@ -111,19 +269,19 @@ class PANConnector(object):
 
         @return: None
         """
-        params = copy.deepcopy(self._params)
-        params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
-        iface_name = 'ethernet1/1'
-        self._add_external_ip(xml_api, ip_dict)
-        self._set_router_iface(xml_api, iface_name)
-        if cfg.CONF.pan_dev_default_route_next_hop:
-            self._set_default_route(xml_api)
-        self._set_security_zone_iface(xml_api,
-                                      iface_name,
-                                      cfg.CONF.pan_dev_external_security_zone)
-        self._set_management_profile(xml_api, iface_name)
+        with self._transaction(device_sn) as xml_api:
+            iface_name = 'ethernet1/1'
+            self._add_external_ip(xml_api, ip_dict)
+            self._set_router_iface(xml_api, iface_name)
+            if cfg.CONF.pan_dev_default_route_next_hop:
+                self._set_default_route(xml_api)
+            self._set_security_zone_iface(
+                xml_api,
+                iface_name,
+                cfg.CONF.pan_dev_external_security_zone)
+            self._set_management_profile(xml_api, iface_name)
 
+    @metrics.instrumented
     def remove_external_ip(self, device_sn):
         """Remove ip address from the device external interface.
 
@@ -131,20 +289,19 @@ class PANConnector(object):
 
         @return: None
         """
-        params = copy.deepcopy(self._params)
-        params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
-        iface_name = 'ethernet1/1'
-        self._clear_router_iface(xml_api, iface_name)
-        if cfg.CONF.pan_dev_default_route_next_hop:
-            self._clear_default_route(xml_api)
-        self._clear_security_zone_iface(
-            xml_api,
-            iface_name,
-            cfg.CONF.pan_dev_external_security_zone)
-        self._clear_management_profile(xml_api, iface_name)
-        self._remove_external_ip(xml_api)
+        with self._transaction(device_sn) as xml_api:
+            iface_name = 'ethernet1/1'
+            self._clear_router_iface(xml_api, iface_name)
+            if cfg.CONF.pan_dev_default_route_next_hop:
+                self._clear_default_route(xml_api)
+            self._clear_security_zone_iface(
+                xml_api,
+                iface_name,
+                cfg.CONF.pan_dev_external_security_zone)
+            self._clear_management_profile(xml_api, iface_name)
+            self._remove_external_ip(xml_api)
 
+    @metrics.instrumented
     def add_external_nat(self, device_sn, ip_dict):
         """Add external NAT rule to allow internet access from Nova instances.
 
@@ -156,173 +313,175 @@ class PANConnector(object):
         @return: None
         """
         ip = ip_dict['ip_address'] + '/' + ip_dict['cidr'].split('/')[1]
-        params = copy.deepcopy(self._params)
-        params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
-
-        # If the source (internal) zone doesn't exist, create it
-        sz_xpath = ("/config/devices/entry[@name='localhost.localdomain']"
-                    "/vsys/entry[@name='vsys1']/zone/entry[@name='%s']"
-                    % cfg.CONF.pan_dev_internal_security_zone)
+        with self._transaction(device_sn) as xml_api:
+            # If the source (internal) zone doesn't exist, create it
+            self._ensure_security_zone(
+                xml_api, cfg.CONF.pan_dev_internal_security_zone)
+
+            xpath = ("/config/devices/entry[@name='localhost.localdomain']"
+                     "/vsys/entry[@name='vsys1']/rulebase/nat/rules")
+            element = (
+                "<entry name='OpenStack'>"
+                "<source-translation>"
+                "<dynamic-ip-and-port>"
+                "<interface-address>"
+                "<ip>%(ip)s</ip>"
+                "<interface>ethernet1/1</interface>"
+                "</interface-address>"
+                "</dynamic-ip-and-port>"
+                "</source-translation>"
+                "<to><member>%(destination_zone)s</member></to>"
+                "<from><member>%(source_zone)s</member></from>"
+                "<source><member>any</member></source>"
+                "<destination><member>any</member></destination>"
+                "<service>any</service>"
+                "<nat-type>ipv4</nat-type>"
+                "</entry>" %
+                {'ip': ip,
+                 'source_zone': cfg.CONF.pan_dev_internal_security_zone,
+                 'destination_zone': cfg.CONF.pan_dev_external_security_zone}
+            )
+            xml_api.set(xpath, element)
+
+    @metrics.instrumented
+    def remove_external_nat(self, device_sn):
+        """Remove external NAT rule to deny internet access for Nova instances.
 
-        try:
-            xml_api.show(sz_xpath)
-        except xapi.PanXapiError as e:
-            if e.msg.lower() == 'no such node':
-                element = "<network><layer3/></network>"
-                xml_api.set(sz_xpath, element)
-            else:
-                raise
+        @param device_sn: PAN device serial number
 
-        xpath = ("/config/devices/entry[@name='localhost.localdomain']/vsys"
-                 "/entry[@name='vsys1']/rulebase/nat/rules")
-        element = (
-            "<entry name='OpenStack'>"
-            "<source-translation>"
-            "<dynamic-ip-and-port>"
-            "<interface-address>"
-            "<ip>%(ip)s</ip>"
-            "<interface>ethernet1/1</interface>"
-            "</interface-address>"
-            "</dynamic-ip-and-port>"
-            "</source-translation>"
-            "<to><member>%(destination_zone)s</member></to>"
-            "<from><member>%(source_zone)s</member></from>"
-            "<source><member>any</member></source>"
-            "<destination><member>any</member></destination>"
-            "<service>any</service>"
-            "<nat-type>ipv4</nat-type>"
-            "</entry>" %
-            {'ip': ip,
-             'source_zone': cfg.CONF.pan_dev_internal_security_zone,
-             'destination_zone': cfg.CONF.pan_dev_external_security_zone}
-        )
-        xml_api.set(xpath, element)
+        @return: None
+        """
+        with self._transaction(device_sn) as xml_api:
+            xpath = ("/config/devices/entry[@name='localhost.localdomain']"
+                     "/vsys/entry[@name='vsys1']/rulebase/nat/rules"
+                     "/entry[@name='OpenStack']")
+            xml_api.delete(xpath)
 
-    def remove_external_nat(self, device_sn):
-        """Remove external NAT rule to deny internet access for Nova instances.
+    @metrics.instrumented
+    def register_ip_address(self, device_sn, ip_address, tags, flush=True):
+        """Register ip address with tags for dynamic address groups.
 
         @param device_sn: PAN device serial number
+        @param ip_address: ip address to register
+        @param tags: list of tags
+        @param flush: send the update now instead of buffering it
 
         @return: None
         """
-        params = copy.deepcopy(self._params)
-        params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
-        xpath = ("/config/devices/entry[@name='localhost.localdomain']/vsys"
-                 "/entry[@name='vsys1']/rulebase/nat/rules"
-                 "/entry[@name='OpenStack']")
-        xml_api.delete(xpath)
-
-    def register_ip_address(self, device_sn, ip_address, tags):
-        params = copy.deepcopy(self._params)
-        params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
-        xml_tags = ""
-        tags.sort()
-        for tag in tags:
-            xml_tag = "<member>%s</member>" % tag
-            xml_tags += xml_tag
-        cmd = ("<uid-message>"
-               "<version>2.0</version>"
-               "<type>update</type>"
-               "<payload>"
-               "<register>"
-               "<entry ip=\"%s\">"
-               "<tag>"
-               "%s"
-               "</tag>"
-               "</entry>"
-               "</register>"
-               "</payload>"
-               "</uid-message>" % (ip_address, xml_tags))
+        self._uid_writer.register(device_sn, ip_address, tags)
+        if flush:
+            self._uid_writer.flush(device_sn)
 
-        try:
-            xml_api.user_id(cmd)
-        except xapi.PanXapiError as e:
-            if 'already exists, ignore' in e.msg.lower():
-                pass
-            else:
-                raise
+    @metrics.instrumented
+    def unregister_ip_address(self, device_sn, ip_address, flush=True):
+        """Unregister ip address from dynamic address groups.
+
+        @param device_sn: PAN device serial number
+        @param ip_address: ip address to unregister
+        @param flush: send the update now instead of buffering it
+
+        @return: None
+        """
+        self._uid_writer.unregister(device_sn, ip_address)
+        if flush:
+            self._uid_writer.flush(device_sn)
 
-    def unregister_ip_address(self, device_sn, ip_address):
-        params = copy.deepcopy(self._params)
-        params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
+    @metrics.instrumented
+    def flush_user_id(self, device_sn=None):
+        """Send buffered User-ID updates.
 
-        cmd = ("<uid-message>"
-               "<version>2.0</version>"
-               "<type>update</type>"
-               "<payload>"
-               "<unregister>"
-               "<entry ip=\"%s\">"
-               "</entry>"
-               "</unregister>"
-               "</payload>"
-               "</uid-message>" % ip_address)
+        @param device_sn: PAN device serial number, all devices if None
 
-        xml_api.user_id(cmd)
+        @return: None
+        """
+        self._uid_writer.flush(device_sn)
 
+    @metrics.instrumented
     def list_devices(self):
         """Get list of PAN devices in specified (in the config file)
            device group.
 
         @return: list of devices serial numbers
         """
-        xml_api = xapi.PanXapi(**self._params)
-        return [item['name'] for item in self._list_group_devices(xml_api)]
+        with self._registry.client() as xml_api:
+            return self._list_group_devices(xml_api)
 
+    @metrics.instrumented
     def add_vlan_iface(self, device_sn, iface_dict):
         """Add VLAN interface to specified device.
 
         @param device_sn: PAN device serial number
         @param iface_dict: dict with VLAN interface info. Contains:
             - 'port_id': Neutron port id
+            - 'unit': ethernet1/2 unit number allocated for this port;
+              if missing, the unit after the existing ones is used
             - 'ip_address': ip address allocated for this interface
             - 'cidr': interface subnet in cidr notation
             - 'segmentation_id': vlan tag
 
         @return: None
         """
-        params = copy.deepcopy(self._params)
-        params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
-        vlan_ifaces = self._list_vlan_interfaces(xml_api)
+        with self._transaction(device_sn) as xml_api:
+            if 'unit' in iface_dict:
+                vlan_iface_name = "ethernet1/2.%d" % iface_dict['unit']
+                self._config_cache.discard(device_sn, 'vlan_units')
+            else:
+                vlan_ifaces = self._get_vlan_interfaces(xml_api)
 
-        device_cnt = len(vlan_ifaces)
-        vlan_iface_name = "ethernet1/2.%d" % (device_cnt + 1)
+                device_cnt = len(vlan_ifaces)
+                vlan_iface_name = "ethernet1/2.%d" % (device_cnt + 1)
 
-        self._add_vlan_iface(xml_api, vlan_iface_name, iface_dict)
-        self._set_router_iface(xml_api, vlan_iface_name)
-        self._set_security_zone_iface(xml_api,
-                                      vlan_iface_name,
-                                      cfg.CONF.pan_dev_internal_security_zone)
+                self._config_cache.put(
+                    device_sn, 'vlan_units',
+                    vlan_ifaces + [{'name': vlan_iface_name,
+                                    'comment': "port_id=%s"
+                                    % iface_dict['port_id']}])
+
+            self._add_vlan_iface(xml_api, vlan_iface_name, iface_dict)
+            self._set_router_iface(xml_api, vlan_iface_name)
+            self._set_security_zone_iface(
+                xml_api,
+                vlan_iface_name,
+                cfg.CONF.pan_dev_internal_security_zone)
 
+    @metrics.instrumented
     def remove_vlan_iface(self, device_sn, iface_dict):
         """Remove VLAN interface from specified device.
 
         @param device_sn: PAN device serial number
         @param iface_dict: dict with VLAN interface info. Contains:
             - 'port_id': Neutron port id
+            - 'unit': ethernet1/2 unit number allocated for this port;
+              if missing, the unit is looked up by port id
 
         @return: None
         """
-        params = copy.deepcopy(self._params)
-        params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
-        vlan_ifaces = self._list_vlan_interfaces(xml_api)
-
-        vlan_iface = next((item for item in vlan_ifaces
-                           if iface_dict['port_id'] in item["comment"]), None)
-
-        if vlan_iface:
-            self._clear_router_iface(xml_api, vlan_iface['name'])
+        with self._transaction(device_sn) as xml_api:
+            if 'unit' in iface_dict:
+                vlan_iface_name = "ethernet1/2.%d" % iface_dict['unit']
+                self._config_cache.discard(device_sn, 'vlan_units')
+            else:
+                vlan_ifaces = self._get_vlan_interfaces(xml_api)
+
+                vlan_iface = next((item for item in vlan_ifaces
+                                   if iface_dict['port_id']
+                                   in item["comment"]),
+                                  None)
+                if not vlan_iface:
+                    return
+                vlan_iface_name = vlan_iface['name']
+                self._config_cache.put(
+                    device_sn, 'vlan_units',
+                    [item for item in vlan_ifaces if item is not vlan_iface])
+
+            self._clear_router_iface(xml_api, vlan_iface_name)
             self._clear_security_zone_iface(
                 xml_api,
-                vlan_iface['name'],
+                vlan_iface_name,
                 cfg.CONF.pan_dev_internal_security_zone)
-            self._remove_vlan_iface(xml_api, vlan_iface['name'])
+            self._remove_vlan_iface(xml_api, vlan_iface_name)
 
+    @metrics.instrumented
     def add_device_tags(self, device_sn, tags):
         """Add tags to specified device.
 
@@ -331,10 +490,11 @@ class PANConnector(object):
 
         @return: None
         """
-        xml_api = xapi.PanXapi(**self._params)
-        for tag in tags:
-            self._add_device_tag(xml_api, device_sn, tag)
+        with self._transaction() as xml_api:
+            for tag in tags:
+                self._add_device_tag(xml_api, device_sn, tag)
 
+    @metrics.instrumented
     def remove_device_tags(self, device_sn, tags):
         """Remove tags from device.
 
@@ -343,24 +503,328 @@ class PANConnector(object):
 
         @return: None
         """
-        xml_api = xapi.PanXapi(**self._params)
-        for tag in tags:
-            self._remove_device_tag(xml_api, device_sn, tag)
+        with self._transaction() as xml_api:
+            for tag in tags:
+                self._remove_device_tag(xml_api, device_sn, tag)
 
-    def commit_configuration(self, device_sn=None):
+    @metrics.instrumented
+    def set_security_policy(self, device_sn, policy_dict):
+        """Replace the security rules managed by OpenStack on a device.
+
+        Rules whose name starts with the policy prefix are replaced by the
+        given ones, placed after any other rule, and unused prefixed
+        address and service objects are removed. Everything is sent in one
+        configuration request.
+
+        @param device_sn: PAN device serial number
+        @param policy_dict: dict with the policy. Contains:
+            - 'prefix': name prefix of the objects managed by OpenStack
+            - 'addresses': dict of address object name to ip/netmask
+            - 'services': dict of service object name to dict with
+              'protocol', 'source_port' and 'destination_port'
+            - 'rules': ordered list of dicts with 'name', 'action',
+              'enabled', 'source', 'destination', 'application',
+              'service' and 'description'; source, destination and
+              service are object names or 'any'
+
+        @return: None
+        """
+        with self._transaction(device_sn) as xml_api:
+            self._clear_security_objects(xml_api, policy_dict['prefix'],
+                                         policy_dict['addresses'],
+                                         policy_dict['services'])
+            self._set_security_objects(xml_api, policy_dict['addresses'],
+                                       policy_dict['services'])
+            if policy_dict['rules']:
+                xml_api.set(self._vsys_xpath('rulebase/security/rules'),
+                            ''.join(self._security_rule_element(rule)
+                                    for rule in policy_dict['rules']))
+
+    @metrics.instrumented
+    def update_security_policy(self, device_sn, old_policy_dict,
+                               policy_dict, rule_changes):
+        """Change only what differs from the policy applied last.
+
+        @param device_sn: PAN device serial number
+        @param old_policy_dict: policy applied last, see set_security_policy
+        @param policy_dict: policy to apply
+        @param rule_changes: ordered list of (action, name, rule, before)
+            turning the old rule list into the new one, as computed by
+            neutron.services.firewall.drivers.rule_diff.diff_rules(); action
+            is 'delete', 'update', 'insert' or 'move', and inserted or moved
+            rules go just before the rule named before, or last if None
+
+        @return: None
+        """
+        rules_xpath = self._vsys_xpath('rulebase/security/rules')
+        with self._transaction(device_sn) as xml_api:
+            # Objects are added before and removed after the rules using
+            # them.
+            self._set_security_objects(
+                xml_api,
+                dict((name, ip)
+                     for name, ip in policy_dict['addresses'].items()
+                     if old_policy_dict['addresses'].get(name) != ip),
+                dict((name, service)
+                     for name, service in policy_dict['services'].items()
+                     if old_policy_dict['services'].get(name) != service))
+
+            for action, name, rule, before in rule_changes:
+                entry_xpath = "%s/entry[@name='%s']" % (rules_xpath, name)
+                if action == 'delete':
+                    xml_api.delete(entry_xpath)
+                elif action == 'update':
+                    xml_api.edit(entry_xpath,
+                                 self._security_rule_element(rule))
+                else:
+                    if action == 'insert':
+                        xml_api.set(rules_xpath,
+                                    self._security_rule_element(rule))
+                    if before is not None:
+                        xml_api.move(entry_xpath, 'before', before)
+                    elif action == 'move':
+                        xml_api.move(entry_xpath, 'bottom')
+
+            for path, old, new in (
+                    ('address', old_policy_dict['addresses'],
+                     policy_dict['addresses']),
+                    ('service', old_policy_dict['services'],
+                     policy_dict['services'])):
+                for name in sorted(set(old) - set(new)):
+                    xml_api.delete("%s/entry[@name='%s']"
+                                   % (self._vsys_xpath(path), name))
+
+    @metrics.instrumented
+    def clear_security_policy(self, device_sn, prefix):
+        """Remove the security rules and objects managed by OpenStack.
+
+        @param device_sn: PAN device serial number
+        @param prefix: name prefix of the objects managed by OpenStack
+
+        @return: None
+        """
+        with self._transaction(device_sn) as xml_api:
+            self._clear_security_objects(xml_api, prefix, {}, {})
+
+    @metrics.instrumented
+    def get_device_state(self, device_sn):
+        """Read the part of a device configuration managed by Neutron.
+
+        The whole device configuration is read with one show request.
+
+        @param device_sn: PAN device serial number
+
+        @return: dict with:
+            - 'units': dict of ethernet1/2 unit number to dict with
+              'port_id' (None if the unit is not tagged with one),
+              'segmentation_id' and 'ip' (address/prefix length)
+            - 'external_ip': address/prefix length of ethernet1/1 or None
+            - 'nat_ip': address/prefix length of the OpenStack NAT rule, or
+              None if there is no such rule
+        """
+        with self._registry.client(device_sn) as xml_api:
+            xml_api.show("/config/devices/entry"
+                         "[@name='localhost.localdomain']")
+            entry = xml_api.element_result.find('entry')
+
+        units = {}
+        for unit in entry.findall("network/interface/ethernet"
+                                  "/entry[@name='ethernet1/2']/layer3/units"
+                                  "/entry"):
+            name = unit.get('name', '')
+            if not name.startswith('ethernet1/2.'):
+                continue
+            comment = unit.findtext('comment') or ''
+            tag = unit.findtext('tag')
+            ip = unit.find('ip/entry')
+            units[int(name.split('.', 1)[1])] = {
+                'port_id': (comment[len('port_id='):]
+                            if comment.startswith('port_id=') else None),
+                'segmentation_id': int(tag) if tag else None,
+                'ip': ip.get('name') if ip is not None else None}
+
+        external_ip = entry.find("network/interface/ethernet"
+                                 "/entry[@name='ethernet1/1']/layer3/ip"
+                                 "/entry")
+        nat = entry.find("vsys/entry[@name='vsys1']/rulebase/nat/rules"
+                         "/entry[@name='OpenStack']")
+        return {'units': units,
+                'external_ip': (external_ip.get('name')
+                                if external_ip is not None else None),
+                'nat_ip': (nat.findtext('source-translation'
+                                        '/dynamic-ip-and-port'
+                                        '/interface-address/ip')
+                           if nat is not None else None)}
+
+    @metrics.instrumented
+    def commit_configuration(self, device_sn=None, wait=True):
         """Commit candidate configuration to Panorama or specified device.
 
+        Commit requests for the same device made within pan_commit_window
+        seconds are served by a single commit.
+
         @param device_sn: PAN device serial number
+        @param wait: block until the commit is finished
+
+        @return: CommitFuture of the scheduled commit, JobHandle of the
+            commit job if commits are not coalesced, or None if there was
+            nothing to commit
+        """
+        if self._metrics.enabled:
+            self._metrics.increment('commit.requests',
+                                    (device_sn or 'panorama',))
+        if self._commit_scheduler is None:
+            future = self._start_commit(device_sn)
+        else:
+            future = self._commit_scheduler.schedule(device_sn)
+        if wait and future is not None:
+            future.wait()
+        return future
+
+    def invalidate_config_cache(self, device_sn=None):
+        """Forget the cached configuration of a device.
+
+        To be called when the device configuration was changed by other
+        means than this connector.
+
+        @param device_sn: PAN device serial number, all devices if None
 
         @return: None
         """
+        if device_sn is None:
+            self._config_cache.invalidate()
+        else:
+            self._config_cache.invalidate(device_sn)
+
+    @contextlib.contextmanager
+    def _transaction(self, device_sn=None):
+        # Changes are only sent if the whole operation was prepared
+        # without error.
+        with self._registry.client(device_sn) as xml_api:
+            txn = transaction.ConfigTransaction(
+                xml_api, multi_config=self._multi_config)
+            try:
+                yield txn
+                txn.send()
+            except Exception:
+                # The cache may have been updated with changes that were
+                # not applied.
+                self._config_cache.invalidate(device_sn)
+                raise
+            finally:
+                self._multi_config = (self._multi_config and
+                                      txn.multi_config)
+
+    def _send_uid_message(self, device_sn, cmd):
+        with self._registry.client(device_sn) as xml_api:
+            try:
+                xml_api.user_id(cmd)
+            except xapi.PanXapiError as e:
+                lines = (e.msg or '').lower().splitlines()
+                if not lines or not all('already exists, ignore' in line
+                                        for line in lines):
+                    raise
+
+    def _commit(self, device_sn):
+        handle = self._start_commit(device_sn)
+        if handle is not None:
+            handle.wait()
+
+    def _start_commit(self, device_sn):
         c = commit.PanCommit()
-        params = copy.deepcopy(self._params)
-        params['use_get'] = True
-        if device_sn:
-            params['serial'] = device_sn
-        xml_api = xapi.PanXapi(**params)
-        xml_api.commit(cmd=c.cmd(), sync=True)
+        with self._registry.client(device_sn, use_get=True) as xml_api:
+            job_id = xml_api.commit(cmd=c.cmd())
+        if job_id is None:
+            return None
+        if self._metrics.enabled:
+            self._metrics.increment('commit.jobs',
+                                    (device_sn or 'panorama',))
+        handle = self._job_poller.track(device_sn, job_id)
+        handle.add_done_callback(self._log_commit_result)
+        return handle
+
+    def _log_commit_result(self, handle):
+        device = handle.device_sn or 'Panorama'
+        if handle.exception is not None:
+            LOG.error(_('Commit job %(job)s on %(device)s failed: %(err)s'),
+                      {'job': handle.job_id, 'device': device,
+                       'err': handle.exception})
+        else:
+            LOG.debug(_('Commit job %(job)s on %(device)s finished'),
+                      {'job': handle.job_id, 'device': device})
+
+    def _vsys_xpath(self, path):
+        return ("/config/devices/entry[@name='localhost.localdomain']"
+                "/vsys/entry[@name='vsys1']/%s" % path)
+
+    def _list_entry_names(self, api, xpath, prefix):
+        try:
+            return [entry.get('name') for entry in api.iter_show(xpath)
+                    if entry.get('name', '').startswith(prefix)]
+        except xapi.PanXapiError as e:
+            if e.msg.lower() == 'no such node':
+                return []
+            raise
+
+    def _clear_security_objects(self, api, prefix, addresses, services):
+        # Rules go first: PAN-OS refuses to delete objects still in use.
+        rules_xpath = self._vsys_xpath('rulebase/security/rules')
+        for name in self._list_entry_names(api, rules_xpath, prefix):
+            api.delete("%s/entry[@name='%s']" % (rules_xpath, name))
+        for path, keep in (('address', addresses), ('service', services)):
+            xpath = self._vsys_xpath(path)
+            for name in self._list_entry_names(api, xpath, prefix):
+                if name not in keep:
+                    api.delete("%s/entry[@name='%s']" % (xpath, name))
+
+    def _set_security_objects(self, api, addresses, services):
+        if addresses:
+            api.set(self._vsys_xpath('address'), ''.join(
+                "<entry name='%s'><ip-netmask>%s</ip-netmask></entry>"
+                % (name, ip) for name, ip in sorted(addresses.items())))
+        if services:
+            api.set(self._vsys_xpath('service'), ''.join(
+                self._service_element(name, service)
+                for name, service in sorted(services.items())))
+
+    def _service_element(self, name, service):
+        ports = "<port>%s</port>" % (service['destination_port'] or
+                                     '0-65535')
+        if service['source_port']:
+            ports += "<source-port>%s</source-port>" % service['source_port']
+        return ("<entry name='%(name)s'><protocol><%(proto)s>%(ports)s"
+                "</%(proto)s></protocol></entry>"
+                % {'name': name, 'proto': service['protocol'],
+                   'ports': ports})
+
+    def _security_rule_element(self, rule):
+        zones = [cfg.CONF.pan_dev_internal_security_zone]
+        if cfg.CONF.pan_dev_external_security_zone not in zones:
+            zones.append(cfg.CONF.pan_dev_external_security_zone)
+        zones = ''.join("<member>%s</member>" % zone for zone in zones)
+        element = (
+            "<entry name='%(name)s'>"
+            "<from>%(zones)s</from>"
+            "<to>%(zones)s</to>"
+            "<source><member>%(source)s</member></source>"
+            "<destination><member>%(destination)s</member></destination>"
+            "<source-user><member>any</member></source-user>"
+            "<application><member>%(application)s</member></application>"
+            "<service><member>%(service)s</member></service>"
+            "<action>%(action)s</action>"
+            "<disabled>%(disabled)s</disabled>"
+            % {'name': rule['name'],
+               'zones': zones,
+               'source': rule['source'],
+               'destination': rule['destination'],
+               'application': rule['application'],
+               'service': rule['service'],
+               'action': rule['action'],
+               'disabled': 'no' if rule['enabled'] else 'yes'})
+        if rule.get('description'):
+            element += ("<description>%s</description>"
+                        % saxutils.escape(rule['description']))
+        return element + "</entry>"
 
     def _add_device_tag(self, api, device_sn, tag):
         xpath = "/config/mgt-config/devices"
@@ -383,10 +847,9 @@ class PANConnector(object):
         xpath = ("/config/devices/entry[@name='localhost.localdomain']"
                  "/device-group/entry[@name='%s']/devices"
                  % cfg.CONF.pan_device_group)
-        api.show(xpath)
-        result = api.xml_python()
-
-        return result['response']['result']['devices']['entry']
+        # A Panorama device group may hold thousands of devices; only
+        # their names are needed.
+        return [entry.get('name') for entry in api.iter_show(xpath)]
 
     def _get_device(self, api, device_sn):
         xpath = ("/config/mgt-config/devices/entry[@name='%s']" % device_sn)
@@ -394,6 +857,20 @@ class PANConnector(object):
         result = api.xml_python()
         return result['response']['result']['entry']
 
+    def _get_vlan_interfaces(self, api):
+        device_sn = self._target(api)
+        vlan_ifaces = self._config_cache.get(device_sn, 'vlan_units')
+        if vlan_ifaces is config_cache.MISSING:
+            vlan_ifaces = self._list_vlan_interfaces(api)
+            if isinstance(vlan_ifaces, dict):
+                vlan_ifaces = [vlan_ifaces]
+            self._config_cache.put(device_sn, 'vlan_units', vlan_ifaces)
+        return list(vlan_ifaces)
+
+    def _target(self, api):
+        # Serial number of the device the client sends requests to
+        return getattr(api, 'serial', None)
+
     def _list_vlan_interfaces(self, api):
         xpath = ("/config/devices/entry[@name='localhost.localdomain']"
                  "/network/interface/ethernet/entry[@name='ethernet1/2']"
@@ -443,11 +920,15 @@ class PANConnector(object):
         api.delete(xpath)
 
     def _set_router_iface(self, api, iface_name):
+        key = ('router_iface', iface_name)
+        if self._config_cache.get(self._target(api), key) is True:
+            return
         xpath = ("/config/devices/entry[@name='localhost.localdomain']"
                  "/network/virtual-router/entry[@name='%s']/"
                  "interface" % cfg.CONF.pan_dev_router)
         element = "<member>%s</member>" % iface_name
         api.set(xpath, element)
+        self._config_cache.put(self._target(api), key, True)
 
     def _clear_router_iface(self, api, iface_name):
         xpath = ("/config/devices/entry[@name='localhost.localdomain']"
@@ -456,8 +937,14 @@ class PANConnector(object):
                  % {'router': cfg.CONF.pan_dev_router,
                     'iface': iface_name})
         api.delete(xpath)
+        self._config_cache.discard(self._target(api),
+                                   ('router_iface', iface_name))
+
+    def _ensure_security_zone(self, api, zone_name):
+        key = ('zone', zone_name)
+        if self._config_cache.get(self._target(api), key) is True:
+            return
 
-    def _set_security_zone_iface(self, api, iface_name, zone_name):
         sz_xpath = ("/config/devices/entry[@name='localhost.localdomain']"
                     "/vsys/entry[@name='vsys1']/zone/entry[@name='%s']"
                     % zone_name)
@@ -470,6 +957,10 @@ class PANConnector(object):
                 api.set(sz_xpath, element)
             else:
                 raise
+        self._config_cache.put(self._target(api), key, True)
+
+    def _set_security_zone_iface(self, api, iface_name, zone_name):
+        self._ensure_security_zone(api, zone_name)
 
         xpath = ("/config/devices/entry[@name='localhost.localdomain']"
                  "/vsys/entry[@name='vsys1']/zone/entry[@name='%s']"
@@ -0,0 +1,234 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Keep-alive HTTP(S) connection pool for the PAN XML API.
+
+urllib2.urlopen() opens a new TCP connection (and TLS session) for every
+request. HTTPConnectionPool keeps idle connections per (scheme, host, port)
+so consecutive XML API calls made by PANConnector reuse the same socket.
+"""
+
+import httplib
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+def _is_idempotent(query, body):
+    # Whether an XML API request only reads, so can be sent again
+    params = urlparse.parse_qs(query or '')
+    params.update(urlparse.parse_qs(body or ''))
+    req_type = params.get('type', [None])[0]
+    if req_type == 'keygen':
+        return True
+    if req_type == 'config':
+        return params.get('action', [None])[0] in ('show', 'get')
+    if req_type == 'op':
+        return params.get('cmd', [''])[0].lstrip().startswith('<show>')
+    return False
+
+
+class PooledResponse(object):
+    """Fully read HTTP response detached from its (reusable) connection."""
+
+    def __init__(self, response, body):
+        self.status = response.status
+        self.reason = response.reason
+        self.msg = response.msg
+        self._body = body
+
+    def read(self):
+        return self._body
+
+    def getheader(self, name, default=None):
+        return self.msg.getheader(name, default)
+
+    def info(self):
+        return self.msg
+
+
+class StreamingResponse(object):
+    """HTTP response read incrementally from a pooled connection.
+
+    The connection goes back to the pool once the body was read to the end,
+    and is closed if the response is closed before that.
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self.status = response.status
+        self.reason = response.reason
+        self.msg = response.msg
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    def read(self, amt=None):
+        if self._conn is None:
+            return ''
+        data = self._response.read(amt)
+        if amt is None or self._response.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool.release(self._key, conn)
+        else:
+            self._response.close()
+            conn.close()
+
+    def getheader(self, name, default=None):
+        return self.msg.getheader(name, default)
+
+    def info(self):
+        return self.msg
+
+
+class HTTPConnectionPool(object):
+    """Per-host pool of persistent HTTP(S) connections.
+
+    At most `maxsize` idle connections are kept for each host; connections
+    unused for more than `idle_timeout` seconds are closed when the pool is
+    next accessed for that host. Concurrent callers never block: when no idle
+    connection is available a new one is opened, and surplus connections are
+    closed on release.
+    """
+
+    def __init__(self, maxsize=4, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, key, timeout):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn_cls = httplib.HTTPSConnection
+        else:
+            conn_cls = httplib.HTTPConnection
+        LOG.debug(_('Opening new %(scheme)s connection to %(host)s:%(port)s'),
+                  {'scheme': scheme, 'host': host, 'port': port})
+        return conn_cls(host, port, timeout=timeout)
+
+    def _evict(self, key, now):
+        idle = self._idle.get(key, [])
+        alive = []
+        for conn, last_used in idle:
+            if now - last_used > self.idle_timeout:
+                conn.close()
+            else:
+                alive.append((conn, last_used))
+        self._idle[key] = alive
+        return alive
+
+    def acquire(self, key, timeout=None):
+        """Return an idle connection for key, or a new one.
+
+        @param key: tuple (scheme, host, port)
+        @param timeout: socket timeout for newly opened connections
+
+        @return: tuple (connection, reused)
+        """
+        with self._lock:
+            idle = self._evict(key, time.time())
+            if idle:
+                conn, _last_used = idle.pop()
+                return conn, True
+        return self._new_connection(key, timeout), False
+
+    def release(self, key, conn):
+        """Return a connection to the pool, closing it if the pool is full."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _last_used in idle:
+                    conn.close()
+            self._idle = {}
+
+    def urlopen(self, request, timeout=None, stream=False):
+        """Send a urllib2.Request over a pooled connection.
+
+        Raises the same urllib2.HTTPError / urllib2.URLError exceptions as
+        urllib2.urlopen() so callers can handle both paths alike.
+
+        @param stream: return a StreamingResponse instead of reading the
+            whole body; the caller must read it to the end or close it
+        """
+        url = urlparse.urlsplit(request.get_full_url())
+        key = (url.scheme, url.hostname, url.port)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        headers = dict(request.header_items())
+        body = request.get_data()
+        if body is not None:
+            headers.setdefault('Content-Type',
+                               'application/x-www-form-urlencoded')
+
+        while True:
+            conn, reused = self.acquire(key, timeout)
+            sent = False
+            try:
+                conn.request(request.get_method(), path, body, headers)
+                sent = True
+                response = conn.getresponse()
+                if not stream or response.status >= 400:
+                    data = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                conn.close()
+                # The peer may have closed an idle keep-alive connection;
+                # retry on a fresh one, unless the peer may have received
+                # a request that must not be applied twice.
+                if reused and (not sent or
+                               _is_idempotent(url.query, body)):
+                    LOG.debug(_('Stale pooled connection to %(host)s: '
+                                '%(err)s'), {'host': key[1], 'err': e})
+                    continue
+                raise urllib2.URLError(e)
+            break
+
+        if stream and response.status < 400:
+            return StreamingResponse(self, key, conn, response)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.release(key, conn)
+
+        result = PooledResponse(response, data)
+        if result.status >= 400:
+            raise urllib2.HTTPError(request.get_full_url(), result.status,
+                                    result.reason, result.msg, None)
+        return result
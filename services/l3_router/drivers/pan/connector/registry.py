@@ -0,0 +1,161 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Registry of reusable PanXapi clients and cached API keys.
+
+A PanXapi client configured with a username and password calls keygen()
+before its first request. The registry keeps generated keys per
+(host, serial) so that only the first client for a target pays for the
+extra round trip, and hands out idle clients instead of building new ones.
+"""
+
+import contextlib
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+
+LOG = logging.getLogger(__name__)
+
+# PanXapi methods which send a request authenticated with the API key
+_KEYED_METHODS = frozenset(['ad_hoc', 'show', 'get', 'delete', 'set',
+                            'edit', 'multi_config', 'move', 'rename',
+                            'clone', 'user_id', 'commit', 'op', 'export',
+                            'log', 'iter_show', 'iter_get', 'iter_log',
+                            'job_status'])
+
+
+def is_auth_error(api, error):
+    """Check if a PanXapiError was caused by an invalid or expired key."""
+    if getattr(api, 'status_code', None) == '403':
+        return True
+    msg = (error.msg or '').lower()
+    return 'code: 403' in msg or 'invalid credential' in msg
+
+
+class RegisteredClient(object):
+    """PanXapi proxy that regenerates the API key after an auth failure."""
+
+    def __init__(self, registry, target, api):
+        self._registry = registry
+        self._target = target
+        self._api = api
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if name not in _KEYED_METHODS:
+            return attr
+
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except xapi.PanXapiError as e:
+                if (not self._registry.can_keygen or
+                        not is_auth_error(self._api, e)):
+                    raise
+                LOG.info(_('PAN-OS API key for %(target)s rejected, '
+                           'generating a new one'), {'target': self._target})
+                self._registry.invalidate_key(self._target)
+                self._api.api_key = None
+                return attr(*args, **kwargs)
+        return call
+
+
+class ClientRegistry(object):
+    """Hand out PanXapi clients keyed by (host, serial).
+
+    @param params: PanXapi keyword arguments shared by all clients
+    @param pool: optional HTTPConnectionPool used by all clients
+    @param key_lifetime: seconds a generated API key is reused; 0 means
+        until PAN-OS rejects it
+    @param max_idle: maximum number of idle clients kept per target
+    """
+
+    def __init__(self, params, pool=None, key_lifetime=0, max_idle=4):
+        self._params = params
+        self._pool = pool
+        self._key_lifetime = key_lifetime
+        self._max_idle = max(max_idle, 1)
+        self._keys = {}
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @property
+    def can_keygen(self):
+        return 'api_key' not in self._params
+
+    def _target(self, serial):
+        return (self._params['hostname'], serial)
+
+    def get_key(self, target):
+        with self._lock:
+            entry = self._keys.get(target)
+            if entry is None:
+                return None
+            key, expires = entry
+            if expires is not None and time.time() > expires:
+                del self._keys[target]
+                return None
+            return key
+
+    def set_key(self, target, key):
+        expires = None
+        if self._key_lifetime:
+            expires = time.time() + self._key_lifetime
+        with self._lock:
+            self._keys[target] = (key, expires)
+
+    def invalidate_key(self, target):
+        with self._lock:
+            self._keys.pop(target, None)
+
+    def _checkout(self, target, use_get):
+        with self._lock:
+            idle = self._idle.get(target + (use_get,))
+            if idle:
+                return idle.pop()
+
+        params = dict(self._params)
+        if use_get:
+            params['use_get'] = True
+        if target[1]:
+            params['serial'] = target[1]
+        return xapi.PanXapi(pool=self._pool, **params)
+
+    def _checkin(self, target, use_get, api):
+        with self._lock:
+            idle = self._idle.setdefault(target + (use_get,), [])
+            if len(idle) < self._max_idle:
+                idle.append(api)
+
+    @contextlib.contextmanager
+    def client(self, serial=None, use_get=False):
+        """Borrow a client for the given device serial (None: Panorama).
+
+        The client must not be used outside of the with block.
+        """
+        target = self._target(serial)
+        api = self._checkout(target, use_get)
+        if self.can_keygen:
+            api.api_key = self.get_key(target)
+        try:
+            yield RegisteredClient(self, target, api)
+        finally:
+            if self.can_keygen and api.api_key:
+                if api.api_key != self.get_key(target):
+                    self.set_key(target, api.api_key)
+            self._checkin(target, use_get, api)
@@ -0,0 +1,135 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Batching of PAN-OS configuration changes.
+
+A connector operation is made of several set/edit/delete/move calls on
+different xpaths. ConfigTransaction records them and sends them as a
+single type=config&action=multi-config request, which PAN-OS applies
+atomically. Read calls (show, get, xml_python, ...) go straight to the
+wrapped client.
+"""
+
+import re
+from xml.sax import saxutils
+
+from neutron.openstack.common import log as logging
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+
+LOG = logging.getLogger(__name__)
+
+SET = 'set'
+EDIT = 'edit'
+DELETE = 'delete'
+MOVE = 'move'
+
+# Errors of targets that do not know the multi-config action
+_UNSUPPORTED = re.compile(r'\b(unknown|invalid|unsupported)( config| request)?'
+                          r' (action|type)\b', re.IGNORECASE)
+
+
+def build_multi_config(ops):
+    """Build a multi-configure-request from (action, xpath, element)s.
+
+    A move is given as (MOVE, xpath, (where, dst)); dst may be None.
+    """
+    requests = []
+    for i, (action, xpath, element) in enumerate(ops, 1):
+        attrs = "id=\"%d\" xpath=%s" % (i, saxutils.quoteattr(xpath))
+        if action == MOVE:
+            where, dst = element
+            attrs += " where=%s" % saxutils.quoteattr(where)
+            if dst is not None:
+                attrs += " dst=%s" % saxutils.quoteattr(dst)
+            element = None
+        if element is None:
+            requests.append("<%s %s/>" % (action, attrs))
+        else:
+            requests.append("<%s %s>%s</%s>"
+                            % (action, attrs, element, action))
+    return ("<multi-configure-request>%s</multi-configure-request>"
+            % ''.join(requests))
+
+
+class ConfigTransaction(object):
+    """Record configuration changes made through a PanXapi client.
+
+    @param api: PanXapi client (or registry proxy) to send the changes with
+    @param multi_config: send several changes as one multi-config request;
+        if False, or if the target rejects multi-config, they are sent one
+        by one in the order they were made
+    """
+
+    def __init__(self, api, multi_config=True):
+        self._api = api
+        self.multi_config = multi_config
+        self._ops = []
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    def set(self, xpath=None, element=None):
+        self._ops.append((SET, xpath, element))
+
+    def edit(self, xpath=None, element=None):
+        self._ops.append((EDIT, xpath, element))
+
+    def delete(self, xpath=None):
+        self._ops.append((DELETE, xpath, None))
+
+    def move(self, xpath=None, where=None, dst=None):
+        self._ops.append((MOVE, xpath, (where, dst)))
+
+    def pending(self):
+        return len(self._ops)
+
+    def send(self):
+        """Send the recorded changes.
+
+        @return: None
+        """
+        ops, self._ops = self._ops, []
+        if not ops:
+            return
+        if len(ops) == 1 or not self.multi_config:
+            self._replay(ops)
+            return
+
+        try:
+            self._api.multi_config(build_multi_config(ops))
+        except xapi.PanXapiError as e:
+            # Any other error may come from one of the changes, or from a
+            # request the target may have applied: sending the changes
+            # one by one would not be atomic, or would apply them twice.
+            if not _UNSUPPORTED.search(str(e)):
+                raise
+            # The target rejected the action itself, so nothing was
+            # changed and the changes can safely be sent one by one.
+            LOG.debug(_('multi-config request failed (%s), sending changes'
+                        ' one by one'), e)
+            self._replay(ops)
+            LOG.warning(_('Target accepts the changes but not multi-config'
+                          ' requests; no longer batching them'))
+            self.multi_config = False
+
+    def _replay(self, ops):
+        for action, xpath, element in ops:
+            if action == DELETE:
+                self._api.delete(xpath)
+            elif action == MOVE:
+                self._api.move(xpath, *element)
+            else:
+                getattr(self._api, action)(xpath, element)
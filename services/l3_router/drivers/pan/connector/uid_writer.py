@@ -0,0 +1,130 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Buffered writer for PAN-OS User-ID register/unregister messages.
+
+A single <uid-message> can carry any number of register and unregister
+entries. UserIdWriter buffers entries per device and sends them as one
+message when the buffer is flushed explicitly, reaches max_entries, or
+has been pending for flush_interval seconds.
+"""
+
+import collections
+
+import eventlet
+
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+REGISTER = 'register'
+UNREGISTER = 'unregister'
+
+
+def build_uid_message(entries):
+    """Build a uid-message for an ordered mapping ip -> (action, tags)."""
+    register = []
+    unregister = []
+    for ip, (action, tags) in entries.iteritems():
+        if action == REGISTER:
+            members = ''.join("<member>%s</member>" % tag
+                              for tag in sorted(tags))
+            register.append("<entry ip=\"%s\"><tag>%s</tag></entry>"
+                            % (ip, members))
+        else:
+            unregister.append("<entry ip=\"%s\"></entry>" % ip)
+
+    payload = ''
+    if register:
+        payload += "<register>%s</register>" % ''.join(register)
+    if unregister:
+        payload += "<unregister>%s</unregister>" % ''.join(unregister)
+
+    return ("<uid-message>"
+            "<version>2.0</version>"
+            "<type>update</type>"
+            "<payload>%s</payload>"
+            "</uid-message>" % payload)
+
+
+class UserIdWriter(object):
+    """Merge User-ID updates per device into as few messages as possible.
+
+    @param send_func: callable(device_sn, cmd) sending one uid-message
+    @param max_entries: flush a device buffer once it holds this many entries
+    @param flush_interval: seconds after which a non-empty buffer is flushed
+        in the background; 0 disables timed flushes
+    """
+
+    def __init__(self, send_func, max_entries=500, flush_interval=1.0):
+        self._send_func = send_func
+        self._max_entries = max_entries
+        self._flush_interval = flush_interval
+        self._buffers = {}
+
+    def register(self, device_sn, ip_address, tags):
+        self._add(device_sn, ip_address, REGISTER, tags)
+
+    def unregister(self, device_sn, ip_address):
+        self._add(device_sn, ip_address, UNREGISTER, None)
+
+    def pending(self, device_sn):
+        return len(self._buffers.get(device_sn, ()))
+
+    def _add(self, device_sn, ip_address, action, tags):
+        entries = self._buffers.get(device_sn)
+        if entries is not None and ip_address in entries:
+            pending_action, pending_tags = entries[ip_address]
+            if pending_action != action:
+                # PAN-OS gives no ordering guarantee between register and
+                # unregister entries of one message.
+                self.flush(device_sn)
+                entries = None
+            elif action == REGISTER:
+                tags = set(tags) | pending_tags
+
+        if entries is None:
+            entries = self._buffers.setdefault(device_sn,
+                                               collections.OrderedDict())
+        if not entries and self._flush_interval > 0:
+            eventlet.spawn_after(self._flush_interval,
+                                 self._timed_flush, device_sn)
+
+        entries[ip_address] = (action, set(tags) if tags else None)
+        if len(entries) >= self._max_entries:
+            self.flush(device_sn)
+
+    def _timed_flush(self, device_sn):
+        try:
+            self.flush(device_sn)
+        except Exception:
+            LOG.exception(_('Failed to send User-ID updates to %s'),
+                          device_sn)
+
+    def flush(self, device_sn=None):
+        """Send buffered entries of device_sn, or of all devices if None."""
+        if device_sn is None:
+            devices = self._buffers.keys()
+        else:
+            devices = [device_sn]
+
+        for device in devices:
+            entries = self._buffers.pop(device, None)
+            if not entries:
+                continue
+            LOG.debug(_('Sending %(count)d User-ID update(s) to %(device)s'),
+                      {'count': len(entries), 'device': device})
+            self._send_func(device, build_uid_message(entries))
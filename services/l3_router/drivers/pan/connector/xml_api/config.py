@@ -16,6 +16,7 @@
 # @author: Kevin Steves, kevin.steves@pobox.com
 
 from __future__ import print_function
+import logging as std_logging
 import sys
 import xml.etree.ElementTree as etree
 #import lxml.etree as etree
@@ -45,6 +46,10 @@ class PanConfig:
         self._config_version = 0  # 0 indicates not yet set
         self._config_panorama = None
         self._config_multi_vsys = None
+        self._tags_forcelist = tags_forcelist
+        # Per-element debug messages cost more than the conversion itself
+        # on large configs, so they are only built when they are logged.
+        self._debug = LOG.isEnabledFor(std_logging.DEBUG)
 
         LOG.debug(_('Python version: %s'), sys.version)
         LOG.debug(_('xml.etree.ElementTree version: %s'), etree.VERSION)
@@ -155,66 +160,71 @@ class PanConfig:
 
         return d
 
-    def __serialize_py(self, elem, obj, forcelist=False):
-        tag = elem.tag
-        text = elem.text
-        text_strip = None
-        if text:
-            text_strip = text.strip()
-        attrs = elem.items()
-
-        LOG.debug(_('TAG(forcelist=%(forcelist)s): "%(tag)s"'),
-                  {'forcelist': forcelist,
-                   'tag': tag})
-
-        if forcelist:
-            if tag not in obj:
-                obj[tag] = []
-            if not len(elem) and not text_strip and not attrs:
-                obj[tag].append(None)
-                return
-            if not len(elem) and text_strip and not attrs:
-                obj[tag].append(text)
-                return
-
-            obj[tag].append({})
-            o = obj[tag][-1]
-
-        else:
-            if not len(elem) and not text_strip and not attrs:
-                obj[tag] = None
-                return
-            if not len(elem) and text_strip and not attrs:
-                if text_strip == 'yes':
-                    obj[tag] = True
+    def __serialize_py(self, root, obj):
+        # Iterative depth-first walk: configs can be deep enough for
+        # recursion to cost more than the conversion. Every stack item is
+        # (element, parent dict, whether the element is put in a list).
+        tags_forcelist = self._tags_forcelist
+        debug = self._debug
+        stack = [(root, obj, False)]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            elem, obj, forcelist = pop()
+            tag = elem.tag
+            text = elem.text
+            text_strip = text.strip() if text else None
+            attrs = elem.attrib
+            nchildren = len(elem)
+
+            if debug:
+                LOG.debug(_('TAG(forcelist=%(forcelist)s): "%(tag)s"'),
+                          {'forcelist': forcelist,
+                           'tag': tag})
+
+            if not nchildren and not attrs:
+                if not text_strip:
+                    value = None
+                elif forcelist:
+                    value = text
+                elif text_strip == 'yes':
+                    value = True
                 elif text_strip == 'no':
-                    obj[tag] = False
+                    value = False
                 else:
-                    obj[tag] = text
-                return
-
-            obj[tag] = {}
-            o = obj[tag]
-
-        for k, v in attrs:
-#            o['@' + k] = v
-            o[k] = v
-
-        if text_strip:
-            o[tag] = text
-
-        if len(elem):
-            tags = {}
-            for e in elem:
-                if e.tag in tags:
-                    tags[e.tag] += 1
+                    value = text
+                if forcelist:
+                    if tag not in obj:
+                        obj[tag] = []
+                    obj[tag].append(value)
                 else:
-                    tags[e.tag] = 1
-            for e in elem:
-                forcelist = False
-                if e.tag in _tags_forcelist or tags[e.tag] > 1:
-                    forcelist = True
-                self.__serialize_py(e, o, forcelist)
+                    obj[tag] = value
+                continue
+
+            o = dict(attrs)
+            if text_strip:
+                o[tag] = text
+            if forcelist:
+                if tag not in obj:
+                    obj[tag] = []
+                obj[tag].append(o)
+            else:
+                obj[tag] = o
+
+            if nchildren:
+                children = list(elem)
+                if nchildren == 1:
+                    child = children[0]
+                    push((child, o, child.tag in tags_forcelist))
+                    continue
+                counts = {}
+                for e in children:
+                    counts[e.tag] = counts.get(e.tag, 0) + 1
+                # Pushed in reverse so siblings are appended to their
+                # lists in document order.
+                for e in reversed(children):
+                    push((e, o, e.tag in tags_forcelist or counts[e.tag] > 1))
 
     def flat(self, path, xpath=None):
         nodes = self.__find_xpath(xpath)
@@ -235,13 +245,13 @@ class PanConfig:
             text_strip = text.strip()
         attrs = elem.items()
 
-        LOG.debug(_('TAG(elem=%(index)d): "%(tag)s"'),
-                  {'index': len(elem),
-                   'tag': tag})
-        LOG.debug(_('text_strip: "%s"'), text_strip)
-        LOG.debug(_('attrs: %s'), attrs)
-        LOG.debug(_('path: "%s"'), path)
-        LOG.debug(_('obj: %s'), obj)
+        if self._debug:
+            LOG.debug(_('TAG(elem=%(index)d): "%(tag)s"'),
+                      {'index': len(elem),
+                       'tag': tag})
+            LOG.debug(_('text_strip: "%s"'), text_strip)
+            LOG.debug(_('attrs: %s'), attrs)
+            LOG.debug(_('path: "%s"'), path)
 
         if not text_strip:
             obj.append(path)
@@ -290,15 +300,15 @@ class PanConfig:
             text_strip = text.strip()
         attrs = elem.items()
 
-        LOG.debug(_('TAG(elem=%(index)d member_list=%(member_list)s): '
-                    '"%(tag)s"'),
-                  {'index': len(elem),
-                   'member_list': member_list,
-                   'tag': tag})
-        LOG.debug(_('text_strip: "%s"'), text_strip)
-        LOG.debug(_('attrs: %s'), attrs)
-        LOG.debug(_('path: "%s"'), path)
-        LOG.debug(_('obj: %s'), obj)
+        if self._debug:
+            LOG.debug(_('TAG(elem=%(index)d member_list=%(member_list)s): '
+                        '"%(tag)s"'),
+                      {'index': len(elem),
+                       'member_list': member_list,
+                       'tag': tag})
+            LOG.debug(_('text_strip: "%s"'), text_strip)
+            LOG.debug(_('attrs: %s'), attrs)
+            LOG.debug(_('path: "%s"'), path)
 
         for k, v in attrs:
             if k == 'name':
@@ -306,9 +316,10 @@ class PanConfig:
 
         if member_list:
             nodes = elem.findall('./member')
-            LOG.debug(_('TAG(members=%(num)d): "%(tag)s"'),
-                      {'num': len(nodes),
-                       'tag': tag})
+            if self._debug:
+                LOG.debug(_('TAG(members=%(num)d): "%(tag)s"'),
+                          {'num': len(nodes),
+                           'tag': tag})
             if len(nodes) > 1:
                 members = []
                 for e in nodes:
@@ -41,6 +41,8 @@ from neutron.services.l3_router.drivers.pan.connector.xml_api \
 LOG = logging.getLogger(__name__)
 _encoding = 'utf-8'
 _job_query_interval = 0.5
+_job_query_max_interval = 10.0
+_job_query_backoff = 2.0
 
 
 class PanXapiError(Exception):
@@ -66,7 +68,10 @@ class PanXapi:
                  use_get=False,
                  timeout=None,
                  cafile=None,
-                 capath=None):
+                 capath=None,
+                 pool=None,
+                 keep_document=True,
+                 metrics=None):
         self.tag = tag
         self.api_username = api_username
         self.api_password = api_password
@@ -78,6 +83,13 @@ class PanXapi:
         self.timeout = timeout
         self.cafile = cafile
         self.capath = capath
+        self.pool = pool
+        # Keeping the raw response text doubles the memory used by large
+        # show results; element_root is enough for everything but xml_root()
+        # after a ParseError.
+        self.keep_document = keep_document
+        # connector.metrics backend; None (the default) measures nothing
+        self.metrics = metrics
 
         LOG.debug(_('Python version: %s'), sys.version)
         LOG.debug(_('xml.etree.ElementTree version: %s'), etree.VERSION)
@@ -206,7 +218,8 @@ class PanXapi:
         return True
 
     def __set_xml_response(self, message_body):
-        self.xml_document = message_body.decode(_encoding)
+        if self.keep_document:
+            self.xml_document = message_body.decode(_encoding)
 
         try:
             element = etree.fromstring(message_body)
@@ -228,6 +241,9 @@ class PanXapi:
         LOG.debug(_('message_body: %s'), type(message_body))
         LOG.debug(_('message_body.decode(): %s'), type(self.xml_document))
 
+        return self.__set_status()
+
+    def __set_status(self):
         response_attrib = self.element_root.attrib
         if not response_attrib:
             # XXX error?
@@ -246,6 +262,78 @@ class PanXapi:
         else:
             return False
 
+    def __check_xml_response(self, response):
+        content_type = self.__get_header(response, 'content-type')
+        if not ('application/xml' in content_type and
+                'charset=utf-8' in content_type):
+            response.close()
+            if not content_type:
+                raise PanXapiError('no content-type response header')
+            raise PanXapiError('no handler for content-type: %s' %
+                               content_type)
+
+    def __iter_xml_response(self, response, tag):
+        # Parse the response while it is being received. Every top-level
+        # tag element of the result is yielded once complete and then
+        # removed from the tree, so memory use is bounded by the largest
+        # entry instead of by the whole document. Error responses are
+        # small and kept whole for __get_response_msg().
+        stack = []
+        depth = 0
+        success = False
+        try:
+            try:
+                for event, elem in etree.iterparse(response,
+                                                   events=('start', 'end')):
+                    if event == 'start':
+                        if not stack:
+                            self.element_root = elem
+                            success = elem.get('status') == 'success'
+                        stack.append(elem)
+                        if elem.tag == tag:
+                            depth += 1
+                        continue
+
+                    stack.pop()
+                    if elem.tag != tag:
+                        continue
+                    depth -= 1
+                    if depth or not success:
+                        continue
+                    yield elem
+                    elem.clear()
+                    if stack:
+                        stack[-1].remove(elem)
+            except etree.ParseError as msg:
+                raise PanXapiError('ElementTree.iterparse ParseError: %s' %
+                                   msg)
+        finally:
+            response.close()
+
+        self.element_result = self.element_root.find('result')
+        if not self.__set_status():
+            raise PanXapiError(self.status_detail)
+
+    def __iter_type_config(self, action, xpath, tag):
+        self.__set_api_key()
+        self.__clear_response()
+
+        query = {}
+        query['type'] = 'config'
+        query['action'] = action
+        query['key'] = self.api_key
+        if xpath is not None:
+            query['xpath'] = xpath
+        if self.serial is not None:
+            query['target'] = self.serial
+
+        response = self.__api_request(query, stream=True)
+        if not response:
+            raise PanXapiError(self.status_detail)
+
+        self.__check_xml_response(response)
+        return self.__iter_xml_response(response, tag)
+
     def __get_response_msg(self):
         lines = []
 
@@ -363,9 +451,13 @@ class PanXapi:
         LOG.debug(_('xml_root.decode(): %s'), type(s.decode(_encoding)))
         return s.decode(_encoding)
 
-    # XXX xml_python() is not documented
     # XXX not sure this should be here
-    def xml_python(self, result=False):
+    def xml_python(self, result=False, xpath=None):
+        """Convert the response, or the first result element, to Python.
+
+        @param xpath: ElementTree path relative to the converted element;
+            only the subtrees it selects are converted
+        """
         if result:
             if (self.element_result is None or
                     not len(self.element_result)):
@@ -381,9 +473,9 @@ class PanXapi:
         except pan_config.PanConfigError as msg:
             raise PanXapiError('pan.config.PanConfigError: %s' % msg)
 
-        return conf.python()
+        return conf.python(xpath)
 
-    def __api_request(self, query):
+    def __api_request(self, query, stream=False):
         # type=keygen request will urlencode key if needed so don't
         # double encode
         if 'key' in query:
@@ -420,8 +512,13 @@ class PanXapi:
         if self.timeout is not None:
             kwargs['timeout'] = self.timeout
 
+        start = time.time()
         try:
-            response = urlopen(**kwargs)
+            if self.pool is not None:
+                response = self.pool.urlopen(request, timeout=self.timeout,
+                                             stream=stream)
+            else:
+                response = urlopen(**kwargs)
 
         # XXX handle httplib.BadStatusLine when http to port 443
         except URLError as error:
@@ -433,13 +530,33 @@ class PanXapi:
             if not (hasattr(error, 'code') or hasattr(error, 'reason')):
                 msg += ' unknown error (Kevin heart Python)'
             self.status_detail = msg
+            if self.metrics is not None:
+                self.__record_request(query, start, len(data), None)
             return False
 
+        if self.metrics is not None:
+            self.__record_request(query, start, len(data), response)
+
         LOG.debug(_('HTTP response headers:'))
         LOG.debug(_('%s'), response.info())
 
         return response
 
+    def __record_request(self, query, start, sent, response):
+        # Time until the response headers, or the whole body for pooled
+        # non-streamed responses, which are read at once.
+        tags = (query.get('type'), query.get('action'),
+                self.serial or 'panorama')
+        self.metrics.timing('api.request_time', time.time() - start, tags)
+        self.metrics.increment('api.requests', tags)
+        self.metrics.increment('api.bytes_sent', tags, sent)
+        if response is None:
+            self.metrics.increment('api.errors', tags)
+            return
+        length = response.info().getheader('content-length')
+        if length and length.isdigit():
+            self.metrics.increment('api.bytes_received', tags, int(length))
+
     def __set_api_key(self):
         if self.api_key is None:
             self.keygen()
@@ -541,6 +658,25 @@ class PanXapi:
             query['xpath'] = xpath
         self.__type_config('get', query)
 
+    def iter_show(self, xpath=None, tag='entry'):
+        """Streaming variant of show().
+
+        The request is sent at once; the returned generator parses the
+        response as it is read and yields every outermost tag element of
+        the result. A yielded element is cleared once the next one is
+        requested, so copy what you need out of it. xml_document is not
+        set and element_result keeps only what was not yielded.
+
+        @param xpath: configuration subtree to show
+        @param tag: name of the elements to yield
+        @return: generator of xml.etree.ElementTree.Element
+        """
+        return self.__iter_type_config('show', xpath, tag)
+
+    def iter_get(self, xpath=None, tag='entry'):
+        """Streaming variant of get(), see iter_show()."""
+        return self.__iter_type_config('get', xpath, tag)
+
     def delete(self, xpath=None):
         query = {}
         if xpath is not None:
@@ -563,6 +699,12 @@ class PanXapi:
             query['element'] = element
         self.__type_config('edit', query)
 
+    def multi_config(self, element=None):
+        query = {}
+        if element is not None:
+            query['element'] = element
+        self.__type_config('multi-config', query)
+
     def move(self, xpath=None, where=None, dst=None):
         query = {}
         if xpath is not None:
@@ -669,44 +811,81 @@ class PanXapi:
         if not self.__set_response(response):
             raise PanXapiError(self.status_detail)
 
-        if sync is not True:
-            return
-
         job = self.element_root.find('./result/job')
         if job is None:
-            return
+            return None
 
         LOG.debug(_('commit job: %s'), job.text)
 
-        cmd = 'show jobs id "%s"' % job.text
-        start_time = time.time()
+        if sync is not True:
+            return job.text
 
-        while True:
+        # XXX commit vs. commit-all job status
+        self.__wait_job(job.text, interval, timeout)
+        return job.text
+
+    def job_status(self, job_id, log=False):
+        """Query the status of a job once.
+
+        @param job_id: id of a commit (or other op) job, or of a log job
+            if log is True
+        @return: job status text, 'FIN' once the job is finished
+        """
+        if log:
+            self.__set_api_key()
+            self.__clear_response()
+
+            query = {}
+            query['type'] = 'log'
+            query['action'] = 'get'
+            query['key'] = self.api_key
+            query['job-id'] = job_id
+
+            response = self.__api_request(query)
+            if not response:
+                raise PanXapiError(self.status_detail)
+
+            if not self.__set_response(response):
+                raise PanXapiError(self.status_detail)
+
+            where = 'type=log&action=get response'
+        else:
+            cmd = 'show jobs id "%s"' % job_id
             try:
                 self.op(cmd=cmd, cmd_xml=True)
             except PanXapiError as msg:
                 raise PanXapiError('commit %s: %s' % (cmd, msg))
 
-            path = './result/job/status'
-            status = self.element_root.find(path)
-            if status is None:
-                raise PanXapiError('no status element in ' +
-                                   "'%s' response" % cmd)
-            if status.text == 'FIN':
-                # XXX commit vs. commit-all job status
+            where = "'%s' response" % cmd
+
+        status = self.element_root.find('./result/job/status')
+        if status is None:
+            raise PanXapiError('no status element in ' + where)
+        return status.text
+
+    def __wait_job(self, job_id, interval, timeout, log=False):
+        # Poll with exponential backoff: short jobs finish quickly while
+        # long commits don't cost a request every interval seconds.
+        start_time = time.time()
+
+        while True:
+            status = self.job_status(job_id, log=log)
+            if status == 'FIN':
                 return
 
             LOG.debug(_('job %(job)s, status %(status)s'),
-                      {'job': job.text,
-                       'status': status.text})
+                      {'job': job_id,
+                       'status': status})
 
             if (timeout is not None and timeout != 0 and
                     time.time() > start_time + timeout):
                 raise PanXapiError('timeout waiting for ' +
-                                   'job %s completion' % job.text)
+                                   'job %s completion' % job_id)
 
             LOG.debug(_('sleep %.2f seconds'), interval)
             time.sleep(interval)
+            interval = min(interval * _job_query_backoff,
+                           max(interval, _job_query_max_interval))
 
     def op(self, cmd=None, vsys=None, cmd_xml=False):
         if cmd is not None and cmd_xml:
@@ -758,8 +937,31 @@ class PanXapi:
         if self.export_result:
             self.export_result['category'] = category
 
+    def iter_log(self, job_id, tag='entry'):
+        """Stream the log entries of a finished log job.
+
+        @param job_id: id returned by log()
+        @param tag: name of the elements to yield, see iter_show()
+        @return: generator of xml.etree.ElementTree.Element
+        """
+        self.__set_api_key()
+        self.__clear_response()
+
+        query = {}
+        query['type'] = 'log'
+        query['action'] = 'get'
+        query['key'] = self.api_key
+        query['job-id'] = job_id
+
+        response = self.__api_request(query, stream=True)
+        if not response:
+            raise PanXapiError(self.status_detail)
+
+        self.__check_xml_response(response)
+        return self.__iter_xml_response(response, tag)
+
     def log(self, log_type=None, nlogs=None, skip=None, filter=None,
-            interval=None, timeout=None):
+            interval=None, timeout=None, sync=True):
         self.__set_api_key()
         self.__clear_response()
 
@@ -804,38 +1006,10 @@ class PanXapi:
         if job is None:
             raise PanXapiError('no job element in type=log response')
 
-        query = {}
-        query['type'] = 'log'
-        query['action'] = 'get'
-        query['key'] = self.api_key
-        query['job-id'] = job.text
         LOG.debug(_('log job: %s'), job.text)
 
-        start_time = time.time()
-
-        while True:
-            response = self.__api_request(query)
-            if not response:
-                raise PanXapiError(self.status_detail)
-
-            if not self.__set_response(response):
-                raise PanXapiError(self.status_detail)
-
-            status = self.element_root.find('./result/job/status')
-            if status is None:
-                raise PanXapiError('no status element in ' +
-                                   'type=log&action=get response')
-            if status.text == 'FIN':
-                return
-
-            LOG.debug(_('job %(job)s, status %(status)s'),
-                      {'job': job.text,
-                       'status': status.text})
-
-            if (timeout is not None and timeout != 0 and
-                    time.time() > start_time + timeout):
-                raise PanXapiError('timeout waiting for ' +
-                                   'job %s completion' % job.text)
+        if sync is not True:
+            return job.text
 
-            LOG.debug(_('sleep %.2f seconds'), interval)
-            time.sleep(interval)
+        self.__wait_job(job.text, interval, timeout, log=True)
+        return job.text
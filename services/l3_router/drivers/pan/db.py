@@ -18,7 +18,12 @@ import sqlalchemy as sa
 
 from neutron.common import exceptions as neutron_exc
 from neutron.db import db_base_plugin_v2
+from neutron.db import l3_db
 from neutron.db import model_base
+from neutron.db import models_v2
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
 
 
 class PanDeviceReservationNotFound(neutron_exc.NotFound):
@@ -26,17 +31,34 @@ class PanDeviceReservationNotFound(neutron_exc.NotFound):
                 ' found')
 
 
+class NoFreePanDevice(neutron_exc.ServiceUnavailable):
+    message = _('No free PAN device is available for a new router')
+
+
 class PanDeviceReservation(model_base.BASEV2):
-    """Represents a PAN device reservation for Neutron router."""
+    """Represents a pooled PAN device and the router it is reserved for."""
     __tablename__ = 'pan_device_reservations'
-    router_id = sa.Column(sa.String(36), nullable=False)
+    router_id = sa.Column(sa.String(36), nullable=True, index=True)
     device_sn = sa.Column(sa.String(16), nullable=False, primary_key=True)
 
 
+class PanInterfaceMapping(model_base.BASEV2):
+    """Represents the ethernet1/2 unit of a Neutron router port."""
+    __tablename__ = 'pan_interface_mappings'
+    __table_args__ = (sa.UniqueConstraint('device_sn', 'unit'),
+                      model_base.BASEV2.__table_args__)
+    port_id = sa.Column(sa.String(36),
+                        sa.ForeignKey('ports.id', ondelete="CASCADE"),
+                        primary_key=True)
+    device_sn = sa.Column(sa.String(16), nullable=False)
+    unit = sa.Column(sa.Integer, nullable=False, autoincrement=False)
+    segmentation_id = sa.Column(sa.Integer)
+
+
 class PanDbApi(db_base_plugin_v2.NeutronDbPluginV2):
 
     def reserve_pan_device(self, context, device_sn, router_id):
-        """Create PAN device reservation DB record.
+        """Reserve a given PAN device for a router.
 
         @param context: contain user information
         @param device_sn: Panorama device serial number
@@ -44,12 +66,47 @@ class PanDbApi(db_base_plugin_v2.NeutronDbPluginV2):
         @return: None
         """
         with context.session.begin(subtransactions=True):
-            reservation_ref = PanDeviceReservation(router_id=router_id,
-                                                   device_sn=device_sn)
-            context.session.add(reservation_ref)
+            reservation = context.session.query(PanDeviceReservation).\
+                filter_by(device_sn=device_sn).first()
+            if reservation is None:
+                reservation = PanDeviceReservation(device_sn=device_sn)
+                context.session.add(reservation)
+            reservation.router_id = router_id
+
+    def claim_pan_device(self, context, router_id):
+        """Reserve any free PAN device of the pool for a router.
+
+        The free device row is locked, so concurrent claims never get the
+        same device.
+
+        @param context: contain user information
+        @param router_id: Neutron router id
+        @return: serial number of the reserved device
+        """
+        with context.session.begin(subtransactions=True):
+            reservation = context.session.query(PanDeviceReservation).\
+                filter(PanDeviceReservation.router_id == sa.null()).\
+                order_by(PanDeviceReservation.device_sn).\
+                with_lockmode('update').first()
+            if reservation is not None:
+                reservation.router_id = router_id
+                return reservation.device_sn
+        # Raised out of the subtransaction, whose rollback would deactivate
+        # the enclosing transaction
+        raise NoFreePanDevice()
+
+    def has_free_pan_device(self, context):
+        """Check whether the pool has a device free for a new router.
+
+        @param context: contain user information
+        @return: True if a device is free
+        """
+        query = context.session.query(PanDeviceReservation).filter(
+            PanDeviceReservation.router_id == sa.null())
+        return query.first() is not None
 
     def release_pan_device(self, context, router_id):
-        """Delete PAN device reservation DB record.
+        """Return the PAN device reserved for a router to the pool.
 
         @param context: contain user information
         @param router_id: Neutron router id
@@ -57,7 +114,35 @@ class PanDbApi(db_base_plugin_v2.NeutronDbPluginV2):
         """
         with context.session.begin(subtransactions=True):
             reservation = self._get_reservation_by_router(context, router_id)
-            context.session.delete(reservation)
+            reservation.router_id = None
+
+    def sync_pan_devices(self, context, device_sns):
+        """Make the pool match the devices of the Panorama device group.
+
+        New devices are added as free. Free devices that left the group are
+        removed; reserved ones are kept until their router is deleted.
+
+        @param context: contain user information
+        @param device_sns: serial numbers of the device group members
+        @return: None
+        """
+        device_sns = set(device_sns)
+        with context.session.begin(subtransactions=True):
+            known = set()
+            for reservation in context.session.query(PanDeviceReservation):
+                known.add(reservation.device_sn)
+                if reservation.device_sn in device_sns:
+                    continue
+                if reservation.router_id is None:
+                    context.session.delete(reservation)
+                else:
+                    LOG.warning(_('PAN device %(device)s reserved for router'
+                                  ' %(router)s is no longer in the device'
+                                  ' group'),
+                                {'device': reservation.device_sn,
+                                 'router': reservation.router_id})
+            for device_sn in device_sns - known:
+                context.session.add(PanDeviceReservation(device_sn=device_sn))
 
     def get_device_reservation(self, context, router_id):
         """Get PAN device reservation DB record.
@@ -75,8 +160,147 @@ class PanDbApi(db_base_plugin_v2.NeutronDbPluginV2):
         @param context: contain user information
         @return: list of dict with reservation info
         """
-        return self._get_collection(context, PanDeviceReservation,
-                                    self._make_device_reservation_dict)
+        query = self._model_query(context, PanDeviceReservation).filter(
+            PanDeviceReservation.router_id != sa.null())
+        return [self._make_device_reservation_dict(dev_res)
+                for dev_res in query]
+
+    def allocate_interface(self, context, device_sn, port_id,
+                           segmentation_id):
+        """Allocate the lowest free ethernet1/2 unit of a device to a port.
+
+        @param context: contain user information
+        @param device_sn: PAN device serial number
+        @param port_id: Neutron router port id
+        @param segmentation_id: vlan tag of the port network
+        @return: unit number
+        """
+        with context.session.begin(subtransactions=True):
+            # Locking the device row serializes allocations on the device
+            context.session.query(PanDeviceReservation).filter_by(
+                device_sn=device_sn).with_lockmode('update').first()
+            units = context.session.query(PanInterfaceMapping.unit).\
+                filter_by(device_sn=device_sn)
+            used = set(used_unit for (used_unit,) in units)
+            unit = 1
+            while unit in used:
+                unit += 1
+            context.session.add(PanInterfaceMapping(
+                port_id=port_id, device_sn=device_sn, unit=unit,
+                segmentation_id=segmentation_id))
+            return unit
+
+    def adopt_interfaces(self, context, device_sn, units):
+        """Record the mappings of the units existing on a device.
+
+        Units created before the mappings were persisted are only known by
+        the port_id comment on the device. The units of existing ports not
+        mapped yet are recorded as they are.
+
+        @param context: contain user information
+        @param device_sn: PAN device serial number
+        @param units: dict of unit number to dict with 'port_id' (None if
+            the unit is not tagged with one) and 'segmentation_id', as
+            returned by PANConnector.get_device_state()
+        @return: set of the port ids of units whose port does not exist
+        """
+        with context.session.begin(subtransactions=True):
+            context.session.query(PanDeviceReservation).filter_by(
+                device_sn=device_sn).with_lockmode('update').first()
+            port_ids = set(value['port_id'] for value in units.values()
+                           if value['port_id'])
+            if not port_ids:
+                return set()
+            existing = set(port_id for (port_id,) in context.session.query(
+                models_v2.Port.id).filter(models_v2.Port.id.in_(port_ids)))
+            mapped = context.session.query(PanInterfaceMapping).filter(
+                sa.or_(PanInterfaceMapping.device_sn == device_sn,
+                       PanInterfaceMapping.port_id.in_(port_ids)))
+            mapped_units = set()
+            mapped_ports = set()
+            for mapping in mapped:
+                if mapping.device_sn == device_sn:
+                    mapped_units.add(mapping.unit)
+                mapped_ports.add(mapping.port_id)
+            for unit, value in sorted(units.items()):
+                port_id = value['port_id']
+                if (unit in mapped_units or port_id not in existing or
+                        port_id in mapped_ports):
+                    continue
+                LOG.info(_('Recording unit %(unit)s of PAN device %(device)s'
+                           ' for port %(port)s'),
+                         {'unit': unit, 'device': device_sn,
+                          'port': port_id})
+                context.session.add(PanInterfaceMapping(
+                    port_id=port_id, device_sn=device_sn, unit=unit,
+                    segmentation_id=value['segmentation_id']))
+                mapped_ports.add(port_id)
+            return port_ids - existing
+
+    def release_interface(self, context, port_id):
+        """Free the ethernet1/2 unit allocated to a port.
+
+        @param context: contain user information
+        @param port_id: Neutron router port id
+        @return: dict with the released mapping info, None if the port had
+            no unit allocated
+        """
+        with context.session.begin(subtransactions=True):
+            mapping = context.session.query(PanInterfaceMapping).filter_by(
+                port_id=port_id).first()
+            if mapping is None:
+                return None
+            result = self._make_interface_mapping_dict(mapping)
+            context.session.delete(mapping)
+            return result
+
+    def get_interface_mappings(self, context, device_sn):
+        """Get the ethernet1/2 units allocated on a device.
+
+        @param context: contain user information
+        @param device_sn: PAN device serial number
+        @return: list of dict with mapping info
+        """
+        query = self._model_query(context, PanInterfaceMapping).filter_by(
+            device_sn=device_sn)
+        return [self._make_interface_mapping_dict(mapping)
+                for mapping in query]
+
+    def get_port_ip(self, context, port_id):
+        """Get the first fixed ip of a port with its subnet cidr.
+
+        @param context: contain user information
+        @param port_id: Neutron port id
+        @return: dict with 'ip_address' and 'cidr', None if the port has no
+            fixed ip
+        """
+        fixed_ips = self.get_port(context, port_id)['fixed_ips']
+        if not fixed_ips:
+            return None
+        ip = fixed_ips[0]
+        subnet = self.get_subnet(context, ip['subnet_id'])
+        return {'ip_address': ip['ip_address'],
+                'cidr': subnet['cidr']}
+
+    def get_router_gateway_ip(self, context, router_id):
+        """Get the ip of the external gateway port of a router.
+
+        @param context: contain user information
+        @param router_id: Neutron router id
+        @return: dict with 'ip_address' and 'cidr', None if the router has
+            no gateway
+        """
+        router = self._model_query(context, l3_db.Router).filter_by(
+            id=router_id).first()
+        if router is None or not router.gw_port_id:
+            return None
+        return self.get_port_ip(context, router.gw_port_id)
+
+    def _make_interface_mapping_dict(self, mapping):
+        return {'port_id': mapping['port_id'],
+                'device_sn': mapping['device_sn'],
+                'unit': mapping['unit'],
+                'segmentation_id': mapping['segmentation_id']}
 
     def _make_device_reservation_dict(self, dev_res, fields=None):
             res = {
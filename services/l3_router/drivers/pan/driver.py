@@ -14,11 +14,19 @@
 #    under the License.
 #
 
+from oslo.config import cfg
+
+from neutron import context as neutron_context
 from neutron.extensions import l3
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import loopingcall
 from neutron.plugins.ml2 import db as ml2_db
 from neutron.services.l3_router.drivers import base as l3_base_driver
 from neutron.services.l3_router.drivers.pan.connector import pan_connector
 from neutron.services.l3_router.drivers.pan import db as pan_db
+from neutron.services.l3_router.drivers.pan import reconciler
+
+LOG = logging.getLogger(__name__)
 
 NETWORK_TYPE = 'vlan'
 
@@ -28,22 +36,37 @@ class L3RouterPANDriver(l3_base_driver.L3RouterBaseDriver):
     def __init__(self):
         self._connector = pan_connector.PANConnector()
         self._db = pan_db.PanDbApi()
+        if cfg.CONF.pan_device_sync_interval > 0:
+            self._device_sync = loopingcall.FixedIntervalLoopingCall(
+                self._periodic_sync_devices)
+            self._device_sync.start(
+                interval=cfg.CONF.pan_device_sync_interval)
+        self._reconciler = reconciler.Reconciler(
+            self._connector, self._db,
+            workers=cfg.CONF.pan_reconcile_workers,
+            device_interval=cfg.CONF.pan_reconcile_device_interval)
+        if cfg.CONF.pan_reconcile_interval > 0:
+            self._reconcile = loopingcall.FixedIntervalLoopingCall(
+                self._periodic_reconcile)
+            self._reconcile.start(
+                interval=cfg.CONF.pan_reconcile_interval,
+                initial_delay=cfg.CONF.pan_reconcile_interval)
+
+    def create_router_prepare(self, context, r_ctx):
+        # Devices may have joined the device group since the last sync.
+        # Panorama is queried before the router transaction is opened.
+        if not self._db.has_free_pan_device(context):
+            self._sync_devices(context)
 
     def create_router_precommit(self, context, r_ctx):
-        devices = self._connector.list_devices()
-        reserved_devices = [item['device_sn'] for item
-                            in self._db.get_device_reservations(context)]
-        free_devices = list(set(devices) - set(reserved_devices))
-        if not free_devices:
-            raise Exception("No more free PAN devices")
-        device_sn = free_devices[0]
-
-        self._db.reserve_pan_device(context, device_sn, r_ctx.current['id'])
+        device_sn = self._db.claim_pan_device(context, r_ctx.current['id'])
+
         tags = self._generate_device_tags(r_ctx.current)
         self._connector.add_device_tags(device_sn, tags)
 
     def create_router_postcommit(self, context, r_ctx):
-        self._connector.commit_configuration()
+        self._connector.commit_configuration(
+            wait=cfg.CONF.pan_commit_wait)
 
     def update_router_precommit(self, context, r_ctx):
         if l3.EXTERNAL_GW_INFO in r_ctx.update:
@@ -69,7 +92,8 @@ class L3RouterPANDriver(l3_base_driver.L3RouterBaseDriver):
 
     def update_router_postcommit(self, context, r_ctx):
         if r_ctx.params.get('device_sn'):
-            self._connector.commit_configuration(r_ctx.params['device_sn'])
+            self._connector.commit_configuration(
+                r_ctx.params['device_sn'], wait=cfg.CONF.pan_commit_wait)
 
     def delete_router_precommit(self, context, r_ctx):
         dev_res = self._db.get_device_reservation(context,
@@ -80,7 +104,8 @@ class L3RouterPANDriver(l3_base_driver.L3RouterBaseDriver):
         self._connector.remove_device_tags(dev_res['device_sn'], tags)
 
     def delete_router_postcommit(self, context, r_ctx):
-        self._connector.commit_configuration()
+        self._connector.commit_configuration(
+            wait=cfg.CONF.pan_commit_wait)
 
     def add_router_interface_precommit(self, context, rp_ctx):
         dev_res = self._db.get_device_reservation(context,
@@ -89,7 +114,12 @@ class L3RouterPANDriver(l3_base_driver.L3RouterBaseDriver):
             context, rp_ctx.current['network_id'])
         ip = rp_ctx.current['fixed_ips'][0]
         subnet = self._db.get_subnet(context, ip['subnet_id'])
+        self._adopt_device_units(context, dev_res['device_sn'])
+        unit = self._db.allocate_interface(
+            context, dev_res['device_sn'], rp_ctx.current['id'],
+            segmentation_id)
         iface_dict = {'port_id': rp_ctx.current['id'],
+                      'unit': unit,
                       'segmentation_id': segmentation_id,
                       'ip_address': ip['ip_address'],
                       'cidr': subnet['cidr']}
@@ -97,17 +127,27 @@ class L3RouterPANDriver(l3_base_driver.L3RouterBaseDriver):
         rp_ctx.params = {'device_sn': dev_res['device_sn']}
 
     def add_router_interface_postcommit(self, context, rp_ctx):
-        self._connector.commit_configuration(rp_ctx.params['device_sn'])
+        self._connector.commit_configuration(
+            rp_ctx.params['device_sn'], wait=cfg.CONF.pan_commit_wait)
+
+    def remove_router_interface_prepare(self, context, rp_ctx):
+        # The mapping is deleted with the port
+        rp_ctx.params = {'mapping': self._db.release_interface(
+            context, rp_ctx.original['id'])}
 
     def remove_router_interface_precommit(self, context, rp_ctx):
         dev_res = self._db.get_device_reservation(context,
                                                   rp_ctx.original_router_id)
         iface_dict = {'port_id': rp_ctx.original['id']}
+        mapping = rp_ctx.params.get('mapping')
+        if mapping:
+            iface_dict['unit'] = mapping['unit']
         self._connector.remove_vlan_iface(dev_res['device_sn'], iface_dict)
         rp_ctx.params = {'device_sn': dev_res['device_sn']}
 
     def remove_router_interface_postcommit(self, context, rp_ctx):
-        self._connector.commit_configuration(rp_ctx.params['device_sn'])
+        self._connector.commit_configuration(
+            rp_ctx.params['device_sn'], wait=cfg.CONF.pan_commit_wait)
 
     def create_floatingip_precommit(self, context, fip_ctx):
         pass
@@ -133,6 +173,34 @@ class L3RouterPANDriver(l3_base_driver.L3RouterBaseDriver):
     def disassociate_floatingip_postcommit(self, context, fip_ctx):
         pass
 
+    def _periodic_sync_devices(self):
+        try:
+            self._sync_devices(neutron_context.get_admin_context())
+        except Exception:
+            LOG.exception(_('Failed to synchronize the PAN device pool'))
+
+    def _periodic_reconcile(self):
+        try:
+            self._reconciler.run()
+        except Exception:
+            LOG.exception(_('Failed to reconcile the PAN devices'))
+
+    def _adopt_device_units(self, context, device_sn):
+        # A device without mappings may have units made before the mappings
+        # were persisted. The ones of existing ports are recorded, and the
+        # ones of deleted ports removed so their unit can be allocated.
+        if self._db.get_interface_mappings(context, device_sn):
+            return
+        units = self._connector.get_device_state(device_sn)['units']
+        stale_ports = self._db.adopt_interfaces(context, device_sn, units)
+        for unit, value in sorted(units.items()):
+            if value['port_id'] in stale_ports:
+                self._connector.remove_vlan_iface(
+                    device_sn, {'port_id': value['port_id'], 'unit': unit})
+
+    def _sync_devices(self, context):
+        self._db.sync_pan_devices(context, self._connector.list_devices())
+
     def _get_network_segmentation_id(self, context, network_id,
                                      network_type=NETWORK_TYPE):
         nw_segments = ml2_db.get_network_segments(context.session, network_id)
@@ -0,0 +1,180 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Repair of PAN device configurations drifting from the Neutron database.
+
+A failed postcommit, a manual change or a device replaced from backup can
+leave a device with missing or stale ethernet1/2 units, or with an
+external address and OpenStack NAT rule not matching the router gateway.
+Reconciler reads the configuration of every reserved device with one show
+request, compares fingerprints of each managed subtree with the ones
+computed from the database and rewrites only the subtrees that differ.
+"""
+
+import hashlib
+import time
+
+import eventlet
+
+from neutron import context as neutron_context
+from neutron.openstack.common import jsonutils
+from neutron.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+GATEWAY = 'gateway'
+
+
+def fingerprint(value):
+    return hashlib.sha1(jsonutils.dumps(value, sort_keys=True)).hexdigest()
+
+
+def _cidr_ip(ip_dict):
+    return ip_dict['ip_address'] + '/' + ip_dict['cidr'].split('/')[1]
+
+
+class Reconciler(object):
+    """Check reserved PAN devices against the database and repair them.
+
+    @param connector: PANConnector
+    @param db: PanDbApi
+    @param workers: number of devices checked concurrently
+    @param device_interval: minimum seconds between two checks of the same
+        device
+    """
+
+    def __init__(self, connector, db, workers=4, device_interval=60):
+        self._connector = connector
+        self._db = db
+        self._pool = eventlet.GreenPool(workers)
+        self._device_interval = device_interval
+        self._last_check = {}
+
+    def run(self):
+        """Check every reserved device not checked recently."""
+        context = neutron_context.get_admin_context()
+        now = time.time()
+        for dev_res in self._db.get_device_reservations(context):
+            last = self._last_check.get(dev_res['device_sn'])
+            if last is not None and now - last < self._device_interval:
+                continue
+            self._last_check[dev_res['device_sn']] = now
+            self._pool.spawn_n(self._check_device_safe, dev_res)
+        self._pool.waitall()
+
+    def _check_device_safe(self, dev_res):
+        try:
+            self.check_device(neutron_context.get_admin_context(), dev_res)
+        except Exception:
+            LOG.exception(_('Failed to reconcile PAN device %s'),
+                          dev_res['device_sn'])
+
+    def check_device(self, context, dev_res):
+        """Repair the configuration of one device.
+
+        @param context: contain user information
+        @param dev_res: device reservation dict
+        @return: number of repaired subtrees
+        """
+        device_sn = dev_res['device_sn']
+        device_state = self._connector.get_device_state(device_sn)
+        # Units made before the mappings were persisted are recorded, not
+        # repaired
+        stale_ports = self._db.adopt_interfaces(context, device_sn,
+                                                device_state['units'])
+        expected, ip_dicts = self._expected_state(context, dev_res)
+        actual = self._actual_state(device_state, expected, stale_ports)
+
+        drift = [key for key in set(expected) | set(actual)
+                 if (key not in expected or key not in actual or
+                     fingerprint(expected[key]) != fingerprint(actual[key]))]
+        if not drift:
+            return 0
+
+        LOG.warning(_('PAN device %(device)s differs from the database in'
+                      ' %(drift)s, repairing'),
+                    {'device': device_sn, 'drift': sorted(drift)})
+        # The connector cache may hold what the device lost
+        self._connector.invalidate_config_cache(device_sn)
+        for key in drift:
+            if key == GATEWAY:
+                self._repair_gateway(device_sn, expected[key], actual[key],
+                                     ip_dicts[key])
+            else:
+                self._repair_unit(device_sn, key, expected.get(key),
+                                  actual.get(key), ip_dicts.get(key))
+        self._connector.commit_configuration(device_sn, wait=False)
+        return len(drift)
+
+    def _expected_state(self, context, dev_res):
+        # Returns the state to compare and the ip dicts needed to repair it
+        state = {}
+        ip_dicts = {}
+        for mapping in self._db.get_interface_mappings(
+                context, dev_res['device_sn']):
+            ip_dict = self._db.get_port_ip(context, mapping['port_id'])
+            if ip_dict is None:
+                # Nothing to configure for a port without an address
+                continue
+            state[mapping['unit']] = {
+                'port_id': mapping['port_id'],
+                'segmentation_id': mapping['segmentation_id'],
+                'ip': _cidr_ip(ip_dict)}
+            ip_dicts[mapping['unit']] = ip_dict
+
+        ip_dict = self._db.get_router_gateway_ip(context,
+                                                 dev_res['router_id'])
+        ip = _cidr_ip(ip_dict) if ip_dict else None
+        state[GATEWAY] = {'external_ip': ip, 'nat_ip': ip}
+        ip_dicts[GATEWAY] = ip_dict
+        return state, ip_dicts
+
+    def _actual_state(self, device_state, expected, stale_ports):
+        # Units without a port_id comment were not made by Neutron. The
+        # unit of an existing port is only replaced by the one the
+        # database expects in its place, and removed with the port.
+        state = dict((unit, value)
+                     for unit, value in device_state['units'].items()
+                     if value['port_id'] and
+                     (unit in expected or value['port_id'] in stale_ports))
+        state[GATEWAY] = {'external_ip': device_state['external_ip'],
+                          'nat_ip': device_state['nat_ip']}
+        return state
+
+    def _repair_unit(self, device_sn, unit, expected, actual, ip_dict):
+        if actual is not None and (expected is None or
+                                   actual['port_id'] != expected['port_id']):
+            self._connector.remove_vlan_iface(
+                device_sn, {'port_id': actual['port_id'], 'unit': unit})
+        if expected is not None:
+            iface_dict = dict(ip_dict)
+            iface_dict.update({'port_id': expected['port_id'],
+                               'unit': unit,
+                               'segmentation_id':
+                               expected['segmentation_id']})
+            self._connector.add_vlan_iface(device_sn, iface_dict)
+
+    def _repair_gateway(self, device_sn, expected, actual, ip_dict):
+        ip = expected['external_ip']
+        if actual['nat_ip'] is not None and actual['nat_ip'] != ip:
+            self._connector.remove_external_nat(device_sn)
+        if actual['external_ip'] is not None and actual['external_ip'] != ip:
+            self._connector.remove_external_ip(device_sn)
+        if ip is not None:
+            if actual['external_ip'] != ip:
+                self._connector.add_external_ip(device_sn, ip_dict)
+            if actual['nat_ip'] != ip:
+                self._connector.add_external_nat(device_sn, ip_dict)
@@ -0,0 +1,227 @@
+# Copyright (c) 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Durable queue for L3 driver postcommit operations.
+
+Driver postcommits may block for a long time (a PAN-OS commit takes tens
+of seconds). In asynchronous mode, L3RouterPlugin stores them as rows of
+l3_driver_jobs, in the same transaction as the change they belong to, and
+answers the API request at once. A JobQueue worker pool then runs the jobs
+of every router in order and moves the router from PENDING_* to ACTIVE,
+or to ERROR once a job ran out of attempts.
+"""
+
+import datetime
+
+import eventlet
+from eventlet import event
+import sqlalchemy as sa
+
+from neutron import context as neutron_context
+from neutron.db import api as db_api
+from neutron.db import l3_db
+from neutron.db import model_base
+from neutron.openstack.common import jsonutils
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from neutron.plugins.common import constants
+
+LOG = logging.getLogger(__name__)
+
+JOB_PENDING = 'PENDING'
+JOB_RUNNING = 'RUNNING'
+JOB_ERROR = 'ERROR'
+
+
+class L3DriverJob(model_base.BASEV2):
+    """Represents a queued L3 driver postcommit operation."""
+    __tablename__ = 'l3_driver_jobs'
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    router_id = sa.Column(sa.String(36), nullable=False, index=True)
+    method = sa.Column(sa.String(64), nullable=False)
+    data = sa.Column(sa.Text, nullable=False)
+    status = sa.Column(sa.String(16), nullable=False)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    created_at = sa.Column(sa.DateTime, nullable=False)
+    started_at = sa.Column(sa.DateTime)
+
+
+def enqueue(context, router_id, method, data, router_status=None):
+    """Store a postcommit job; call inside the transaction of the change.
+
+    @param context: contain user information
+    @param router_id: Neutron router id; jobs of one router run in order
+    @param method: name of the driver method to call
+    @param data: JSON serializable arguments of the driver method
+    @param router_status: status to give the router, if it still exists
+    @return: None
+    """
+    with context.session.begin(subtransactions=True):
+        context.session.add(L3DriverJob(router_id=router_id,
+                                        method=method,
+                                        data=jsonutils.dumps(data),
+                                        status=JOB_PENDING,
+                                        attempts=0,
+                                        created_at=timeutils.utcnow()))
+        if router_status:
+            _set_router_status(context, router_id, router_status)
+
+
+def _set_router_status(context, router_id, status):
+    context.session.query(l3_db.Router).filter_by(id=router_id).update(
+        {'status': status}, synchronize_session=False)
+
+
+class JobQueue(object):
+    """Worker pool running queued postcommit jobs.
+
+    Jobs are picked up when wake() is called after a transaction enqueued
+    some, and every poll_interval seconds for jobs enqueued by other
+    servers or left behind by a restart.
+
+    @param run_func: callable(context, method, data) running one job
+    @param workers: number of routers whose jobs are run concurrently
+    @param poll_interval: seconds between two scans of the queue
+    @param max_attempts: runs of a failing job before it is given up
+    @param job_timeout: seconds after which a RUNNING job is considered
+        abandoned and run again
+    """
+
+    def __init__(self, run_func, workers=4, poll_interval=5,
+                 max_attempts=3, job_timeout=600):
+        self._run_func = run_func
+        self._pool = eventlet.GreenPool(workers)
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self._job_timeout = job_timeout
+        self._busy = set()
+        self._wakeup = event.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+
+    def wake(self):
+        """Look for new jobs now instead of at the next poll."""
+        if not self._wakeup.ready():
+            self._wakeup.send()
+
+    def _run(self):
+        while True:
+            try:
+                self.dispatch()
+            except Exception:
+                LOG.exception(_('Failed to dispatch L3 driver jobs'))
+            with eventlet.Timeout(self._poll_interval, False):
+                self._wakeup.wait()
+            self._wakeup = event.Event()
+
+    def dispatch(self):
+        """Start a worker for every router having runnable jobs."""
+        session = db_api.get_session()
+        query = session.query(L3DriverJob.router_id).filter(
+            self._runnable()).distinct()
+        for (router_id,) in query:
+            if router_id in self._busy:
+                continue
+            if not self._pool.free():
+                break
+            self._busy.add(router_id)
+            self._pool.spawn_n(self._drain, router_id)
+
+    def wait(self):
+        """Block until every started worker is finished."""
+        self._pool.waitall()
+
+    def _runnable(self):
+        abandoned = timeutils.utcnow() - datetime.timedelta(
+            seconds=self._job_timeout)
+        return sa.or_(L3DriverJob.status == JOB_PENDING,
+                      sa.and_(L3DriverJob.status == JOB_RUNNING,
+                              L3DriverJob.started_at < abandoned))
+
+    def _drain(self, router_id):
+        context = neutron_context.get_admin_context()
+        try:
+            while True:
+                job = self._claim(context, router_id)
+                if job is None or not self._execute(context, job):
+                    break
+        except Exception:
+            LOG.exception(_('Failed to run L3 driver jobs of router %s'),
+                          router_id)
+        finally:
+            self._busy.discard(router_id)
+
+    def _claim(self, context, router_id):
+        # Row locks on the jobs of the router keep other servers from
+        # running two of them at the same time.
+        with context.session.begin(subtransactions=True):
+            jobs = context.session.query(L3DriverJob).filter(
+                L3DriverJob.router_id == router_id,
+                L3DriverJob.status != JOB_ERROR).order_by(
+                L3DriverJob.id).with_lockmode('update').all()
+            if not jobs:
+                return None
+            job = jobs[0]
+            if (job.status == JOB_RUNNING and
+                    context.session.query(L3DriverJob).filter(
+                        L3DriverJob.id == job.id,
+                        self._runnable()).count() == 0):
+                return None
+            job.status = JOB_RUNNING
+            job.started_at = timeutils.utcnow()
+            job.attempts += 1
+            return {'id': job.id, 'method': job.method, 'data': job.data,
+                    'attempts': job.attempts}
+
+    def _execute(self, context, job):
+        try:
+            self._run_func(context, job['method'],
+                           jsonutils.loads(job['data']))
+        except Exception:
+            LOG.exception(_('L3 driver job %(id)s (%(method)s) failed, '
+                            'attempt %(attempts)d of %(max)d'),
+                          {'id': job['id'], 'method': job['method'],
+                           'attempts': job['attempts'],
+                           'max': self._max_attempts})
+            self._job_failed(context, job)
+            return False
+
+        self._job_done(context, job)
+        return True
+
+    def _job_done(self, context, job):
+        with context.session.begin(subtransactions=True):
+            db_job = context.session.query(L3DriverJob).get(job['id'])
+            router_id = db_job.router_id
+            context.session.delete(db_job)
+            remaining = context.session.query(L3DriverJob).filter(
+                L3DriverJob.router_id == router_id,
+                L3DriverJob.id != job['id'],
+                L3DriverJob.status != JOB_ERROR).count()
+            if not remaining:
+                _set_router_status(context, router_id, constants.ACTIVE)
+
+    def _job_failed(self, context, job):
+        with context.session.begin(subtransactions=True):
+            db_job = context.session.query(L3DriverJob).get(job['id'])
+            if job['attempts'] < self._max_attempts:
+                db_job.status = JOB_PENDING
+                return
+            db_job.status = JOB_ERROR
+            _set_router_status(context, db_job.router_id, constants.ERROR)
@@ -37,6 +37,7 @@ from neutron.db import models_v2
 from neutron.openstack.common import importutils
 from neutron.openstack.common import rpc
 from neutron.plugins.common import constants
+from neutron.services.l3_router import job_queue
 
 OPTS = [
     cfg.StrOpt(
@@ -44,6 +45,31 @@ OPTS = [
         default='neutron.services.l3_router.drivers.l3_agent_driver.'
                 'L3AgentDriver',
         help=_("Driver for L3 service plugin")),
+    cfg.BoolOpt(
+        'l3_driver_async',
+        default=False,
+        help=_("Queue L3 driver postcommit operations in the database and "
+               "run them in the background instead of before the API "
+               "response; routers stay in PENDING_* until they ran")),
+    cfg.IntOpt(
+        'l3_driver_async_workers',
+        default=4,
+        help=_("Number of routers whose queued L3 driver operations are "
+               "run concurrently")),
+    cfg.IntOpt(
+        'l3_driver_async_poll_interval',
+        default=5,
+        help=_("Seconds between two scans of the L3 driver job queue")),
+    cfg.IntOpt(
+        'l3_driver_async_max_attempts',
+        default=3,
+        help=_("Runs of a failing L3 driver operation before the router "
+               "is put in ERROR")),
+    cfg.IntOpt(
+        'l3_driver_async_job_timeout',
+        default=600,
+        help=_("Seconds after which a running L3 driver operation is "
+               "considered abandoned and run again")),
 ]
 
 cfg.CONF.register_opts(OPTS)
@@ -67,6 +93,7 @@ class L3DriverContext(object):
 class RouterContext(L3DriverContext):
 
     def __init__(self, router, old_router=None, router_update=None):
+        super(RouterContext, self).__init__()
         self._router = router
         self._original_router = old_router
         self._router_update = router_update
@@ -87,6 +114,7 @@ class RouterContext(L3DriverContext):
 class RouterPortContext(L3DriverContext):
 
     def __init__(self, port, old_port=None):
+        super(RouterPortContext, self).__init__()
         self._port = port
         self._original_port = old_port
 
@@ -110,6 +138,7 @@ class RouterPortContext(L3DriverContext):
 class FloatingIPContext(L3DriverContext):
 
     def __init__(self, fip, old_fip=None):
+        super(FloatingIPContext, self).__init__()
         self._fip = fip
         self._original_fip = old_fip
 
@@ -130,6 +159,28 @@ class FloatingIPContext(L3DriverContext):
         return self._original_fip.get('router_id')
 
 
+def _context_to_dict(ctx):
+    data = {'type': ctx.__class__.__name__,
+            'current': ctx.current,
+            'original': ctx.original,
+            'params': ctx.params}
+    if isinstance(ctx, RouterContext):
+        data['update'] = ctx.update
+    return data
+
+
+def _context_from_dict(data):
+    if data['type'] == RouterContext.__name__:
+        ctx = RouterContext(data['current'], data['original'],
+                            data['update'])
+    elif data['type'] == RouterPortContext.__name__:
+        ctx = RouterPortContext(data['current'], data['original'])
+    else:
+        ctx = FloatingIPContext(data['current'], data['original'])
+    ctx.params = data['params']
+    return ctx
+
+
 class L3RouterPluginRpcCallbacks(l3_rpc_base.L3RpcCallbackMixin):
 
     RPC_API_VERSION = '1.1'
@@ -165,6 +216,15 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
         self.router_scheduler = importutils.import_object(
             cfg.CONF.router_scheduler_driver)
         self.driver = importutils.import_object(cfg.CONF.l3_driver)
+        self._job_queue = None
+        if cfg.CONF.l3_driver_async:
+            self._job_queue = job_queue.JobQueue(
+                self._run_postcommit_job,
+                workers=cfg.CONF.l3_driver_async_workers,
+                poll_interval=cfg.CONF.l3_driver_async_poll_interval,
+                max_attempts=cfg.CONF.l3_driver_async_max_attempts,
+                job_timeout=cfg.CONF.l3_driver_async_job_timeout)
+            self._job_queue.start()
 
     def setup_rpc(self):
         # RPC support
@@ -178,6 +238,28 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
                                   fanout=False)
         self.conn.consume_in_thread()
 
+    def _enqueue_postcommit(self, context, method, ctx, router_id,
+                            router_status=constants.PENDING_UPDATE):
+        """In asynchronous mode, queue a driver postcommit.
+
+        Must be called inside the transaction of the change, so that the
+        job is stored if and only if the change is.
+        """
+        if self._job_queue is None:
+            return
+        job_queue.enqueue(context, router_id, method, _context_to_dict(ctx),
+                          router_status=router_status)
+
+    def _postcommit(self, context, method, ctx):
+        """Run a driver postcommit, or wake up the queue that will."""
+        if self._job_queue is not None:
+            self._job_queue.wake()
+        else:
+            getattr(self.driver, method)(context, ctx)
+
+    def _run_postcommit_job(self, context, method, data):
+        getattr(self.driver, method)(context, _context_from_dict(data))
+
     def get_plugin_type(self):
         return constants.L3_ROUTER_NAT
 
@@ -210,6 +292,7 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
         @return: dict with router info
         """
         r_data = router['router']
+        self.driver.create_router_prepare(context, RouterContext(r_data))
 
         with context.session.begin(subtransactions=True):
             r = super(L3RouterPlugin, self).create_router(context,
@@ -217,8 +300,13 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
 
             r_ctx = RouterContext(r)
             self.driver.create_router_precommit(context, r_ctx)
+            self._enqueue_postcommit(context, 'create_router_postcommit',
+                                     r_ctx, r['id'],
+                                     router_status=constants.PENDING_CREATE)
 
-        self.driver.create_router_postcommit(context, r_ctx)
+        self._postcommit(context, 'create_router_postcommit', r_ctx)
+        if self._job_queue is not None:
+            r['status'] = constants.PENDING_CREATE
 
         return r
 
@@ -236,8 +324,12 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
             r = super(L3RouterPlugin, self).update_router(context, id, router)
             r_ctx = RouterContext(r, old_r, update)
             self.driver.update_router_precommit(context, r_ctx)
+            self._enqueue_postcommit(context, 'update_router_postcommit',
+                                     r_ctx, id)
 
-        self.driver.update_router_postcommit(context, r_ctx)
+        self._postcommit(context, 'update_router_postcommit', r_ctx)
+        if self._job_queue is not None:
+            r['status'] = constants.PENDING_UPDATE
 
         return r
 
@@ -253,8 +345,10 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
             super(L3RouterPlugin, self).delete_router(context, id)
             r_ctx = RouterContext(None, old_r)
             self.driver.delete_router_precommit(context, r_ctx)
+            self._enqueue_postcommit(context, 'delete_router_postcommit',
+                                     r_ctx, id, router_status=None)
 
-        self.driver.delete_router_postcommit(context, r_ctx)
+        self._postcommit(context, 'delete_router_postcommit', r_ctx)
 
     def add_router_interface(self, context, id, interface_info):
         """Add interface to Neutron router.
@@ -270,8 +364,11 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
             p = self.get_port(context, ret['port_id'])
             rp_ctx = RouterPortContext(p)
             self.driver.add_router_interface_precommit(context, rp_ctx)
+            self._enqueue_postcommit(context,
+                                     'add_router_interface_postcommit',
+                                     rp_ctx, id)
 
-        self.driver.add_router_interface_postcommit(context, rp_ctx)
+        self._postcommit(context, 'add_router_interface_postcommit', rp_ctx)
 
         return ret
 
@@ -304,12 +401,17 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
                 pass
 
         with context.session.begin(subtransactions=True):
+            rp_ctx = RouterPortContext(None, old_p)
+            self.driver.remove_router_interface_prepare(context, rp_ctx)
             ret = super(L3RouterPlugin, self).remove_router_interface(
                 context, id, interface_info)
-            rp_ctx = RouterPortContext(None, old_p)
             self.driver.remove_router_interface_precommit(context, rp_ctx)
+            self._enqueue_postcommit(context,
+                                     'remove_router_interface_postcommit',
+                                     rp_ctx, id)
 
-        self.driver.remove_router_interface_postcommit(context, rp_ctx)
+        self._postcommit(context, 'remove_router_interface_postcommit',
+                         rp_ctx)
         return ret
 
     def create_floatingip(self, context, floatingip):
@@ -361,8 +463,11 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
                     context, id, floatingip)
                 fip_ctx = FloatingIPContext(fip, old_fip)
                 self.driver.update_floatingip_precommit(context, fip_ctx)
+                self._enqueue_postcommit(context,
+                                         'update_floatingip_postcommit',
+                                         fip_ctx, old_router_id)
 
-            self.driver.update_floatingip_postcommit(context, fip_ctx)
+            self._postcommit(context, 'update_floatingip_postcommit', fip_ctx)
             return fip
 
         with context.session.begin(subtransactions=True):
@@ -377,8 +482,10 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
                 fip_ctx = FloatingIPContext(fip)
 
             self.driver.update_floatingip_precommit(context, fip_ctx)
+            self._enqueue_postcommit(context, 'update_floatingip_postcommit',
+                                     fip_ctx, new_router_id or old_router_id)
 
-        self.driver.update_floatingip_postcommit(context, fip_ctx)
+        self._postcommit(context, 'update_floatingip_postcommit', fip_ctx)
 
         return fip
 
@@ -396,8 +503,11 @@ class L3RouterPlugin(db_base_plugin_v2.NeutronDbPluginV2,
                 super(L3RouterPlugin, self).delete_floatingip(context, id)
                 fip_ctx = FloatingIPContext(None, old_fip)
                 self.driver.delete_floatingip_precommit(context, fip_ctx)
+                self._enqueue_postcommit(context,
+                                         'delete_floatingip_postcommit',
+                                         fip_ctx, router_id)
 
-            self.driver.delete_floatingip_postcommit(context, fip_ctx)
+            self._postcommit(context, 'delete_floatingip_postcommit', fip_ctx)
         else:
             super(L3RouterPlugin, self).delete_floatingip(context, id)
 
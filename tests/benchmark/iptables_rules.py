@@ -0,0 +1,225 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Microbenchmark of IptablesManager._modify_rules() on large tables.
+
+Compares _modify_rules() with the substring search based merge it
+replaced, after checking that both give the same iptables-restore input:
+
+    python -m neutron.tests.benchmark.iptables_rules [--rules N] [--runs N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+import timeit
+
+from neutron.agent.linux import iptables_manager
+
+
+def _legacy_find_last_entry(filter_list, match_str):
+    # find a matching entry, starting from the bottom
+    for s in reversed(filter_list):
+        s = s.strip()
+        if match_str in s:
+            return s
+
+
+def legacy_modify_rules(manager, current_lines, table, table_name):
+    """_modify_rules() as it was before the entries were indexed."""
+    unwrapped_chains = table.unwrapped_chains
+    chains = table.chains
+    remove_chains = table.remove_chains
+    rules = table.rules
+    remove_rules = table.remove_rules
+
+    if not current_lines:
+        current_lines = ['# Generated by iptables_manager',
+                         '*' + table_name, 'COMMIT',
+                         '# Completed by iptables_manager']
+
+    old_filter, new_filter = [], []
+    for line in current_lines:
+        (old_filter if manager.wrap_name in line else
+         new_filter).append(line.strip())
+
+    rules_index = manager._find_rules_index(new_filter)
+
+    all_chains = [':%s' % name for name in unwrapped_chains]
+    all_chains += [':%s-%s' % (manager.wrap_name, name) for name in chains]
+
+    our_chains = []
+    for chain in all_chains:
+        chain_str = str(chain).strip()
+        old = _legacy_find_last_entry(old_filter, chain_str)
+        if not old:
+            dup = _legacy_find_last_entry(new_filter, chain_str)
+        new_filter = [s for s in new_filter if chain_str not in s.strip()]
+        if old or dup:
+            chain_str = str(old or dup)
+        else:
+            chain_str += ' - [0:0]'
+        our_chains += [chain_str]
+
+    our_rules = []
+    bot_rules = []
+    for rule in rules:
+        rule_str = str(rule).strip()
+        old = _legacy_find_last_entry(old_filter, rule_str)
+        if not old:
+            dup = _legacy_find_last_entry(new_filter, rule_str)
+        new_filter = [s for s in new_filter if rule_str not in s.strip()]
+        if old or dup:
+            rule_str = str(old or dup)
+            if not old:
+                rules_index -= 1
+        else:
+            rule_str = '[0:0] ' + rule_str
+        if rule.top:
+            our_rules += [rule_str]
+        else:
+            bot_rules += [rule_str]
+
+    our_rules += bot_rules
+
+    new_filter[rules_index:rules_index] = our_rules
+    new_filter[rules_index:rules_index] = our_chains
+
+    strip = iptables_manager._strip_packets_bytes
+    seen_chains = set()
+    seen_rules = set()
+
+    def _weed_out(line):
+        if line.startswith(':'):
+            line = strip(line)
+            if line in seen_chains:
+                return False
+            seen_chains.add(line)
+            for chain in remove_chains:
+                if chain == line:
+                    remove_chains.remove(chain)
+                    return False
+        elif line.startswith('['):
+            line = strip(line)
+            if line in seen_rules:
+                return False
+            seen_rules.add(line)
+            for rule in remove_rules:
+                if strip(str(rule)) == line:
+                    remove_rules.remove(rule)
+                    return False
+        return True
+
+    new_filter.reverse()
+    new_filter = [line for line in new_filter if _weed_out(line)]
+    new_filter.reverse()
+
+    remove_chains.clear()
+    for rule in remove_rules:
+        remove_rules.remove(rule)
+
+    return new_filter
+
+
+def build_manager(rules):
+    """Build an L3 agent like manager with about rules NAT rules.
+
+    Every floating IP gets a DNAT, an OUTPUT DNAT and an SNAT rule, the
+    way the L3 agent adds them, plus a filter rule for its fixed IP.
+
+    @param rules: number of NAT rules to generate
+    @return: (IptablesManager, current iptables-save lines of its nat
+        and filter tables)
+    """
+    manager = iptables_manager.IptablesManager(state_less=False)
+    nat = manager.ipv4['nat']
+    flt = manager.ipv4['filter']
+    nat.add_chain('float-snat')
+    nat.add_rule('snat', '-j $float-snat')
+    for i in range(rules // 3):
+        floating = '172.%d.%d.%d/32' % (16 + i // 65536, i // 256 % 256,
+                                        i % 256)
+        fixed = '10.%d.%d.%d/32' % (i // 65536, i // 256 % 256, i % 256)
+        nat.add_rule('PREROUTING', '-d %s -j DNAT --to %s' %
+                     (floating, fixed))
+        nat.add_rule('OUTPUT', '-d %s -j DNAT --to %s' % (floating, fixed))
+        nat.add_rule('float-snat', '-s %s -j SNAT --to %s' %
+                     (fixed, floating))
+        flt.add_rule('FORWARD', '-d %s -j ACCEPT' % fixed)
+    # A chain of another tool, removed below
+    flt.add_chain('ext', wrap=False)
+    flt.add_rule('ext', '-j DROP', wrap=False)
+
+    current = []
+    for name, table in (('nat', nat), ('filter', flt)):
+        lines = manager._modify_rules([], table, name)
+        # Give every entry its own counters, as on a busy router
+        current += ['[%d:%d] %s' % (i, i * 64, line.split('] ', 1)[1])
+                    if line.startswith('[') else line
+                    for i, line in enumerate(lines)]
+    current.insert(len(current) - 2, '[9:576] -A FORWARD -j external')
+
+    # Schedule a change in every table, as an update would
+    nat.remove_rule('OUTPUT', nat.rules[-1].rule)
+    nat.add_rule('PREROUTING', '-d 192.0.2.1/32 -j DNAT --to 10.255.0.1/32')
+    flt.remove_chain('ext', wrap=False)
+    return manager, current
+
+
+def _modify(modify, manager, current):
+    for name in ('nat', 'filter'):
+        start, end = manager._find_table(current, name)
+        yield modify(current[start:end], manager.ipv4[name], name)
+
+
+def run(rules, runs):
+    manager, current = build_manager(rules)
+    legacy_manager = build_manager(rules)[0]
+    if (list(_modify(manager._modify_rules, manager, current)) !=
+            list(_modify(lambda *args: legacy_modify_rules(legacy_manager,
+                                                           *args),
+                         legacy_manager, current))):
+        raise AssertionError('_modify_rules() and legacy merge differ')
+
+    legacy = min(timeit.repeat(
+        lambda: list(_modify(lambda *args: legacy_modify_rules(
+            legacy_manager, *args), legacy_manager, current)),
+        number=1, repeat=runs))
+    indexed = min(timeit.repeat(
+        lambda: list(_modify(manager._modify_rules, manager, current)),
+        number=1, repeat=runs))
+
+    print('rules: %d, iptables-save lines: %d' % (
+        sum(len(table.rules) for table in manager.ipv4.values()),
+        len(current)))
+    print('legacy merge:     %10.2f ms' % (legacy * 1000))
+    print('_modify_rules():  %10.2f ms' % (indexed * 1000))
+    print('speedup:          %10.2fx' % (legacy / indexed))
+    return legacy, indexed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', type=int, default=20000,
+                        help='NAT rules to generate')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='timed runs; the fastest is reported')
+    args = parser.parse_args(argv)
+    run(args.rules, args.runs)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
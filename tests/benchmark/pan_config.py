@@ -0,0 +1,154 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Microbenchmark of PanConfig.python() on large generated configs.
+
+Compares PanConfig.python() with the recursive converter it replaced,
+after checking that both give the same result:
+
+    python -m neutron.tests.benchmark.pan_config [--entries N] [--runs N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+import timeit
+import xml.etree.ElementTree as etree
+
+from neutron.services.l3_router.drivers.pan.connector.xml_api import config
+
+_tags_forcelist = set(['entry', 'member'])
+
+
+def legacy_python(elem):
+    """Recursive PanConfig.python() conversion it was replaced with."""
+    d = {}
+    _legacy_serialize(elem, d)
+    return d
+
+
+def _legacy_serialize(elem, obj, forcelist=False):
+    tag = elem.tag
+    text = elem.text
+    text_strip = None
+    if text:
+        text_strip = text.strip()
+    attrs = elem.items()
+
+    config.LOG.debug(_('TAG(forcelist=%(forcelist)s): "%(tag)s"'),
+                     {'forcelist': forcelist,
+                      'tag': tag})
+
+    if forcelist:
+        if tag not in obj:
+            obj[tag] = []
+        if not len(elem) and not text_strip and not attrs:
+            obj[tag].append(None)
+            return
+        if not len(elem) and text_strip and not attrs:
+            obj[tag].append(text)
+            return
+        obj[tag].append({})
+        o = obj[tag][-1]
+    else:
+        if not len(elem) and not text_strip and not attrs:
+            obj[tag] = None
+            return
+        if not len(elem) and text_strip and not attrs:
+            if text_strip == 'yes':
+                obj[tag] = True
+            elif text_strip == 'no':
+                obj[tag] = False
+            else:
+                obj[tag] = text
+            return
+        obj[tag] = {}
+        o = obj[tag]
+
+    for k, v in attrs:
+        o[k] = v
+    if text_strip:
+        o[tag] = text
+
+    if len(elem):
+        tags = {}
+        for e in elem:
+            if e.tag in tags:
+                tags[e.tag] += 1
+            else:
+                tags[e.tag] = 1
+        for e in elem:
+            _legacy_serialize(e, o, e.tag in _tags_forcelist or
+                              tags[e.tag] > 1)
+
+
+def build_config(entries):
+    """Build a show response with entries VLAN units and address objects.
+
+    @param entries: number of units and of address objects
+    @return: xml.etree.ElementTree.Element
+    """
+    parts = ['<response status="success"><result><config>'
+             '<units>']
+    for i in range(entries):
+        parts.append(
+            '<entry name="ethernet1/2.%(i)d"><ip><entry name="10.%(a)d.%(b)d'
+            '.1/24"/></ip><tag>%(i)d</tag><comment>port-%(i)d</comment>'
+            '<interface-management-profile>ping</interface-management-'
+            'profile><ipv6><enabled>no</enabled></ipv6></entry>'
+            % {'i': i + 1, 'a': i // 256, 'b': i % 256})
+    parts.append('</units><address>')
+    for i in range(entries):
+        parts.append(
+            '<entry name="addr-%(i)d"><ip-netmask>10.%(a)d.%(b)d.10'
+            '</ip-netmask><tag><member>tenant</member><member>net-%(i)d'
+            '</member><member>host-%(i)d</member></tag></entry>'
+            % {'i': i, 'a': i // 256, 'b': i % 256})
+    parts.append('</address></config></result></response>')
+    return etree.fromstring(''.join(parts))
+
+
+def run(entries, runs):
+    elem = build_config(entries)
+    if config.PanConfig(config=elem).python() != legacy_python(elem):
+        raise AssertionError('PanConfig.python() and legacy converter differ')
+
+    legacy = min(timeit.repeat(lambda: legacy_python(elem),
+                               number=1, repeat=runs))
+    current = min(timeit.repeat(
+        lambda: config.PanConfig(config=elem).python(),
+        number=1, repeat=runs))
+
+    print('entries: %d, elements: %d' % (entries,
+                                         sum(1 for _ in elem.iter())))
+    print('legacy converter:    %8.2f ms' % (legacy * 1000))
+    print('PanConfig.python():  %8.2f ms' % (current * 1000))
+    print('speedup:             %8.2fx' % (legacy / current))
+    return legacy, current
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=5000,
+                        help='VLAN units and address objects to generate')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='timed runs; the fastest is reported')
+    args = parser.parse_args(argv)
+    run(args.entries, args.runs)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,399 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Load benchmark of the PAN drivers against the PAN-OS API simulator.
+
+L3RouterPANDriver and PanoramaMechanismDriver are driven through router
+and port churn, with the Neutron database in sqlite and PAN-OS replaced by
+pan_simulator.PanSimulator served on localhost:
+
+    python -m neutron.tests.benchmark.pan_load [--routers N] [--ports N]
+        [--concurrency N] [--latency S] [--commit-time S] ...
+
+Each operation runs for all routers (concurrently, up to --concurrency)
+before the next one starts. For every operation the API requests and
+commit jobs it caused are reported per call, with the latency
+percentiles of the calls.
+
+The simulator is reached over HTTP unless --certfile and --keyfile are
+given, so that TLS handshakes (and the connection pool sparing them) can
+be measured too.
+"""
+
+from __future__ import print_function
+
+import argparse
+import ssl
+import sys
+import time
+
+import eventlet
+from eventlet import semaphore
+from oslo.config import cfg
+
+from neutron.common import constants
+from neutron import context as neutron_context
+from neutron.db import api as db_api
+from neutron.db import l3_db
+from neutron.db import models_v2
+from neutron.extensions import l3
+from neutron.plugins.ml2 import db as ml2_db
+from neutron.plugins.ml2.drivers import mech_panorama
+from neutron.services.l3_router.drivers.pan import db as pan_db
+from neutron.services.l3_router.drivers.pan import driver as pan_driver
+from neutron.services.l3_router import l3_router_plugin
+from neutron.tests.benchmark import pan_simulator
+
+TENANT_ID = 'bench-tenant'
+EXT_NET_ID = 'bench-ext-net'
+EXT_SUBNET_ID = 'bench-ext-subnet'
+
+OPERATIONS = ['create_router', 'add_gateway', 'add_interface',
+              'create_port', 'delete_port', 'remove_interface',
+              'remove_gateway', 'delete_router']
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non empty list of numbers."""
+    values = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+class StaticInstances(object):
+    """Stands in for the Nova instance cache of the mechanism driver."""
+
+    def get(self, instance_id):
+        return {'image_id': 'bench-image', 'flavor_id': 'bench-flavor',
+                'host': 'bench-host', 'user_id': 'bench-user'}
+
+
+class PortContext(object):
+    """The part of the ML2 PortContext used by PanoramaMechanismDriver."""
+
+    def __init__(self, plugin, plugin_context, port):
+        self._plugin = plugin
+        self._plugin_context = plugin_context
+        self._port = port
+
+
+class Benchmark(object):
+    """Router and port churn against a PanSimulator.
+
+    @param simulator: started PanSimulator with one device per router
+    @param routers: number of routers, each with one tenant network
+    @param ports: compute ports created and deleted per network
+    @param concurrency: routers handled at the same time
+    @param use_http: reach the simulator over HTTP instead of HTTPS
+    """
+
+    def __init__(self, simulator, routers, ports, concurrency,
+                 use_http=True):
+        self.simulator = simulator
+        self.routers = routers
+        self.ports = ports
+        self.pool = eventlet.GreenPool(concurrency)
+        self.context = neutron_context.get_admin_context()
+        self.l3_driver = pan_driver.L3RouterPANDriver()
+        self.mech_driver = mech_panorama.PanoramaMechanismDriver()
+        self.mech_driver.instance_cache = StaticInstances()
+        if use_http:
+            # PANConnector always uses HTTPS; its registry builds every
+            # client from these parameters.
+            self.l3_driver._connector._params['use_http'] = True
+            self.mech_driver.connector._params['use_http'] = True
+        # The mechanism driver keeps the devices found by a port delete
+        # precommit in an attribute until the postcommit, so port deletes
+        # are serialized; their latency includes waiting for the lock.
+        self.mech_lock = semaphore.Semaphore()
+        self.plugin = pan_db.PanDbApi()
+        self.results = []
+
+    def run(self):
+        self._create_external_network()
+        for i in range(self.routers):
+            self._create_tenant_network(i)
+        for operation in OPERATIONS:
+            self.results.append(self._run_operation(operation))
+        return self.results
+
+    def _run_operation(self, operation):
+        func = getattr(self, '_' + operation)
+        calls = [(i,) for i in range(self.routers)]
+        if operation in ('create_port', 'delete_port'):
+            calls = [(i, j) for i in range(self.routers)
+                     for j in range(self.ports)]
+
+        self.simulator.reset_stats()
+        start = time.time()
+        latencies = list(self.pool.starmap(
+            lambda *args: self._timed(func, *args), calls))
+        elapsed = time.time() - start
+        stats = dict(self.simulator.stats)
+        return {'operation': operation,
+                'calls': len(calls),
+                'elapsed': elapsed,
+                'requests': stats.get('requests', 0),
+                'commits': stats.get('commit_jobs', 0),
+                'errors': stats.get('errors', 0),
+                'stats': stats,
+                'latencies': latencies}
+
+    def _timed(self, func, *args):
+        start = time.time()
+        func(*args)
+        return time.time() - start
+
+    def _add(self, *rows):
+        with self.context.session.begin(subtransactions=True):
+            for row in rows:
+                self.context.session.add(row)
+
+    def _create_external_network(self):
+        self._add(models_v2.Network(id=EXT_NET_ID, name='ext',
+                                    tenant_id=TENANT_ID, status='ACTIVE',
+                                    admin_state_up=True, shared=False),
+                  models_v2.Subnet(id=EXT_SUBNET_ID, network_id=EXT_NET_ID,
+                                   tenant_id=TENANT_ID, ip_version=4,
+                                   cidr='172.16.0.0/16',
+                                   gateway_ip='172.16.0.1',
+                                   enable_dhcp=False, shared=False))
+
+    def _create_tenant_network(self, i):
+        net_id = 'bench-net-%d' % i
+        self._add(models_v2.Network(id=net_id, name=net_id,
+                                    tenant_id=TENANT_ID, status='ACTIVE',
+                                    admin_state_up=True, shared=False),
+                  models_v2.Subnet(id='bench-subnet-%d' % i,
+                                   network_id=net_id, tenant_id=TENANT_ID,
+                                   ip_version=4, cidr=self._cidr(i),
+                                   gateway_ip=self._ip(i, 1),
+                                   enable_dhcp=False, shared=False))
+        ml2_db.add_network_segment(self.context.session, net_id,
+                                   {'network_type': 'vlan',
+                                    'physical_network': 'physnet',
+                                    'segmentation_id': 100 + i})
+
+    def _cidr(self, i):
+        return '10.%d.%d.0/24' % (i // 256, i % 256)
+
+    def _ip(self, i, host):
+        return '10.%d.%d.%d' % (i // 256, i % 256, host)
+
+    def _router(self, i, gw_port_id=None):
+        return {'id': 'bench-router-%d' % i, 'tenant_id': TENANT_ID,
+                'name': 'router-%d' % i, 'gw_port_id': gw_port_id}
+
+    def _add_port(self, port_id, network_id, subnet_id, ip, device_id,
+                  device_owner):
+        self._add(models_v2.Port(id=port_id, network_id=network_id,
+                                 tenant_id=TENANT_ID,
+                                 mac_address='fa:16:3e:%s' % port_id[-8:],
+                                 status='ACTIVE', admin_state_up=True,
+                                 device_id=device_id,
+                                 device_owner=device_owner),
+                  models_v2.IPAllocation(port_id=port_id, ip_address=ip,
+                                         subnet_id=subnet_id,
+                                         network_id=network_id))
+        return {'id': port_id, 'network_id': network_id,
+                'tenant_id': TENANT_ID, 'device_id': device_id,
+                'device_owner': device_owner, 'security_groups': [],
+                'fixed_ips': [{'subnet_id': subnet_id, 'ip_address': ip}]}
+
+    def _delete_port_row(self, port_id):
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.query(models_v2.Port).filter_by(
+                id=port_id).delete()
+
+    def _create_router(self, i):
+        router = self._router(i)
+        self._add(l3_db.Router(id=router['id'], tenant_id=TENANT_ID,
+                               name=router['name'], status='ACTIVE',
+                               admin_state_up=True))
+        r_ctx = l3_router_plugin.RouterContext(router)
+        self.l3_driver.create_router_prepare(self.context, r_ctx)
+        self.l3_driver.create_router_precommit(self.context, r_ctx)
+        self.l3_driver.create_router_postcommit(self.context, r_ctx)
+
+    def _add_gateway(self, i):
+        gw_port_id = 'bench-gw-%08d' % i
+        self._add_port(gw_port_id, EXT_NET_ID, EXT_SUBNET_ID,
+                       '172.16.%d.%d' % (i // 250, i % 250 + 2),
+                       'bench-router-%d' % i,
+                       constants.DEVICE_OWNER_ROUTER_GW)
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.query(l3_db.Router).filter_by(
+                id='bench-router-%d' % i).update({'gw_port_id': gw_port_id})
+        r_ctx = l3_router_plugin.RouterContext(
+            self._router(i, gw_port_id), self._router(i),
+            {l3.EXTERNAL_GW_INFO: {'network_id': EXT_NET_ID}})
+        self.l3_driver.update_router_precommit(self.context, r_ctx)
+        self.l3_driver.update_router_postcommit(self.context, r_ctx)
+
+    def _add_interface(self, i):
+        port = self._add_port('bench-if-%08d' % i, 'bench-net-%d' % i,
+                              'bench-subnet-%d' % i, self._ip(i, 1),
+                              'bench-router-%d' % i,
+                              constants.DEVICE_OWNER_ROUTER_INTF)
+        rp_ctx = l3_router_plugin.RouterPortContext(port)
+        self.l3_driver.add_router_interface_precommit(self.context, rp_ctx)
+        self.l3_driver.add_router_interface_postcommit(self.context, rp_ctx)
+
+    def _compute_port_id(self, i, j):
+        return 'bench-vm-%04d%04d' % (i, j)
+
+    def _create_port(self, i, j):
+        port = self._add_port(self._compute_port_id(i, j),
+                              'bench-net-%d' % i, 'bench-subnet-%d' % i,
+                              self._ip(i, 10 + j), 'bench-vm-%d-%d' % (i, j),
+                              'compute:nova')
+        self.mech_driver.create_port_postcommit(
+            PortContext(self.plugin, self.context, port))
+
+    def _delete_port(self, i, j):
+        port_id = self._compute_port_id(i, j)
+        port = {'id': port_id, 'network_id': 'bench-net-%d' % i,
+                'device_owner': 'compute:nova',
+                'fixed_ips': [{'subnet_id': 'bench-subnet-%d' % i,
+                               'ip_address': self._ip(i, 10 + j)}]}
+        ctx = PortContext(self.plugin, self.context, port)
+        with self.mech_lock:
+            self.mech_driver.delete_port_precommit(ctx)
+            self._delete_port_row(port_id)
+            self.mech_driver.delete_port_postcommit(ctx)
+
+    def _remove_interface(self, i):
+        port_id = 'bench-if-%08d' % i
+        port = {'id': port_id, 'device_id': 'bench-router-%d' % i}
+        rp_ctx = l3_router_plugin.RouterPortContext(None, port)
+        self.l3_driver.remove_router_interface_precommit(self.context,
+                                                         rp_ctx)
+        self._delete_port_row(port_id)
+        self.l3_driver.remove_router_interface_postcommit(self.context,
+                                                          rp_ctx)
+
+    def _remove_gateway(self, i):
+        gw_port_id = 'bench-gw-%08d' % i
+        r_ctx = l3_router_plugin.RouterContext(
+            self._router(i), self._router(i, gw_port_id),
+            {l3.EXTERNAL_GW_INFO: {}})
+        self.l3_driver.update_router_precommit(self.context, r_ctx)
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.query(l3_db.Router).filter_by(
+                id='bench-router-%d' % i).update({'gw_port_id': None})
+        self._delete_port_row(gw_port_id)
+        self.l3_driver.update_router_postcommit(self.context, r_ctx)
+
+    def _delete_router(self, i):
+        r_ctx = l3_router_plugin.RouterContext(None, self._router(i))
+        self.l3_driver.delete_router_precommit(self.context, r_ctx)
+        with self.context.session.begin(subtransactions=True):
+            self.context.session.query(l3_db.Router).filter_by(
+                id='bench-router-%d' % i).delete()
+        self.l3_driver.delete_router_postcommit(self.context, r_ctx)
+
+
+def report(results):
+    print('%-17s %6s %9s %9s %9s %8s %8s %8s %6s'
+          % ('operation', 'calls', 'req/call', 'commit/c', 'total s',
+             'p50 ms', 'p90 ms', 'p99 ms', 'errors'))
+    for r in results:
+        latencies = r['latencies']
+        print('%-17s %6d %9.2f %9.2f %9.2f %8.1f %8.1f %8.1f %6d'
+              % (r['operation'], r['calls'],
+                 float(r['requests']) / r['calls'],
+                 float(r['commits']) / r['calls'],
+                 r['elapsed'],
+                 percentile(latencies, 50) * 1000,
+                 percentile(latencies, 90) * 1000,
+                 percentile(latencies, 99) * 1000,
+                 r['errors']))
+    print()
+    for r in results:
+        print('%-17s %s' % (r['operation'], ', '.join(
+            '%s=%d' % item for item in sorted(r['stats'].items())
+            if item[0] not in ('requests', 'errors', 'commit_jobs'))))
+
+
+def configure(args, port):
+    overrides = {'pan_host': '127.0.0.1',
+                 'pan_port': str(port),
+                 'pan_username': 'admin',
+                 'pan_password': 'admin',
+                 'pan_api_key': None,
+                 'pan_device_sync_interval': 0,
+                 'pan_reconcile_interval': 0,
+                 'pan_commit_window': args.commit_window,
+                 'pan_multi_config': not args.no_multi_config,
+                 'pan_config_cache_ttl': args.cache_ttl,
+                 'pan_connection_pool_size': args.pool_size,
+                 'pan_job_poll_interval': args.poll_interval}
+    for name, value in overrides.items():
+        cfg.CONF.set_override(name, value)
+    cfg.CONF.set_override('connection', 'sqlite://', 'database')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routers', type=int, default=20,
+                        help='routers (and PAN devices) to create')
+    parser.add_argument('--ports', type=int, default=5,
+                        help='compute ports per router network')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='routers handled at the same time')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='simulated seconds per API request')
+    parser.add_argument('--commit-time', type=float, default=0.5,
+                        help='simulated seconds per commit job')
+    parser.add_argument('--commit-window', type=float, default=0.0,
+                        help='pan_commit_window')
+    parser.add_argument('--cache-ttl', type=int, default=300,
+                        help='pan_config_cache_ttl')
+    parser.add_argument('--pool-size', type=int, default=4,
+                        help='pan_connection_pool_size')
+    parser.add_argument('--poll-interval', type=float, default=0.1,
+                        help='pan_job_poll_interval')
+    parser.add_argument('--no-multi-config', action='store_true',
+                        help='disable pan_multi_config')
+    parser.add_argument('--certfile',
+                        help='PEM certificate to serve HTTPS with')
+    parser.add_argument('--keyfile',
+                        help='PEM private key of --certfile')
+    args = parser.parse_args(argv)
+
+    eventlet.monkey_patch()
+    if args.certfile:
+        # The simulator certificate is self-signed (PEP 476 opt-out)
+        ssl._create_default_https_context = ssl._create_unverified_context
+
+    simulator = pan_simulator.PanSimulator(
+        latency=args.latency, commit_time=args.commit_time,
+        certfile=args.certfile, keyfile=args.keyfile)
+    for i in range(args.routers):
+        simulator.add_device('0079%08d' % i)
+    port = simulator.start()
+    try:
+        configure(args, port)
+        db_api.configure_db()
+        results = Benchmark(simulator, args.routers, args.ports,
+                            args.concurrency,
+                            use_http=not args.certfile).run()
+    finally:
+        simulator.stop()
+    report(results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
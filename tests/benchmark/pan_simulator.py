@@ -0,0 +1,532 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-memory simulator of the PAN-OS XML API.
+
+PanSimulator serves /api/ over HTTP or HTTPS and keeps a candidate and a
+running configuration tree for Panorama and for every managed device
+(selected with the target parameter). It implements what PANConnector
+uses:
+
+- type=keygen
+- type=config, action show/get/set/edit/delete/move/multi-config; xpaths
+  may only use [@name='...'] and [text()='...'] predicates
+- type=user-id register/unregister messages
+- type=commit, run as an asynchronous job that takes commit_time seconds;
+  commits of the same target run one after the other
+- type=op 'show jobs id N'
+
+Every request waits latency seconds before being answered. Errors are
+answered with HTTP status 200 and a status="error" response, like PAN-OS
+does for configuration errors.
+"""
+
+import BaseHTTPServer
+import collections
+import copy
+import itertools
+import re
+import SocketServer
+import ssl
+import threading
+import time
+import urlparse
+import xml.etree.ElementTree as etree
+from xml.sax import saxutils
+
+DEVICE_CONFIG = (
+    "<config><devices><entry name='localhost.localdomain'>"
+    "<network>"
+    "<interface><ethernet>"
+    "<entry name='ethernet1/1'><layer3/></entry>"
+    "<entry name='ethernet1/2'><layer3><units/></layer3></entry>"
+    "</ethernet></interface>"
+    "<virtual-router><entry name='default'><interface/></entry>"
+    "</virtual-router>"
+    "</network>"
+    "<vsys><entry name='vsys1'>"
+    "<zone/><address/><service/>"
+    "<rulebase><nat><rules/></nat><security><rules/></security></rulebase>"
+    "</entry></vsys>"
+    "</entry></devices></config>")
+
+PANORAMA_CONFIG = (
+    "<config><devices><entry name='localhost.localdomain'>"
+    "<device-group/>"
+    "</entry></devices><mgt-config><devices/></mgt-config></config>")
+
+_STEP_RE = re.compile(r"/([^/\[\]]+)((?:\[[^\]]*\])*)")
+_PREDICATE_RE = re.compile(r"\[(@name|text\(\))=(['\"])(.*?)\2\]")
+
+
+class SimulatorError(Exception):
+    """Request refused; answered as a status="error" response."""
+
+    def __init__(self, msg, code=None):
+        super(SimulatorError, self).__init__(msg)
+        self.msg = msg
+        self.code = code
+
+    def body(self):
+        return saxutils.escape(self.msg)
+
+
+class _UidError(SimulatorError):
+    """User-ID message partly ignored; answered with the entry messages."""
+
+    def __init__(self, entries):
+        super(_UidError, self).__init__('tags already exist')
+        self._entries = entries
+
+    def body(self):
+        return ('<line><uid-response><payload><register>%s</register>'
+                '</payload></uid-response></line>' % self._entries)
+
+
+def parse_xpath(xpath):
+    """Split an xpath into a list of (tag, name, text) steps."""
+    steps = []
+    pos = 0
+    while pos < len(xpath):
+        m = _STEP_RE.match(xpath, pos)
+        if m is None:
+            raise SimulatorError('Malformed xpath: %s' % xpath)
+        tag, predicates = m.groups()
+        name = text = None
+        matched = ''
+        for p in _PREDICATE_RE.finditer(predicates):
+            matched += p.group(0)
+            if p.group(1) == '@name':
+                name = p.group(3)
+            else:
+                text = p.group(3)
+        if matched != predicates:
+            raise SimulatorError('Unsupported xpath predicate: %s'
+                                 % predicates)
+        steps.append((tag, name, text))
+        pos = m.end()
+    if not steps:
+        raise SimulatorError('Malformed xpath: %s' % xpath)
+    return steps
+
+
+def _matches(elem, tag, name, text):
+    return (elem.tag == tag and
+            (name is None or elem.get('name') == name) and
+            (text is None or (elem.text or '') == text))
+
+
+def find(root, steps, create=False):
+    """Return the (parent, element) pairs selected by xpath steps.
+
+    @param root: document element, the parent of <config>
+    @param steps: result of parse_xpath()
+    @param create: create the missing elements of the path
+    """
+    nodes = [(None, root)]
+    for tag, name, text in steps:
+        found = [(node, child) for _parent, node in nodes
+                 for child in node if _matches(child, tag, name, text)]
+        if not found and create and len(nodes) == 1:
+            node = nodes[0][1]
+            child = etree.SubElement(node, tag)
+            if name is not None:
+                child.set('name', name)
+            if text is not None:
+                child.text = text
+            found = [(node, child)]
+        if not found:
+            return []
+        nodes = found
+    return nodes
+
+
+def merge(node, new):
+    """Merge the children of new into node, like a PAN-OS set."""
+    for child in list(new):
+        if child.get('name') is not None:
+            existing = next((e for e in node if e.tag == child.tag and
+                             e.get('name') == child.get('name')), None)
+        elif child.tag == 'member':
+            existing = next((e for e in node if e.tag == 'member' and
+                             e.text == child.text), None)
+        else:
+            existing = node.find(child.tag)
+        if existing is None:
+            node.append(child)
+        elif len(child):
+            merge(existing, child)
+        else:
+            existing.text = child.text
+
+
+def parse_fragment(element):
+    """Parse the (possibly several) top-level elements of a request."""
+    try:
+        return list(etree.fromstring('<root>%s</root>' % element))
+    except etree.ParseError as e:
+        raise SimulatorError('Malformed element: %s' % e)
+
+
+class Job(object):
+
+    def __init__(self, job_id, target, start, finish):
+        self.id = job_id
+        self.target = target
+        self.start = start
+        self.finish = finish
+
+    def status(self, now):
+        if now < self.start:
+            return 'PEND'
+        if now < self.finish:
+            return 'ACT'
+        return 'FIN'
+
+
+class PanSimulator(object):
+    """PAN-OS XML API simulator.
+
+    @param latency: seconds every request waits before being answered
+    @param commit_time: seconds a commit job runs
+    @param username: user name accepted by keygen
+    @param password: password accepted by keygen
+    @param device_group: Panorama device group holding the added devices
+    @param certfile: PEM certificate to serve HTTPS with; HTTP if None
+    @param keyfile: PEM private key of certfile
+    """
+
+    def __init__(self, latency=0.0, commit_time=0.0, username='admin',
+                 password='admin', device_group='default', certfile=None,
+                 keyfile=None):
+        self.latency = latency
+        self.commit_time = commit_time
+        self.username = username
+        self.password = password
+        self.device_group = device_group
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+        self._keys = set()
+        self._key_ids = itertools.count(1)
+        self._job_ids = itertools.count(1)
+        self._jobs = {}
+        self._last_finish = {}
+        self._candidate = {None: self._document(PANORAMA_CONFIG)}
+        self._running = {None: copy.deepcopy(self._candidate[None])}
+        self._dirty = set()
+        self._registered = {}
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def _document(config):
+        root = etree.Element('root')
+        root.append(etree.fromstring(config))
+        return root
+
+    def add_device(self, serial):
+        """Add a device managed by Panorama, member of device_group."""
+        with self._lock:
+            panorama = self._candidate[None]
+            find(panorama, parse_xpath(
+                "/config/devices/entry[@name='localhost.localdomain']"
+                "/device-group/entry[@name='%s']/devices/entry[@name='%s']"
+                % (self.device_group, serial)), create=True)
+            find(panorama, parse_xpath(
+                "/config/mgt-config/devices/entry[@name='%s']" % serial),
+                create=True)
+            self._running[None] = copy.deepcopy(panorama)
+            self._candidate[serial] = self._document(DEVICE_CONFIG)
+            self._running[serial] = copy.deepcopy(self._candidate[serial])
+            self._registered[serial] = {}
+
+    def config(self, target=None, running=False):
+        """Return a copy of the <config> element of a target."""
+        trees = self._running if running else self._candidate
+        with self._lock:
+            return copy.deepcopy(trees[target].find('config'))
+
+    def registered(self, target):
+        """Return the ip -> set of tags registered on a device."""
+        with self._lock:
+            return dict((ip, set(tags))
+                        for ip, tags in self._registered[target].items())
+
+    def revoke_keys(self):
+        """Make every API key generated so far invalid."""
+        with self._lock:
+            self._keys.clear()
+
+    def reset_stats(self):
+        self.stats.clear()
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve the API in a background thread.
+
+        @return: port the simulator listens on
+        """
+        self._server = _Server((host, port), _Handler)
+        self._server.simulator = self
+        if self.certfile:
+            self._server.socket = ssl.wrap_socket(
+                self._server.socket, certfile=self.certfile,
+                keyfile=self.keyfile, server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def handle(self, query):
+        """Answer an API request.
+
+        @param query: dict of the request parameters
+        @return: XML response document
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        req_type = query.get('type')
+        name = req_type
+        if req_type == 'config':
+            name = '%s/%s' % (req_type, query.get('action'))
+        self.stats['requests'] += 1
+        self.stats[name] += 1
+        try:
+            with self._lock:
+                result = self._dispatch(req_type, query)
+        except SimulatorError as e:
+            self.stats['errors'] += 1
+            code = ' code="%s"' % e.code if e.code else ''
+            return ('<response status="error"%s><msg>%s</msg></response>'
+                    % (code, e.body()))
+        if isinstance(result, tuple):
+            code, result = result
+            return ('<response status="success" code="%s">%s</response>'
+                    % (code, result))
+        return '<response status="success">%s</response>' % result
+
+    def _dispatch(self, req_type, query):
+        if req_type == 'keygen':
+            return self._keygen(query)
+        if query.get('key') not in self._keys:
+            raise SimulatorError('Invalid credential', code='403')
+        target = query.get('target')
+        if target not in self._candidate:
+            raise SimulatorError('Invalid target %s' % target)
+        if req_type == 'config':
+            return self._config(target, query)
+        if req_type == 'user-id':
+            return self._user_id(target, query.get('cmd', ''))
+        if req_type == 'commit':
+            return self._commit(target)
+        if req_type == 'op':
+            return self._op(query.get('cmd', ''))
+        raise SimulatorError('Unsupported request type %s' % req_type)
+
+    def _keygen(self, query):
+        if (query.get('user') != self.username or
+                query.get('password') != self.password):
+            raise SimulatorError('Invalid credentials.', code='403')
+        key = 'simulator-key-%d' % next(self._key_ids)
+        self._keys.add(key)
+        return '<result><key>%s</key></result>' % key
+
+    def _config(self, target, query):
+        action = query.get('action')
+        tree = self._candidate[target]
+        if action in ('show', 'get'):
+            nodes = find(tree, parse_xpath(query.get('xpath', '/config')))
+            if not nodes:
+                raise SimulatorError('No such node', code='7')
+            return '<result>%s</result>' % ''.join(
+                etree.tostring(node) for _parent, node in nodes)
+
+        if action == 'multi-config':
+            tree = copy.deepcopy(tree)
+            requests = parse_fragment(query.get('element', ''))
+            if len(requests) != 1 or (
+                    requests[0].tag != 'multi-configure-request'):
+                raise SimulatorError('Malformed multi-config request')
+            for request in requests[0]:
+                params = dict(request.items())
+                if len(request):
+                    params['element'] = ''.join(
+                        etree.tostring(child) for child in request)
+                self._change(tree, request.tag, params)
+        else:
+            self._change(tree, action, query)
+        self._candidate[target] = tree
+        self._dirty.add(target)
+        return (20, '<msg>command succeeded</msg>')
+
+    def _change(self, tree, action, params):
+        steps = parse_xpath(params.get('xpath', ''))
+        if action == 'set':
+            new = etree.Element('root')
+            new.extend(parse_fragment(params.get('element', '')))
+            for _parent, node in find(tree, steps, create=True):
+                merge(node, copy.deepcopy(new))
+        elif action == 'edit':
+            new = parse_fragment(params.get('element', ''))
+            tag, name, _text = steps[-1]
+            if (len(new) != 1 or new[0].tag != tag or
+                    (name is not None and new[0].get('name') != name)):
+                raise SimulatorError('edit breaks config validity')
+            parent = find(tree, steps[:-1], create=True)[0][1]
+            old = find(parent, steps[-1:])
+            if old:
+                index = list(parent).index(old[0][1])
+                parent.remove(old[0][1])
+                parent.insert(index, new[0])
+            else:
+                parent.append(new[0])
+        elif action == 'delete':
+            for parent, node in find(tree, steps):
+                parent.remove(node)
+        elif action == 'move':
+            self._move(tree, steps, params.get('where'), params.get('dst'))
+        else:
+            raise SimulatorError('Unsupported config action %s' % action)
+
+    def _move(self, tree, steps, where, dst):
+        nodes = find(tree, steps)
+        if not nodes:
+            raise SimulatorError('No such node', code='7')
+        parent, node = nodes[0]
+        if where in ('before', 'after'):
+            others = [e for e in parent
+                      if e.tag == node.tag and e.get('name') == dst]
+            if not others:
+                raise SimulatorError('Move destination %s not found' % dst)
+        elif where not in ('top', 'bottom'):
+            raise SimulatorError('Invalid move location %s' % where)
+        parent.remove(node)
+        if where == 'top':
+            parent.insert(0, node)
+        elif where == 'bottom':
+            parent.append(node)
+        else:
+            index = list(parent).index(others[0])
+            parent.insert(index + (where == 'after'), node)
+
+    def _user_id(self, target, cmd):
+        message = parse_fragment(cmd)
+        if len(message) != 1 or message[0].tag != 'uid-message':
+            raise SimulatorError('Malformed uid-message')
+        registered = self._registered.get(target)
+        if registered is None:
+            raise SimulatorError('User-ID is not supported by Panorama')
+        self.stats['uid_entries'] += len(
+            message[0].findall('payload/*/entry'))
+
+        errors = []
+        for entry in message[0].findall('payload/register/entry'):
+            tags = set(m.text for m in entry.findall('tag/member'))
+            ip = entry.get('ip')
+            if tags and tags <= registered.get(ip, set()):
+                errors.append(
+                    '<entry ip=%s message="tags already exists, ignore"/>'
+                    % saxutils.quoteattr(ip))
+            registered.setdefault(ip, set()).update(tags)
+        for entry in message[0].findall('payload/unregister/entry'):
+            registered.pop(entry.get('ip'), None)
+
+        if errors:
+            raise _UidError(''.join(errors))
+        return '<result><uid-response><payload/></uid-response></result>'
+
+    def _commit(self, target):
+        if target not in self._dirty:
+            return (19, '<msg>There are no changes to commit.</msg>')
+        self._dirty.discard(target)
+        self._running[target] = copy.deepcopy(self._candidate[target])
+        self.stats['commit_jobs'] += 1
+
+        now = time.time()
+        start = max(now, self._last_finish.get(target, now))
+        job = Job(str(next(self._job_ids)), target, start,
+                  start + self.commit_time)
+        self._last_finish[target] = job.finish
+        self._jobs[job.id] = job
+        return (19, '<result><msg><line>Commit job enqueued with jobid %s'
+                    '</line></msg><job>%s</job></result>'
+                % (job.id, job.id))
+
+    def _op(self, cmd):
+        m = re.match(r'^<show><jobs><id>(\d+)</id></jobs></show>$', cmd)
+        if m is None:
+            raise SimulatorError('Unsupported op command %s' % cmd)
+        job = self._jobs.get(m.group(1))
+        if job is None:
+            raise SimulatorError('job %s not found' % m.group(1))
+        status = job.status(time.time())
+        if status == 'FIN':
+            result = ('<result>OK</result><progress>100</progress>'
+                      '<details><line>Configuration committed successfully'
+                      '</line></details>')
+        else:
+            result = '<result>PEND</result><progress>0</progress>'
+        return ('<result><job><id>%s</id><type>Commit</type>'
+                '<status>%s</status>%s</job></result>'
+                % (job.id, status, result))
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive, as the connector pools its connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        self._answer(url.path, url.query)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        url = urlparse.urlsplit(self.path)
+        self._answer(url.path, self.rfile.read(length))
+
+    def _answer(self, path, data):
+        if path.rstrip('/') != '/api':
+            self.send_error(404)
+            return
+        query = dict((k, v[0]) for k, v in
+                     urlparse.parse_qs(data, keep_blank_values=True).items())
+        body = self.server.simulator.handle(query)
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,137 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import socket
+
+import eventlet
+import fixtures
+
+from neutron.agent.linux import ovsdb_client
+from neutron.tests import base
+
+
+def _monitor_result():
+    return {
+        'Bridge': {
+            'b1': {'new': {'name': 'br-int',
+                           'ports': ['set', [['uuid', 'p0'],
+                                             ['uuid', 'p1'],
+                                             ['uuid', 'p2']]]}}},
+        'Port': {
+            'p0': {'new': {'name': 'br-int', 'interfaces': ['uuid', 'i0'],
+                           'tag': ['set', []]}},
+            'p1': {'new': {'name': 'tap1', 'interfaces': ['uuid', 'i1'],
+                           'tag': 1}},
+            'p2': {'new': {'name': 'patch-tun', 'interfaces': ['uuid', 'i2'],
+                           'tag': ['set', []]}}},
+        'Interface': {
+            'i1': {'new': {'name': 'tap1', 'ofport': 3,
+                           'external_ids': ['map', [['iface-id', 'id1']]]}},
+            'i2': {'new': {'name': 'patch-tun', 'ofport': ['set', []],
+                           'external_ids': ['map', []]}}}}
+
+
+class TestOvsdbClient(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOvsdbClient, self).setUp()
+        self.client = ovsdb_client.OvsdbClient('unix:/nonexistent')
+
+    def test_decode(self):
+        self.assertEqual([], ovsdb_client.decode(['set', []]))
+        self.assertEqual(['a', 'b'], ovsdb_client.decode(
+            ['set', [['uuid', 'a'], ['uuid', 'b']]]))
+        self.assertEqual({'k': 'v'}, ovsdb_client.decode(
+            ['map', [['k', 'v']]]))
+        self.assertEqual(5, ovsdb_client.decode(5))
+
+    def test_monitor_reply(self):
+        self.client._handle({'id': 'neutron', 'error': None,
+                             'result': _monitor_result()})
+
+        self.assertTrue(self.client.synced)
+        self.assertEqual(['patch-tun', 'tap1'],
+                         self.client.get_port_names('br-int'))
+        self.assertIsNone(self.client.get_port_names('br-tun'))
+        self.assertEqual({'tap1': {'name': 'tap1', 'ofport': 3,
+                                   'external_ids': {'iface-id': 'id1'}}},
+                         self.client.get_rows('Interface', ['tap1']))
+        self.assertEqual([], self.client.get_rows(
+            'Port', ['patch-tun'])['patch-tun']['tag'])
+
+    def test_update(self):
+        self.client._handle({'id': 'neutron', 'error': None,
+                             'result': _monitor_result()})
+        self.assertTrue(self.client.consume_updates())
+        self.assertFalse(self.client.consume_updates())
+
+        self.client._handle({'method': 'update', 'id': None, 'params': [
+            'neutron', {'Port': {'p2': {'old': {}}},
+                        'Bridge': {'b1': {'new': {
+                            'ports': ['set', [['uuid', 'p0'],
+                                              ['uuid', 'p1']]]}}}}]})
+        self.assertFalse(self.client.consume_updates())
+        self.assertEqual(['tap1'], self.client.get_port_names('br-int'))
+
+        self.client._handle({'method': 'update', 'id': None, 'params': [
+            'neutron', {'Interface': {'i1': {'new': {'ofport': 4}}}}]})
+        self.assertTrue(self.client.consume_updates())
+        self.assertEqual(4, self.client.get_rows(
+            'Interface', ['tap1'])['tap1']['ofport'])
+
+    def test_monitor_error(self):
+        self.assertRaises(RuntimeError, self.client._handle,
+                          {'id': 'neutron', 'error': 'unknown database',
+                           'result': None})
+        self.assertFalse(self.client.synced)
+        self.assertTrue(self.client.consume_updates())
+
+    def test_server(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'db.sock')
+        server = eventlet.listen(path, family=socket.AF_UNIX)
+        self.addCleanup(server.close)
+        requests = []
+
+        def serve():
+            conn, _addr = server.accept()
+            requests.append(json.loads(conn.recv(65536)))
+            reply = json.dumps({'id': 'neutron', 'error': None,
+                                'result': _monitor_result()})
+            # Split the reply to check the framing
+            conn.sendall(reply[:10])
+            eventlet.sleep(0.01)
+            conn.sendall(reply[10:] + json.dumps(
+                {'method': 'echo', 'id': 'echo', 'params': []}))
+            requests.append(json.loads(conn.recv(65536)))
+            conn.close()
+
+        serving = eventlet.spawn(serve)
+        client = ovsdb_client.OvsdbClient('unix:' + path, retry_interval=60)
+        client.start()
+        self.addCleanup(client.stop)
+
+        self.assertTrue(client.wait_synced(5))
+        self.assertEqual(['patch-tun', 'tap1'],
+                         client.get_port_names('br-int'))
+        serving.wait()
+        self.assertEqual('monitor', requests[0]['method'])
+        self.assertEqual({'id': 'echo', 'result': [], 'error': None},
+                         requests[1])
+        # The server closed the connection
+        eventlet.sleep(0.01)
+        self.assertFalse(client.synced)
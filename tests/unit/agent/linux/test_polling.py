@@ -38,6 +38,18 @@ class TestGetPollingManager(base.BaseTestCase):
                 mock_stop.assert_has_calls(mock.call())
             mock_start.assert_has_calls(mock.call())
 
+    def test_ovsdb_replica_polling_minimizer(self):
+        client = mock.Mock()
+        with mock.patch('neutron.agent.linux.ovs_lib.get_ovsdb_replica',
+                        return_value=client):
+            with polling.get_polling_manager(minimize_polling=True) as pm:
+                self.assertEqual(pm.__class__,
+                                 polling.OvsdbReplicaPollingMinimizer)
+                client.consume_updates.return_value = False
+                self.assertFalse(pm.is_polling_required)
+                client.consume_updates.return_value = True
+                self.assertTrue(pm.is_polling_required)
+
 
 class TestBasePollingManager(base.BaseTestCase):
 
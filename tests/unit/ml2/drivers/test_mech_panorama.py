@@ -0,0 +1,122 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron import context
+from neutron.db import api as db
+from neutron.db import models_v2
+from neutron.extensions import portbindings
+from neutron.plugins.ml2.drivers import mech_panorama
+from neutron.tests import base
+
+
+class TestPanoramaPortTags(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPanoramaPortTags, self).setUp()
+        db.configure_db()
+        self.ctx = context.get_admin_context()
+        self.addCleanup(db.clear_db)
+        self.driver = mech_panorama.PanoramaMechanismDriver.__new__(
+            mech_panorama.PanoramaMechanismDriver)
+        session = self.ctx.session
+        with session.begin(subtransactions=True):
+            for net_id in ('n1', 'n2'):
+                session.add(models_v2.Network(
+                    id=net_id, name=net_id, tenant_id='tenant',
+                    status='ACTIVE', admin_state_up=True, shared=False))
+                session.add(models_v2.Subnet(
+                    id='s-' + net_id, network_id=net_id, tenant_id='tenant',
+                    ip_version=4, cidr='10.0.0.0/24', gateway_ip='10.0.0.1',
+                    enable_dhcp=False, shared=False))
+        for i, net_id in enumerate(('n1', 'n1', 'n1', 'n2'), 1):
+            self._add_port('p%d' % i, net_id, '10.0.0.%d' % (i + 1))
+
+    def _add_port(self, port_id, net_id, ip):
+        session = self.ctx.session
+        with session.begin(subtransactions=True):
+            session.add(models_v2.Port(
+                id=port_id, network_id=net_id, tenant_id='tenant',
+                mac_address='fa:16:3e:00:00:%s' % port_id[1:].zfill(2),
+                status='ACTIVE', admin_state_up=True, device_id='vm',
+                device_owner='compute:nova'))
+            session.add(models_v2.IPAllocation(
+                port_id=port_id, network_id=net_id,
+                subnet_id='s-' + net_id, ip_address=ip))
+
+    def _port_context(self, port_id):
+        return mock.Mock(_plugin_context=self.ctx, _port={'id': port_id})
+
+    def test_get_network_port_tags(self):
+        self.driver._save_tags_to_db(self._port_context('p1'), ['a', 'b'])
+        self.driver._save_tags_to_db(self._port_context('p3'), ['c'])
+        self.driver._save_tags_to_db(self._port_context('p4'), ['d'])
+
+        result = list(self.driver._get_network_port_tags(
+            self._port_context('p1'), 'n1'))
+
+        self.assertEqual([('p1', '10.0.0.2/24', ['a', 'b']),
+                          ('p3', '10.0.0.4/24', ['c'])], result)
+
+    def test_save_tags_replaces(self):
+        self.driver._save_tags_to_db(self._port_context('p1'), ['a'])
+        self.driver._save_tags_to_db(self._port_context('p1'), ['b'])
+
+        self.assertEqual(1, self.ctx.session.query(
+            mech_panorama.PortMetadata).count())
+
+
+class TestPanoramaInstanceCache(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPanoramaInstanceCache, self).setUp()
+        self.driver = mech_panorama.PanoramaMechanismDriver.__new__(
+            mech_panorama.PanoramaMechanismDriver)
+        self.driver.instance_cache = mock.Mock()
+        self.port = {'id': 'p1', 'device_id': 'vm', 'tenant_id': 'tenant',
+                     'network_id': 'n1', 'device_owner': 'compute:nova',
+                     'fixed_ips': [{'subnet_id': 's1'}],
+                     'security_groups': [],
+                     portbindings.HOST_ID: 'host2'}
+
+    def _info(self, host):
+        return {'image_id': 'image', 'flavor_id': 'flavor', 'host': host,
+                'user_id': 'user'}
+
+    def test_moved_instance_refreshed(self):
+        self.driver.instance_cache.get.side_effect = [self._info('host1'),
+                                                      self._info('host2')]
+
+        tags = self.driver._collect_instance_tags(mock.Mock(_port=self.port))
+
+        self.driver.instance_cache.invalidate.assert_called_once_with('vm')
+        self.assertIn('openstack_vm_host-host2', tags)
+
+    def test_host_change_invalidates(self):
+        context = mock.Mock(current=self.port,
+                            original=dict(self.port, **{
+                                portbindings.HOST_ID: 'host1'}))
+
+        self.driver.update_port_postcommit(context)
+
+        self.driver.instance_cache.invalidate.assert_called_once_with('vm')
+
+    def test_same_host_kept(self):
+        context = mock.Mock(current=self.port, original=dict(self.port))
+
+        self.driver.update_port_postcommit(context)
+
+        self.assertFalse(self.driver.instance_cache.invalidate.called)
@@ -0,0 +1,95 @@
+# Copyright (c) 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from novaclient import exceptions as nova_exc
+
+from neutron.plugins.ml2.drivers import nova_instance_cache
+from neutron.tests import base
+
+
+def fake_server(server_id, host='compute1', status='ACTIVE'):
+    server = mock.Mock(id=server_id, image={'id': 'image'},
+                       flavor={'id': 'flavor'}, user_id='user',
+                       status=status)
+    setattr(server, nova_instance_cache.HOST_ATTR, host)
+    return server
+
+
+class TestInstanceCache(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestInstanceCache, self).setUp()
+        self.client = mock.Mock()
+        self.client.servers.list.return_value = []
+        self.client.servers.get.side_effect = fake_server
+        self.cache = nova_instance_cache.InstanceCache(
+            self.client, ttl=60, max_size=2, prefetch_interval=10)
+
+    def test_get_cached(self):
+        info = self.cache.get('vm1')
+        self.assertEqual(info, self.cache.get('vm1'))
+
+        self.assertEqual({'image_id': 'image', 'flavor_id': 'flavor',
+                          'host': 'compute1', 'user_id': 'user'}, info)
+        self.client.servers.get.assert_called_once_with('vm1')
+        self.client.authenticate.assert_called_once_with()
+
+    def test_prefetch_serves_burst(self):
+        self.client.servers.list.return_value = [fake_server('vm1'),
+                                                 fake_server('vm2')]
+        self.cache.get('vm1')
+        self.cache.get('vm2')
+
+        self.assertEqual(1, self.client.servers.list.call_count)
+        self.assertFalse(self.client.servers.get.called)
+
+    def test_unscheduled_instance_not_cached(self):
+        self.client.servers.get.side_effect = None
+        self.client.servers.get.return_value = fake_server('vm1', host=None)
+        self.cache.get('vm1')
+        self.cache.get('vm1')
+
+        self.assertEqual(2, self.client.servers.get.call_count)
+
+    def test_lru_eviction(self):
+        self.cache.get('vm1')
+        self.cache.get('vm2')
+        self.cache.get('vm1')
+        self.cache.get('vm3')
+        self.cache.get('vm1')
+        self.cache.get('vm2')
+
+        self.assertEqual(['vm1', 'vm2', 'vm3', 'vm2'],
+                         [c[0][0] for c in
+                          self.client.servers.get.call_args_list])
+
+    def test_expiry(self):
+        with mock.patch.object(nova_instance_cache.time, 'time',
+                               return_value=1000):
+            self.cache.get('vm1')
+        with mock.patch.object(nova_instance_cache.time, 'time',
+                               return_value=1061):
+            self.cache.get('vm1')
+
+        self.assertEqual(2, self.client.servers.get.call_count)
+
+    def test_reauthenticate(self):
+        self.client.servers.get.side_effect = [nova_exc.Unauthorized(401),
+                                               fake_server('vm1')]
+        self.cache.get('vm1')
+
+        self.assertEqual(2, self.client.authenticate.call_count)
+        self.assertEqual(2, self.client.servers.get.call_count)
@@ -21,6 +21,7 @@ from oslo.config import cfg
 import testtools
 
 from neutron.agent.linux import ovs_lib
+from neutron.agent.linux import ovsdb_client
 from neutron.agent.linux import utils
 from neutron.common import exceptions
 from neutron.openstack.common import jsonutils
@@ -102,6 +103,89 @@ class TestBaseOVS(base.BaseTestCase):
         self._test_port_exists(None, False)
 
 
+class OVS_Lib_Native_Test(base.BaseTestCase):
+    """Reads the ports of a bridge from the native OVSDB replica."""
+
+    def setUp(self):
+        super(OVS_Lib_Native_Test, self).setUp()
+        self.config(ovsdb_interface='native')
+        client = ovsdb_client.OvsdbClient(cfg.CONF.ovsdb_connection)
+        client._handle({'id': 'neutron', 'error': None, 'result': {
+            'Bridge': {
+                'b1': {'new': {'name': 'br-int',
+                               'ports': ['set', [['uuid', 'p0'],
+                                                 ['uuid', 'p1'],
+                                                 ['uuid', 'p2'],
+                                                 ['uuid', 'p3']]]}},
+                'b2': {'new': {'name': 'br-tun', 'ports': ['uuid', 'p4']}}},
+            'Port': {
+                'p0': {'new': {'name': 'br-int', 'tag': ['set', []]}},
+                'p1': {'new': {'name': 'tap99', 'tag': 1}},
+                'p2': {'new': {'name': 'tap98', 'tag': 2}},
+                'p3': {'new': {'name': 'tun22', 'tag': ['set', []]}},
+                'p4': {'new': {'name': 'tap88', 'tag': ['set', []]}}},
+            'Interface': {
+                'i1': {'new': {'name': 'tap99', 'ofport': 1,
+                               'external_ids': ['map', [
+                                   ['iface-id', 'tap99id'],
+                                   ['attached-mac', 'tap99mac']]]}},
+                'i2': {'new': {'name': 'tap98', 'ofport': ['set', []],
+                               'external_ids': ['map', [
+                                   ['iface-id', 'tap98id'],
+                                   ['attached-mac', 'tap98mac']]]}},
+                'i3': {'new': {'name': 'tun22', 'ofport': 2,
+                               'external_ids': ['map', []]}},
+                'i4': {'new': {'name': 'tap88', 'ofport': 1,
+                               'external_ids': ['map', [
+                                   ['iface-id', 'tap88id'],
+                                   ['attached-mac', 'tap88mac']]]}}}}})
+        mock.patch.dict(ovsdb_client._clients,
+                        {cfg.CONF.ovsdb_connection: client}).start()
+        mock.patch.object(ovs_lib, '_ovsdb_waited', set()).start()
+        self.br = ovs_lib.OVSBridge('br-int', 'sudo')
+        self.execute = mock.patch.object(
+            utils, "execute", spec=utils.execute).start()
+
+    def test_get_port_name_list(self):
+        self.assertEqual(['tap98', 'tap99', 'tun22'],
+                         self.br.get_port_name_list())
+        br_ex = ovs_lib.OVSBridge('br-ex', 'sudo')
+        self.assertRaises(RuntimeError, br_ex.get_port_name_list)
+        self.assertFalse(self.execute.called)
+
+    def test_get_vif_ports(self):
+        ports = self.br.get_vif_ports()
+
+        self.assertEqual([('tap98', '[]', 'tap98id', 'tap98mac'),
+                          ('tap99', '1', 'tap99id', 'tap99mac')],
+                         [(port.port_name, port.ofport, port.vif_id,
+                           port.vif_mac) for port in ports])
+        self.assertFalse(self.execute.called)
+
+    def test_get_vif_port_set(self):
+        self.assertEqual(set(['tap99id']), self.br.get_vif_port_set())
+        self.assertFalse(self.execute.called)
+
+    def test_get_port_tag_dict(self):
+        self.assertEqual({'tap99': 1, 'tap98': 2, 'tun22': []},
+                         self.br.get_port_tag_dict())
+        self.assertFalse(self.execute.called)
+
+    def test_not_synced_falls_back_to_vsctl(self):
+        client = ovsdb_client._clients[cfg.CONF.ovsdb_connection]
+        client._close()
+        self.execute.return_value = 'tap99\n'
+
+        with mock.patch.object(client, 'wait_synced',
+                               return_value=False) as wait_synced:
+            self.assertEqual(['tap99'], self.br.get_port_name_list())
+            self.assertEqual(['tap99'], self.br.get_port_name_list())
+
+        # Only the first query waits for the replica
+        wait_synced.assert_called_once_with(cfg.CONF.ovs_vsctl_timeout)
+        self.assertEqual(2, self.execute.call_count)
+
+
 class OVS_Lib_Test(base.BaseTestCase):
     """A test suite to exercise the OVS libraries shared by Neutron agents.
 
@@ -0,0 +1,161 @@
+# Copyright 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.extensions import firewall as fw_ext
+from neutron.services.firewall.drivers.pan import pan_fwaas
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+from neutron.tests import base
+
+FW_ID = 'fake_fw_id'
+
+
+def fake_rule(rule_id, **kwargs):
+    rule = {'id': rule_id,
+            'name': 'rule %s' % rule_id,
+            'action': 'allow',
+            'enabled': True,
+            'ip_version': 4,
+            'protocol': None,
+            'source_ip_address': None,
+            'destination_ip_address': None,
+            'source_port': None,
+            'destination_port': None}
+    rule.update(kwargs)
+    return rule
+
+
+def fake_firewall(rules, admin_state_up=True):
+    return {'id': FW_ID,
+            'tenant_id': 'fake_tenant',
+            'admin_state_up': admin_state_up,
+            'firewall_rule_list': rules}
+
+
+class TestBuildSecurityPolicy(base.BaseTestCase):
+
+    def test_shared_objects(self):
+        firewall = fake_firewall([
+            fake_rule('1', protocol='tcp', destination_port='80:90',
+                      destination_ip_address='10.0.0.0/24'),
+            fake_rule('2', protocol='tcp', destination_port='80:90',
+                      source_ip_address='10.0.0.0/24', action='deny'),
+            fake_rule('3', protocol='icmp', enabled=False)])
+
+        policy = pan_fwaas.build_security_policy(firewall)
+
+        self.assertEqual({'os-net-10.0.0.0_24': '10.0.0.0/24'},
+                         policy['addresses'])
+        self.assertEqual({'os-svc-tcp-any-80-90':
+                          {'protocol': 'tcp', 'source_port': None,
+                           'destination_port': '80-90'}},
+                         policy['services'])
+        rules = policy['rules']
+        self.assertEqual(['os-1', 'os-2', 'os-3', 'os-default-deny'],
+                         [rule['name'] for rule in rules])
+        self.assertEqual(('any', 'os-net-10.0.0.0_24', 'os-svc-tcp-any-80-90',
+                          'allow'),
+                         (rules[0]['source'], rules[0]['destination'],
+                          rules[0]['service'], rules[0]['action']))
+        self.assertEqual(('os-net-10.0.0.0_24', 'deny'),
+                         (rules[1]['source'], rules[1]['action']))
+        self.assertEqual(('icmp', 'application-default', False),
+                         (rules[2]['application'], rules[2]['service'],
+                          rules[2]['enabled']))
+
+    def test_long_object_name_hashed(self):
+        name = pan_fwaas.object_name('net', 'fd00:1234:5678:9abc::/64')
+
+        self.assertEqual(pan_fwaas.MAX_NAME_LEN, len(name))
+        self.assertTrue(name.startswith('os-net-'))
+
+
+class TestPanFwaasDriver(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPanFwaasDriver, self).setUp()
+        self.connector = mock.patch.object(
+            pan_fwaas.pan_connector, 'PANConnector').start().return_value
+        self.db = mock.patch.object(
+            pan_fwaas.pan_db, 'PanDbApi').start().return_value
+        self.db.get_device_reservation.side_effect = (
+            lambda context, router_id: {'router_id': router_id,
+                                        'device_sn': 'sn-' + router_id})
+        mock.patch.object(pan_fwaas.neutron_context,
+                          'get_admin_context').start()
+        self.driver = pan_fwaas.PanFwaasDriver()
+        self.apply_list = [mock.Mock(router_id='r1'),
+                           mock.Mock(router_id='r2')]
+
+    def test_update_firewall(self):
+        firewall = fake_firewall([fake_rule('1')])
+        future = self.connector.commit_configuration.return_value
+
+        self.driver.update_firewall(self.apply_list, firewall)
+
+        policy = pan_fwaas.build_security_policy(firewall)
+        self.connector.set_security_policy.assert_has_calls(
+            [mock.call('sn-r1', policy), mock.call('sn-r2', policy)])
+        self.connector.commit_configuration.assert_has_calls(
+            [mock.call('sn-r1', wait=False), mock.call('sn-r2', wait=False)])
+        self.assertEqual(2, future.wait.call_count)
+
+    def test_update_firewall_sends_changes_only(self):
+        rules = [fake_rule('1'), fake_rule('2')]
+        self.driver.update_firewall(self.apply_list[:1],
+                                    fake_firewall(rules))
+        old_policy = self.connector.set_security_policy.call_args[0][1]
+
+        firewall = fake_firewall([rules[0], fake_rule('3'), rules[1]])
+        self.driver.update_firewall(self.apply_list[:1], firewall)
+
+        policy = pan_fwaas.build_security_policy(firewall)
+        self.connector.update_security_policy.assert_called_once_with(
+            'sn-r1', old_policy, policy,
+            [('insert', 'os-3', policy['rules'][1], 'os-2')])
+        self.assertEqual(1, self.connector.set_security_policy.call_count)
+
+    def test_unchanged_firewall_not_committed(self):
+        firewall = fake_firewall([fake_rule('1')])
+        self.driver.update_firewall(self.apply_list[:1], firewall)
+        self.driver.update_firewall(self.apply_list[:1], firewall)
+
+        self.assertEqual(1, self.connector.commit_configuration.call_count)
+        self.assertFalse(self.connector.update_security_policy.called)
+
+    def test_admin_down_applies_default_policy(self):
+        self.driver.update_firewall(self.apply_list[:1],
+                                    fake_firewall([fake_rule('1')],
+                                                  admin_state_up=False))
+
+        policy = self.connector.set_security_policy.call_args[0][1]
+        self.assertEqual(['os-default-deny'],
+                         [rule['name'] for rule in policy['rules']])
+
+    def test_delete_firewall(self):
+        self.driver.delete_firewall(self.apply_list[:1], fake_firewall([]))
+
+        self.connector.clear_security_policy.assert_called_once_with(
+            'sn-r1', pan_fwaas.PREFIX)
+
+    def test_device_error(self):
+        self.connector.set_security_policy.side_effect = (
+            xapi.PanXapiError('commit failed'))
+
+        self.assertRaises(fw_ext.FirewallInternalDriverError,
+                          self.driver.create_firewall, self.apply_list,
+                          fake_firewall([fake_rule('1')]))
+        self.assertEqual({}, self.driver._applied)
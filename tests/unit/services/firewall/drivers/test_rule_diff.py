@@ -0,0 +1,83 @@
+# Copyright 2014 OpenStack Foundation.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+
+from neutron.services.firewall.drivers import rule_diff
+from neutron.tests import base
+
+
+def rules(*ids):
+    return [{'id': rule_id, 'action': 'allow'} for rule_id in ids]
+
+
+def apply_ops(old, ops):
+    result = list(old)
+
+    def index(key):
+        return [rule['id'] for rule in result].index(key)
+
+    for action, key, rule, before in ops:
+        if action == rule_diff.UPDATE:
+            result[index(key)] = rule
+            continue
+        if action in (rule_diff.DELETE, rule_diff.MOVE):
+            del result[index(key)]
+        if action in (rule_diff.INSERT, rule_diff.MOVE):
+            if before is None:
+                result.append(rule)
+            else:
+                result.insert(index(before), rule)
+    return result
+
+
+class TestRuleDiff(base.BaseTestCase):
+
+    def test_no_change(self):
+        self.assertEqual([], rule_diff.diff_rules(rules('a', 'b'),
+                                                  rules('a', 'b')))
+
+    def test_insert_one_rule(self):
+        old = rules(*range(2000))
+        new = old[:1000] + rules('x') + old[1000:]
+
+        ops = rule_diff.diff_rules(old, new)
+
+        self.assertEqual([(rule_diff.INSERT, 'x', new[1000], 1000)], ops)
+
+    def test_delete_and_update(self):
+        new = rules('a', 'c')
+        new[1]['action'] = 'deny'
+
+        ops = rule_diff.diff_rules(rules('a', 'b', 'c'), new)
+
+        self.assertEqual([(rule_diff.DELETE, 'b', None, None),
+                          (rule_diff.UPDATE, 'c', new[1], None)], ops)
+
+    def test_move_to_end(self):
+        ops = rule_diff.diff_rules(rules('a', 'b', 'c'), rules('b', 'c', 'a'))
+
+        self.assertEqual([(rule_diff.MOVE, 'a', {'id': 'a', 'action': 'allow'},
+                           None)], ops)
+
+    def test_random_changes(self):
+        rnd = random.Random(42)
+        for _i in range(50):
+            old = rules(*rnd.sample(range(30), rnd.randint(0, 20)))
+            new = rules(*rnd.sample(range(30), rnd.randint(0, 20)))
+
+            ops = rule_diff.diff_rules(old, new)
+
+            self.assertEqual(new, apply_ops(old, ops))
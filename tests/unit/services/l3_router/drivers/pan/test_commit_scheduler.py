@@ -0,0 +1,65 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector import commit_scheduler
+from neutron.tests import base
+
+
+class TestCommitScheduler(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestCommitScheduler, self).setUp()
+        self.commit = mock.Mock(return_value=None)
+        self.scheduler = commit_scheduler.CommitScheduler(self.commit, 0.01)
+
+    def test_requests_coalesced_per_device(self):
+        futures = [self.scheduler.schedule('sn1') for i in range(50)]
+        other = self.scheduler.schedule('sn2')
+
+        futures[0].wait()
+        other.wait()
+
+        self.assertEqual(50, futures[0].requests)
+        self.assertTrue(all(f is futures[0] for f in futures))
+        self.assertEqual([mock.call('sn1'), mock.call('sn2')],
+                         self.commit.call_args_list)
+
+    def test_requests_during_commit_join_next_batch(self):
+        def slow_commit(device_sn):
+            eventlet.sleep(0.05)
+        self.commit.side_effect = slow_commit
+
+        first = self.scheduler.schedule('sn1')
+        eventlet.sleep(0.02)
+        second = self.scheduler.schedule('sn1')
+        third = self.scheduler.schedule('sn1')
+
+        self.assertIsNot(first, second)
+        self.assertIs(second, third)
+        third.wait()
+        self.assertTrue(first.done())
+        self.assertEqual(2, self.commit.call_count)
+
+    def test_error_raised_to_all_waiters(self):
+        self.commit.side_effect = ValueError('commit failed')
+
+        futures = [self.scheduler.schedule() for i in range(2)]
+
+        for future in futures:
+            self.assertRaises(ValueError, future.wait)
+        self.commit.assert_called_once_with(None)
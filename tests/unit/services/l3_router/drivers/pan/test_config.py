@@ -0,0 +1,53 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.services.l3_router.drivers.pan.connector.xml_api import config
+from neutron.tests.benchmark import pan_config
+from neutron.tests import base
+
+UNITS = ('<response status="success"><result><units>'
+         '<entry name="ethernet1/2.1"><tag>101</tag><comment/>'
+         '<ipv6><enabled>no</enabled></ipv6></entry>'
+         '</units><member>a</member><x>1</x><x>2</x></result></response>')
+
+
+class TestPanConfig(base.BaseTestCase):
+
+    def test_python(self):
+        result = config.PanConfig(config=UNITS).python()
+
+        self.assertEqual(
+            {'response': {
+                'status': 'success',
+                'result': {
+                    'units': {'entry': [{'name': 'ethernet1/2.1',
+                                         'tag': '101',
+                                         'comment': None,
+                                         'ipv6': {'enabled': False}}]},
+                    'member': ['a'],
+                    'x': ['1', '2']}}},
+            result)
+
+    def test_python_xpath(self):
+        result = config.PanConfig(config=UNITS).python('./result/units')
+
+        self.assertEqual(['ethernet1/2.1'],
+                         [e['name'] for e in result['units']['entry']])
+
+    def test_python_matches_recursive_converter(self):
+        elem = pan_config.build_config(50)
+
+        self.assertEqual(pan_config.legacy_python(elem),
+                         config.PanConfig(config=elem).python())
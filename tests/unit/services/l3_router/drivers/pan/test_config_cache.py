@@ -0,0 +1,52 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector import config_cache
+from neutron.tests import base
+
+
+class TestConfigCache(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestConfigCache, self).setUp()
+        self.cache = config_cache.ConfigCache(ttl=60)
+
+    def test_entry_expires(self):
+        with mock.patch.object(config_cache.time, 'time', return_value=1000):
+            self.cache.put('sn1', 'zone', True)
+        with mock.patch.object(config_cache.time, 'time', return_value=1059):
+            self.assertIs(True, self.cache.get('sn1', 'zone'))
+        with mock.patch.object(config_cache.time, 'time', return_value=1060):
+            self.assertIs(config_cache.MISSING,
+                          self.cache.get('sn1', 'zone'))
+
+    def test_invalidate(self):
+        self.cache.put('sn1', 'zone', True)
+        self.cache.put('sn2', 'zone', True)
+
+        self.cache.invalidate('sn1')
+        self.assertIs(config_cache.MISSING, self.cache.get('sn1', 'zone'))
+        self.assertIs(True, self.cache.get('sn2', 'zone'))
+
+        self.cache.invalidate()
+        self.assertIs(config_cache.MISSING, self.cache.get('sn2', 'zone'))
+
+    def test_disabled(self):
+        self.cache = config_cache.ConfigCache(ttl=0)
+        self.cache.put('sn1', 'zone', True)
+
+        self.assertIs(config_cache.MISSING, self.cache.get('sn1', 'zone'))
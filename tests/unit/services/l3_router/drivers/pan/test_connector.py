@@ -15,6 +15,7 @@
 
 import copy
 import mock
+import xml.etree.ElementTree as etree
 
 from neutron.services.l3_router.drivers.pan.connector import pan_connector
 from neutron.tests import base
@@ -25,6 +26,7 @@ class FakeXapi(object):
     def __init__(self, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
+        self.serial = kwargs.get('serial')
 
     def __eq__(self, other):
         return (self.args == other.args and self.kwargs == other.kwargs)
@@ -38,17 +40,27 @@ class FakeXapi(object):
     def show(self, xpath=None):
         pass
 
+    def iter_show(self, xpath=None, tag='entry'):
+        return iter([])
+
     def delete(self, xpath=None):
         pass
 
     def set(self, xpath=None, element=None):
         pass
 
+    def multi_config(self, element=None):
+        pass
+
     def commit(self, cmd=None, action=None, sync=False,
                interval=None, timeout=None):
         pass
 
-fake_devices = [{'name': 'device #1'}, {'name': 'device #2'}]
+    def user_id(self, cmd=None, vsys=None):
+        pass
+
+fake_device_entries = [etree.Element('entry', name='device #1'),
+                       etree.Element('entry', name='device #2')]
 fake_interfaces = [{'name': 'ethernet1/2.1', 'comment': ''},
                    {'name': 'ethernet1/2.2', 'comment': ''}]
 
@@ -58,24 +70,23 @@ class TestPANConnector(base.BaseTestCase):
 
     def setUp(self):
         super(TestPANConnector, self).setUp()
-        pan_connector.cfg.CONF.pan_host = '10.10.10.10'
-        pan_connector.cfg.CONF.pan_username = 'fake user'
-        pan_connector.cfg.CONF.pan_password = 'fake password'
+        self.config(pan_host='10.10.10.10', pan_username='fake user',
+                    pan_password='fake password', pan_commit_window=0)
         self.connector = pan_connector.PANConnector()
 
-    @mock.patch.object(FakeXapi, "show", mock.Mock())
-    @mock.patch.object(FakeXapi, "xml_python",
-                       mock.Mock(return_value={'response':
-                                               {'result':
-                                                {'devices':
-                                                 {'entry': fake_devices}}}}))
+    def _fake_api(self, device_sn):
+        params = copy.deepcopy(self.connector._params)
+        params['serial'] = device_sn
+        return FakeXapi(pool=self.connector._pool, **params)
+
+    @mock.patch.object(FakeXapi, "iter_show",
+                       mock.Mock(return_value=iter(fake_device_entries)))
     def test_list_devices(self):
         xpath = ("/config/devices/entry[@name='localhost.localdomain']"
                  "/device-group/entry[@name='default']/devices")
         result = self.connector.list_devices()
 
-        FakeXapi.show.assert_called_once_with(xpath)
-        FakeXapi.xml_python.assert_any_call()
+        FakeXapi.iter_show.assert_called_once_with(xpath)
         self.assertEqual(['device #1', 'device #2'], result)
 
     @mock.patch.object(FakeXapi, "set", mock.Mock())
@@ -102,13 +113,91 @@ class TestPANConnector(base.BaseTestCase):
 
         FakeXapi.delete.assert_called_once_with(xpath)
 
-    @mock.patch.object(FakeXapi, "commit", mock.Mock())
+    @mock.patch.object(FakeXapi, "commit", mock.Mock(return_value=None))
     def test_commit(self):
 
         self.connector.commit_configuration()
 
-        FakeXapi.commit.assert_called_once_with(cmd='<commit></commit>',
-                                                sync=True)
+        FakeXapi.commit.assert_called_once_with(cmd='<commit></commit>')
+
+    @mock.patch.object(FakeXapi, "commit", mock.Mock(return_value='42'))
+    def test_commit_job_tracked(self):
+        with mock.patch.object(self.connector._job_poller,
+                               'track') as track:
+            self.connector.commit_configuration('fake device')
+
+            track.assert_called_once_with('fake device', '42')
+            track.return_value.wait.assert_called_once_with()
+
+    @mock.patch.object(FakeXapi, "commit", mock.Mock(return_value='42'))
+    def test_commit_no_wait(self):
+        with mock.patch.object(self.connector._job_poller,
+                               'track') as track:
+            handle = self.connector.commit_configuration('fake device',
+                                                         wait=False)
+
+            self.assertEqual(track.return_value, handle)
+            self.assertFalse(handle.wait.called)
+
+    @mock.patch.object(FakeXapi, "commit", mock.Mock(return_value=None))
+    def test_commit_coalesced(self):
+        self.config(pan_commit_window=0.01)
+        self.connector = pan_connector.PANConnector()
+
+        futures = [self.connector.commit_configuration('fake device',
+                                                       wait=False)
+                   for i in range(3)]
+        self.connector.commit_configuration('fake device')
+
+        self.assertTrue(all(f is futures[0] for f in futures))
+        self.assertTrue(futures[0].done())
+        FakeXapi.commit.assert_called_once_with(cmd='<commit></commit>')
+
+    @mock.patch.object(FakeXapi, "user_id", mock.Mock())
+    def test_register_ip_address(self):
+        cmd = ("<uid-message><version>2.0</version><type>update</type>"
+               "<payload><register>"
+               "<entry ip=\"10.0.0.3/24\">"
+               "<tag><member>tag1</member><member>tag2</member></tag>"
+               "</entry>"
+               "</register></payload></uid-message>")
+
+        self.connector.register_ip_address('fake device', '10.0.0.3/24',
+                                           ['tag2', 'tag1'])
+
+        FakeXapi.user_id.assert_called_once_with(cmd)
+
+    @mock.patch.object(FakeXapi, "user_id", mock.Mock())
+    def test_register_ip_address_batched(self):
+        cmd = ("<uid-message><version>2.0</version><type>update</type>"
+               "<payload><register>"
+               "<entry ip=\"10.0.0.3/24\"><tag><member>tag1</member></tag>"
+               "</entry>"
+               "<entry ip=\"10.0.0.4/24\"><tag><member>tag1</member></tag>"
+               "</entry>"
+               "</register><unregister>"
+               "<entry ip=\"10.0.0.5/24\"></entry>"
+               "</unregister></payload></uid-message>")
+
+        self.connector.register_ip_address('fake device', '10.0.0.3/24',
+                                           ['tag1'], flush=False)
+        self.connector.register_ip_address('fake device', '10.0.0.4/24',
+                                           ['tag1'], flush=False)
+        self.connector.unregister_ip_address('fake device', '10.0.0.5/24',
+                                             flush=False)
+        self.assertFalse(FakeXapi.user_id.called)
+        self.connector.flush_user_id('fake device')
+
+        FakeXapi.user_id.assert_called_once_with(cmd)
+
+    @mock.patch.object(FakeXapi, "user_id", mock.Mock(
+        side_effect=pan_connector.xapi.PanXapiError(
+            'ip: 10.0.0.3 message: already exists, ignore')))
+    def test_register_ip_address_exists(self):
+        self.connector.register_ip_address('fake device', '10.0.0.3/24',
+                                           ['tag1'])
+
+        self.assertEqual(1, FakeXapi.user_id.call_count)
 
     @mock.patch.object(FakeXapi, "show", mock.Mock())
     @mock.patch.object(FakeXapi, "xml_python",
@@ -170,9 +259,7 @@ class TestPANConnector(base.BaseTestCase):
                       'cidr': '10.0.0.0/24',
                       'segmentation_id': '1111'}
         device = 'fake device'
-        params = copy.deepcopy(self.connector._params)
-        params['serial'] = device
-        api = FakeXapi(**params)
+        api = self._fake_api(device)
         iface_name = 'ethernet1/2.3'
         xpath = ("/config/devices/entry[@name='localhost.localdomain']"
                  "/network/interface/ethernet/entry[@name='ethernet1/2']"
@@ -196,6 +283,88 @@ class TestPANConnector(base.BaseTestCase):
             iface_name,
             pan_connector.cfg.CONF.pan_dev_internal_security_zone)
 
+    @mock.patch.object(pan_connector.PANConnector, "_list_vlan_interfaces",
+                       mock.Mock())
+    @mock.patch.object(pan_connector.PANConnector, "_add_vlan_iface",
+                       mock.Mock())
+    @mock.patch.object(pan_connector.PANConnector, "_set_router_iface",
+                       mock.Mock())
+    @mock.patch.object(pan_connector.PANConnector, "_set_security_zone_iface",
+                       mock.Mock())
+    def test_add_vlan_iface_with_unit(self):
+        iface_dict = {'port_id': 'fake port id',
+                      'unit': 7,
+                      'ip_address': '10.0.0.1',
+                      'cidr': '10.0.0.0/24',
+                      'segmentation_id': '1111'}
+        device = 'fake device'
+        api = self._fake_api(device)
+
+        self.connector.add_vlan_iface(device, iface_dict)
+
+        self.assertFalse(self.connector._list_vlan_interfaces.called)
+        self.connector._add_vlan_iface.assert_called_once_with(
+            api, 'ethernet1/2.7', iface_dict)
+        self.connector._set_router_iface.assert_called_once_with(
+            api, 'ethernet1/2.7')
+
+    @mock.patch.object(pan_connector.PANConnector, "_list_vlan_interfaces",
+                       mock.Mock())
+    @mock.patch.object(pan_connector.PANConnector, "_clear_router_iface",
+                       mock.Mock())
+    @mock.patch.object(pan_connector.PANConnector,
+                       "_clear_security_zone_iface", mock.Mock())
+    @mock.patch.object(pan_connector.PANConnector, "_remove_vlan_iface",
+                       mock.Mock())
+    def test_remove_vlan_iface_with_unit(self):
+        device = 'fake device'
+        api = self._fake_api(device)
+
+        self.connector.remove_vlan_iface(device, {'port_id': 'fake port id',
+                                                  'unit': 7})
+
+        self.assertFalse(self.connector._list_vlan_interfaces.called)
+        self.connector._remove_vlan_iface.assert_called_once_with(
+            api, 'ethernet1/2.7')
+
+    @mock.patch.object(FakeXapi, "set", mock.Mock())
+    @mock.patch.object(FakeXapi, "multi_config", mock.Mock())
+    @mock.patch.object(pan_connector.PANConnector, "_list_vlan_interfaces",
+                       mock.Mock(return_value=fake_interfaces))
+    def test_vlan_interfaces_cached(self):
+        iface_dict = {'port_id': 'fake port id',
+                      'ip_address': '10.0.0.1',
+                      'cidr': '10.0.0.0/24',
+                      'segmentation_id': '1111'}
+
+        with mock.patch.object(self.connector, '_add_vlan_iface') as add:
+            self.connector.add_vlan_iface('fake device', iface_dict)
+            self.connector.add_vlan_iface('fake device', iface_dict)
+
+            self.assertEqual(1, self.connector._list_vlan_interfaces.
+                             call_count)
+            self.assertEqual(['ethernet1/2.3', 'ethernet1/2.4'],
+                             [c[0][1] for c in add.call_args_list])
+
+            self.connector.invalidate_config_cache('fake device')
+            self.connector.add_vlan_iface('fake device', iface_dict)
+
+            self.assertEqual(2, self.connector._list_vlan_interfaces.
+                             call_count)
+
+    @mock.patch.object(FakeXapi, "show", mock.Mock())
+    @mock.patch.object(FakeXapi, "set", mock.Mock())
+    def test_security_zone_probe_cached(self):
+        api = FakeXapi()
+        self.connector._set_security_zone_iface(api, 'ethernet1/2.3',
+                                                'internal')
+        self.connector._set_security_zone_iface(api, 'ethernet1/2.4',
+                                                'internal')
+
+        self.assertEqual(1, FakeXapi.show.call_count)
+        self.assertEqual(2, FakeXapi.set.call_count)
+
+    @mock.patch.object(FakeXapi, "multi_config", mock.Mock())
     @mock.patch.object(FakeXapi, "delete", mock.Mock())
     def test_remove_vlan_iface(self):
         iface_dict = {'port_id': 'fake port id'}
@@ -213,22 +382,60 @@ class TestPANConnector(base.BaseTestCase):
                       "/vsys/entry[@name='vsys1']/zone/entry[@name='internal']"
                       "/network/layer3/member[text()='%s']" % iface_name)
 
-        delete_calls = [mock.call(router_xpath),
-                        mock.call(zone_xpath),
-                        mock.call(iface_xpath)]
+        element = ('<multi-configure-request>'
+                   '<delete id="1" xpath="%s"/>'
+                   '<delete id="2" xpath="%s"/>'
+                   '<delete id="3" xpath="%s"/>'
+                   '</multi-configure-request>'
+                   % (router_xpath, zone_xpath, iface_xpath))
+
+        with mock.patch.object(self.connector, '_list_vlan_interfaces',
+                               mock.Mock(return_value=ifaces)):
+            self.connector.remove_vlan_iface(device, iface_dict)
+
+            FakeXapi.multi_config.assert_called_once_with(element)
+            self.assertFalse(FakeXapi.delete.called)
+
+    @mock.patch.object(FakeXapi, "multi_config",
+                       mock.Mock(side_effect=pan_connector.xapi.PanXapiError(
+                           'unknown action')))
+    @mock.patch.object(FakeXapi, "delete", mock.Mock())
+    def test_remove_vlan_iface_no_multi_config(self):
+        iface_dict = {'port_id': 'fake port id'}
+        ifaces = copy.deepcopy(fake_interfaces)
+        ifaces[0]['comment'] = "port_id=%s" % iface_dict['port_id']
+        iface_name = ifaces[0]['name']
+        device = 'fake device serial'
+        iface_xpath = ("/config/devices/entry[@name='localhost.localdomain']"
+                       "/network/interface/ethernet/entry[@name='ethernet1/2']"
+                       "/layer3/units/entry[@name='%s']" % iface_name)
+        router_xpath = ("/config/devices/entry[@name='localhost.localdomain']"
+                        "/network/virtual-router/entry[@name='default']/"
+                        "interface/member[text()='%s']" % iface_name)
+        zone_xpath = ("/config/devices/entry[@name='localhost.localdomain']"
+                      "/vsys/entry[@name='vsys1']/zone/entry[@name='internal']"
+                      "/network/layer3/member[text()='%s']" % iface_name)
+
+        element = ('<multi-configure-request>'
+                   '<delete id="1" xpath="%s"/>'
+                   '<delete id="2" xpath="%s"/>'
+                   '<delete id="3" xpath="%s"/>'
+                   '</multi-configure-request>'
+                   % (router_xpath, zone_xpath, iface_xpath))
 
         with mock.patch.object(self.connector, '_list_vlan_interfaces',
                                mock.Mock(return_value=ifaces)):
             self.connector.remove_vlan_iface(device, iface_dict)
 
-            FakeXapi.delete.assert_has_calls(delete_calls)
+            FakeXapi.delete.assert_has_calls([mock.call(router_xpath),
+                                              mock.call(zone_xpath),
+                                              mock.call(iface_xpath)])
+            self.assertFalse(self.connector._multi_config)
 
     @mock.patch.object(FakeXapi, "set", mock.Mock())
     def test_add_external_ip_private(self):
         device = 'fake device serial'
-        params = copy.deepcopy(self.connector._params)
-        params['serial'] = device
-        api = FakeXapi(**params)
+        api = self._fake_api(device)
         ip_dict = {'ip_address': '10.0.0.1',
                    'cidr': '10.0.0.0/24'}
         xpath = ("/config/devices/entry[@name='localhost.localdomain']/"
@@ -249,9 +456,7 @@ class TestPANConnector(base.BaseTestCase):
                        mock.Mock())
     def test_add_external_ip_public(self):
         device = 'fake device serial'
-        params = copy.deepcopy(self.connector._params)
-        params['serial'] = device
-        api = FakeXapi(**params)
+        api = self._fake_api(device)
         ip_dict = {'ip_address': '10.0.0.1',
                    'cidr': '10.0.0.0/24'}
         iface_name = 'ethernet1/1'
@@ -271,9 +476,7 @@ class TestPANConnector(base.BaseTestCase):
     @mock.patch.object(FakeXapi, "delete", mock.Mock())
     def test_remove_external_ip_private(self):
         device = 'fake device serial'
-        params = copy.deepcopy(self.connector._params)
-        params['serial'] = device
-        api = FakeXapi(**params)
+        api = self._fake_api(device)
         xpath = ("/config/devices/entry[@name='localhost.localdomain']/"
                  "network/interface/ethernet/entry[@name='ethernet1/1']/"
                  "layer3/ip/entry")
@@ -292,9 +495,7 @@ class TestPANConnector(base.BaseTestCase):
                        mock.Mock())
     def test_remove_external_ip_public(self):
         device = 'fake device serial'
-        params = copy.deepcopy(self.connector._params)
-        params['serial'] = device
-        api = FakeXapi(**params)
+        api = self._fake_api(device)
         iface_name = 'ethernet1/1'
 
         self.connector.remove_external_ip(device)
@@ -315,6 +516,7 @@ class TestPANConnector(base.BaseTestCase):
         device = 'fake device serial'
         params = copy.deepcopy(self.connector._params)
         params['serial'] = device
+        params['pool'] = self.connector._pool
         ip_dict = {'ip_address': '10.0.0.1',
                    'cidr': '10.0.0.0/24'}
         xpath = ("/config/devices/entry[@name='localhost.localdomain']/vsys"
@@ -352,6 +554,7 @@ class TestPANConnector(base.BaseTestCase):
         device = 'fake device serial'
         params = copy.deepcopy(self.connector._params)
         params['serial'] = device
+        params['pool'] = self.connector._pool
         xpath = ("/config/devices/entry[@name='localhost.localdomain']/vsys"
                  "/entry[@name='vsys1']/rulebase/nat/rules"
                  "/entry[@name='OpenStack']")
@@ -359,3 +562,98 @@ class TestPANConnector(base.BaseTestCase):
         self.connector.remove_external_nat(device)
         FakeXapi.__init__.assert_called_once_with(**params)
         FakeXapi.delete.assert_called_once_with(xpath)
+
+    @mock.patch.object(FakeXapi, "multi_config", mock.Mock())
+    def test_set_security_policy(self):
+        vsys = ("/config/devices/entry[@name='localhost.localdomain']"
+                "/vsys/entry[@name='vsys1']")
+        existing = {
+            vsys + '/rulebase/security/rules': ['os-old', 'user-rule'],
+            vsys + '/address': ['os-net-10.0.0.0_24', 'os-net-stale'],
+            vsys + '/service': []}
+        policy = {'prefix': 'os-',
+                  'addresses': {'os-net-10.0.0.0_24': '10.0.0.0/24'},
+                  'services': {},
+                  'rules': [{'name': 'os-1', 'action': 'allow',
+                             'enabled': True, 'source': 'any',
+                             'destination': 'os-net-10.0.0.0_24',
+                             'application': 'any', 'service': 'any',
+                             'description': 'a & b'}]}
+
+        def iter_show(xpath=None, tag='entry'):
+            return iter([etree.Element('entry', name=name)
+                         for name in existing[xpath]])
+
+        with mock.patch.object(FakeXapi, 'iter_show',
+                               mock.Mock(side_effect=iter_show)):
+            self.connector.set_security_policy('fake device serial', policy)
+
+        element = FakeXapi.multi_config.call_args[0][0]
+        ops = etree.fromstring(element)
+        self.assertEqual(
+            [('delete', vsys + "/rulebase/security/rules/entry"
+                               "[@name='os-old']"),
+             ('delete', vsys + "/address/entry[@name='os-net-stale']"),
+             ('set', vsys + '/address'),
+             ('set', vsys + '/rulebase/security/rules')],
+            [(op.tag, op.get('xpath')) for op in ops])
+        rule = ops[3].find('entry')
+        self.assertEqual('os-1', rule.get('name'))
+        self.assertEqual(['internal', 'external'],
+                         [m.text for m in rule.findall('from/member')])
+        self.assertEqual('a & b', rule.find('description').text)
+
+    @mock.patch.object(FakeXapi, "multi_config", mock.Mock())
+    def test_update_security_policy(self):
+        vsys = ("/config/devices/entry[@name='localhost.localdomain']"
+                "/vsys/entry[@name='vsys1']")
+        rules_xpath = vsys + '/rulebase/security/rules'
+        rule = {'name': 'os-2', 'action': 'deny', 'enabled': True,
+                'source': 'os-net-b', 'destination': 'any',
+                'application': 'any', 'service': 'any', 'description': None}
+        old = {'prefix': 'os-', 'addresses': {'os-net-a': '10.0.0.1'},
+               'services': {}, 'rules': []}
+        new = {'prefix': 'os-', 'addresses': {'os-net-b': '10.0.0.2'},
+               'services': {}, 'rules': [rule]}
+        changes = [('delete', 'os-1', None, None),
+                   ('insert', 'os-2', rule, 'os-default-deny')]
+
+        self.connector.update_security_policy('fake device serial', old, new,
+                                              changes)
+
+        ops = etree.fromstring(FakeXapi.multi_config.call_args[0][0])
+        self.assertEqual(
+            [('set', vsys + '/address', None),
+             ('delete', rules_xpath + "/entry[@name='os-1']", None),
+             ('set', rules_xpath, None),
+             ('move', rules_xpath + "/entry[@name='os-2']",
+              'os-default-deny'),
+             ('delete', vsys + "/address/entry[@name='os-net-a']", None)],
+            [(op.tag, op.get('xpath'), op.get('dst')) for op in ops])
+
+    def test_get_device_state(self):
+        result = etree.fromstring(
+            "<result><entry name='localhost.localdomain'>"
+            "<network><interface><ethernet>"
+            "<entry name='ethernet1/1'><layer3><ip>"
+            "<entry name='172.16.0.5/24'/></ip></layer3></entry>"
+            "<entry name='ethernet1/2'><layer3><units>"
+            "<entry name='ethernet1/2.3'><ip><entry name='10.0.0.1/24'/>"
+            "</ip><tag>101</tag><comment>port_id=port-1</comment></entry>"
+            "<entry name='ethernet1/2.4'><tag>7</tag></entry>"
+            "</units></layer3></entry>"
+            "</ethernet></interface></network>"
+            "</entry></result>")
+
+        with mock.patch.object(FakeXapi, 'element_result', result,
+                               create=True):
+            state = self.connector.get_device_state('fake device serial')
+
+        self.assertEqual(
+            {'units': {3: {'port_id': 'port-1', 'segmentation_id': 101,
+                           'ip': '10.0.0.1/24'},
+                       4: {'port_id': None, 'segmentation_id': 7,
+                           'ip': None}},
+             'external_ip': '172.16.0.5/24',
+             'nat_ip': None},
+            state)
@@ -0,0 +1,140 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron import context
+from neutron.db import api as db
+from neutron.db import models_v2
+from neutron.services.l3_router.drivers.pan import db as pan_db
+from neutron.tests import base
+
+
+class TestPanDevicePool(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPanDevicePool, self).setUp()
+        db.configure_db()
+        self.ctx = context.get_admin_context()
+        self.addCleanup(db.clear_db)
+        self.db = pan_db.PanDbApi()
+        self.db.sync_pan_devices(self.ctx, ['sn1', 'sn2'])
+
+    def test_claim_and_release(self):
+        self.assertEqual('sn1', self.db.claim_pan_device(self.ctx, 'r1'))
+        self.assertEqual('sn2', self.db.claim_pan_device(self.ctx, 'r2'))
+        self.assertRaises(pan_db.NoFreePanDevice,
+                          self.db.claim_pan_device, self.ctx, 'r3')
+
+        self.db.release_pan_device(self.ctx, 'r1')
+
+        self.assertEqual('sn1', self.db.claim_pan_device(self.ctx, 'r3'))
+        self.assertEqual({'router_id': 'r3', 'device_sn': 'sn1'},
+                         self.db.get_device_reservation(self.ctx, 'r3'))
+
+    def test_claim_in_transaction(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self.db.claim_pan_device(self.ctx, 'r1')
+            self.db.claim_pan_device(self.ctx, 'r2')
+            self.assertRaises(pan_db.NoFreePanDevice,
+                              self.db.claim_pan_device, self.ctx, 'r3')
+            # The enclosing transaction is still usable
+            self.db.sync_pan_devices(self.ctx, ['sn1', 'sn2', 'sn3'])
+            self.assertEqual('sn3', self.db.claim_pan_device(self.ctx, 'r3'))
+
+        self.assertEqual({'router_id': 'r3', 'device_sn': 'sn3'},
+                         self.db.get_device_reservation(self.ctx, 'r3'))
+
+    def test_get_device_reservations_skips_free_devices(self):
+        self.db.claim_pan_device(self.ctx, 'r1')
+
+        self.assertEqual([{'router_id': 'r1', 'device_sn': 'sn1'}],
+                         self.db.get_device_reservations(self.ctx))
+
+    def test_sync(self):
+        self.db.claim_pan_device(self.ctx, 'r1')
+
+        self.db.sync_pan_devices(self.ctx, ['sn3'])
+
+        devices = dict((res.device_sn, res.router_id) for res in
+                       self.ctx.session.query(pan_db.PanDeviceReservation))
+        self.assertEqual({'sn1': 'r1', 'sn3': None}, devices)
+
+
+class TestPanInterfaceMapping(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPanInterfaceMapping, self).setUp()
+        db.configure_db()
+        self.ctx = context.get_admin_context()
+        self.addCleanup(db.clear_db)
+        self.db = pan_db.PanDbApi()
+        self.db.sync_pan_devices(self.ctx, ['sn1', 'sn2'])
+        with self.ctx.session.begin(subtransactions=True):
+            self.ctx.session.add(models_v2.Network(
+                id='n1', name='net', tenant_id='tenant', status='ACTIVE',
+                admin_state_up=True, shared=False))
+            for i in range(1, 7):
+                self.ctx.session.add(models_v2.Port(
+                    id='p%d' % i, network_id='n1', tenant_id='tenant',
+                    mac_address='fa:16:3e:00:00:%02x' % i, status='ACTIVE',
+                    admin_state_up=True, device_id='router',
+                    device_owner='network:router_interface'))
+
+    def test_allocate_lowest_free_unit(self):
+        self.assertEqual(1, self.db.allocate_interface(self.ctx, 'sn1',
+                                                       'p1', 100))
+        self.assertEqual(2, self.db.allocate_interface(self.ctx, 'sn1',
+                                                       'p2', 101))
+        self.assertEqual(3, self.db.allocate_interface(self.ctx, 'sn1',
+                                                       'p3', 102))
+        self.assertEqual(1, self.db.allocate_interface(self.ctx, 'sn2',
+                                                       'p4', 100))
+
+        self.assertEqual({'port_id': 'p2', 'device_sn': 'sn1', 'unit': 2,
+                          'segmentation_id': 101},
+                         self.db.release_interface(self.ctx, 'p2'))
+        self.assertEqual(2, self.db.allocate_interface(self.ctx, 'sn1',
+                                                       'p5', 103))
+        self.assertEqual(4, self.db.allocate_interface(self.ctx, 'sn1',
+                                                       'p6', 104))
+
+    def test_adopt_interfaces(self):
+        self.db.allocate_interface(self.ctx, 'sn1', 'p1', 100)
+
+        stale = self.db.adopt_interfaces(self.ctx, 'sn1', {
+            1: {'port_id': 'p1', 'segmentation_id': 100},
+            2: {'port_id': 'p2', 'segmentation_id': 101},
+            3: {'port_id': 'gone', 'segmentation_id': 102},
+            4: {'port_id': None, 'segmentation_id': 103},
+            5: {'port_id': 'p1', 'segmentation_id': 100}})
+
+        self.assertEqual(set(['gone']), stale)
+        self.assertEqual(
+            [{'port_id': 'p1', 'device_sn': 'sn1', 'unit': 1,
+              'segmentation_id': 100},
+             {'port_id': 'p2', 'device_sn': 'sn1', 'unit': 2,
+              'segmentation_id': 101}],
+            sorted(self.db.get_interface_mappings(self.ctx, 'sn1'),
+                   key=lambda mapping: mapping['unit']))
+
+    def test_release_unknown_port(self):
+        self.assertIsNone(self.db.release_interface(self.ctx, 'p1'))
+
+    def test_get_interface_mappings(self):
+        self.db.allocate_interface(self.ctx, 'sn1', 'p1', 100)
+        self.db.allocate_interface(self.ctx, 'sn2', 'p2', 101)
+
+        self.assertEqual([{'port_id': 'p1', 'device_sn': 'sn1', 'unit': 1,
+                           'segmentation_id': 100}],
+                         self.db.get_interface_mappings(self.ctx, 'sn1'))
@@ -0,0 +1,132 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron import context
+from neutron.db import api as db
+from neutron.db import l3_db
+from neutron.db import models_v2
+from neutron.services.l3_router.drivers.pan import db as pan_db
+from neutron.services.l3_router.drivers.pan import driver
+from neutron.services.l3_router import l3_router_plugin
+from neutron.tests import base
+
+
+class TestL3RouterPANDriver(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestL3RouterPANDriver, self).setUp()
+        db.configure_db()
+        self.ctx = context.get_admin_context()
+        self.addCleanup(db.clear_db)
+        self.config(pan_device_sync_interval=0, pan_reconcile_interval=0)
+        self.connector = mock.patch.object(driver.pan_connector,
+                                           'PANConnector').start()()
+        self.driver = driver.L3RouterPANDriver()
+        mock.patch.object(self.driver, '_get_network_segmentation_id',
+                          return_value=102).start()
+        mock.patch.object(self.driver._db, 'get_subnet',
+                          return_value={'cidr': '10.0.0.0/24'}).start()
+
+        self.db = pan_db.PanDbApi()
+        self.db.sync_pan_devices(self.ctx, ['sn1'])
+        self.db.claim_pan_device(self.ctx, 'r1')
+        with self.ctx.session.begin(subtransactions=True):
+            self.ctx.session.add(models_v2.Network(
+                id='n1', name='net', tenant_id='tenant', status='ACTIVE',
+                admin_state_up=True, shared=False))
+            for i in range(1, 3):
+                self.ctx.session.add(models_v2.Port(
+                    id='p%d' % i, network_id='n1', tenant_id='tenant',
+                    mac_address='fa:16:3e:00:00:%02x' % i, status='ACTIVE',
+                    admin_state_up=True, device_id='r1',
+                    device_owner='network:router_interface'))
+
+    @mock.patch.object(l3_router_plugin.L3RouterPlugin, 'setup_rpc',
+                       mock.Mock())
+    def test_create_router_syncs_empty_pool(self):
+        transactions = []
+
+        def list_devices():
+            transactions.append(self.ctx.session.transaction)
+            return ['sn1', 'sn2']
+
+        self.connector.list_devices.side_effect = list_devices
+        plugin = l3_router_plugin.L3RouterPlugin()
+        plugin.driver = self.driver
+        router = {'id': 'r2', 'tenant_id': 'tenant', 'name': 'router'}
+
+        with mock.patch.object(l3_db.L3_NAT_db_mixin, 'create_router',
+                               return_value=router):
+            plugin.create_router(self.ctx, {'router': {'name': 'router'}})
+
+        self.assertEqual([None], transactions)
+        self.assertEqual({'router_id': 'r2', 'device_sn': 'sn2'},
+                         self.db.get_device_reservation(self.ctx, 'r2'))
+
+    def _add_router_interface(self, port_id):
+        port = {'id': port_id, 'network_id': 'n1', 'device_id': 'r1',
+                'fixed_ips': [{'subnet_id': 's1',
+                               'ip_address': '10.0.0.1'}]}
+        self.driver.add_router_interface_precommit(
+            self.ctx, l3_router_plugin.RouterPortContext(port))
+        return self.connector.add_vlan_iface.call_args[0][1]['unit']
+
+    def _mapped_units(self):
+        return sorted(mapping['unit'] for mapping in
+                      self.db.get_interface_mappings(self.ctx, 'sn1'))
+
+    def test_first_allocation_adopts_device_units(self):
+        self.connector.get_device_state.return_value = {'units': {
+            1: {'port_id': 'p1', 'segmentation_id': 100},
+            2: {'port_id': 'deleted port', 'segmentation_id': 101}}}
+
+        self.assertEqual(2, self._add_router_interface('p2'))
+        self.connector.remove_vlan_iface.assert_called_once_with(
+            'sn1', {'port_id': 'deleted port', 'unit': 2})
+        self.assertEqual([1, 2], self._mapped_units())
+
+    def test_allocation_uses_mappings(self):
+        self.db.allocate_interface(self.ctx, 'sn1', 'p1', 100)
+        self.assertEqual(2, self._add_router_interface('p2'))
+
+        # Freed by another server process
+        self.db.release_interface(self.ctx, 'p1')
+
+        self.assertEqual(1, self._add_router_interface('p1'))
+        self.assertFalse(self.connector.get_device_state.called)
+        self.assertEqual([1, 2], self._mapped_units())
+
+    @mock.patch.object(l3_router_plugin.L3RouterPlugin, 'setup_rpc',
+                       mock.Mock())
+    def test_remove_router_interface_uses_mapping(self):
+        self.db.allocate_interface(self.ctx, 'sn1', 'p1', 100)
+        plugin = l3_router_plugin.L3RouterPlugin()
+        plugin.driver = self.driver
+
+        def delete_port(context, router_id, interface_info):
+            # The core plugin deletes the port, and its mapping with it
+            context.session.query(models_v2.Port).filter_by(
+                id=interface_info['port_id']).delete()
+
+        with mock.patch.object(l3_db.L3_NAT_db_mixin,
+                               'remove_router_interface',
+                               side_effect=delete_port):
+            plugin.remove_router_interface(self.ctx, 'r1', {'port_id': 'p1'})
+
+        self.connector.remove_vlan_iface.assert_called_once_with(
+            'sn1', {'port_id': 'p1', 'unit': 1})
+        self.assertEqual([], self.db.get_interface_mappings(self.ctx, 'sn1'))
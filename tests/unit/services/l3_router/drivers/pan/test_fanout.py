@@ -0,0 +1,75 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+from eventlet import event
+
+from neutron.services.l3_router.drivers.pan.connector import fanout
+from neutron.tests import base
+
+
+class TestDeviceExecutor(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestDeviceExecutor, self).setUp()
+        self.executor = fanout.DeviceExecutor(max_workers=4, per_device=1)
+
+    def test_devices_run_concurrently(self):
+        started = dict((device_sn, event.Event()) for device_sn in 'abc')
+
+        def func(device_sn, suffix):
+            started[device_sn].send()
+            # Only returns if every other device call was started
+            for ev in started.values():
+                ev.wait()
+            return device_sn + suffix
+
+        with eventlet.Timeout(5):
+            result = self.executor.map(func, 'abc', '-done')
+
+        self.assertEqual({'a': 'a-done', 'b': 'b-done', 'c': 'c-done'},
+                         result)
+
+    def test_errors_aggregated(self):
+        calls = []
+
+        def func(device_sn):
+            calls.append(device_sn)
+            if device_sn != 'b':
+                raise ValueError('failed on %s' % device_sn)
+
+        e = self.assertRaises(fanout.FanoutError,
+                              self.executor.map, func, ['a', 'b', 'c'])
+
+        self.assertEqual(['a', 'c'], sorted(e.errors))
+        self.assertEqual(['a', 'b', 'c'], sorted(calls))
+
+    def test_per_device_limit(self):
+        running = []
+        peak = []
+
+        def func(device_sn):
+            running.append(device_sn)
+            peak.append(running.count(device_sn))
+            eventlet.sleep(0)
+            running.remove(device_sn)
+
+        pool = eventlet.GreenPool()
+        for _i in range(3):
+            pool.spawn(self.executor.map, func, ['a', 'b'])
+        pool.waitall()
+
+        self.assertEqual(6, len(peak))
+        self.assertEqual(1, max(peak))
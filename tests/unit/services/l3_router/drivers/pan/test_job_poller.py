@@ -0,0 +1,120 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import xml.etree.ElementTree as etree
+
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector import job_poller
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+from neutron.tests import base
+
+JOB_XML = ("<response status='success'><result><job>"
+           "<status>%s</status><result>%s</result>"
+           "<details><line>%s</line></details>"
+           "</job></result></response>")
+
+
+class FakeJobApi(object):
+    """Fake client serving 'show jobs id' responses for several jobs."""
+
+    def __init__(self):
+        self.polls = {}
+        self.pending_polls = {}
+        self.results = {}
+
+    def job_status(self, job_id, log=False):
+        self.polls[job_id] = self.polls.get(job_id, 0) + 1
+        if self.polls[job_id] <= self.pending_polls.get(job_id, 0):
+            status, result = 'ACT', 'PEND'
+        else:
+            status, result = 'FIN', self.results.get(job_id, 'OK')
+        self.element_root = etree.fromstring(
+            JOB_XML % (status, result, 'job %s' % job_id))
+        return status
+
+    def xml_result(self):
+        return '<log/>'
+
+
+class FakeRegistry(object):
+
+    def __init__(self, api):
+        self.api = api
+        self.targets = []
+
+    @contextlib.contextmanager
+    def client(self, serial=None, use_get=False):
+        self.targets.append(serial)
+        yield self.api
+
+
+class TestJobPoller(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestJobPoller, self).setUp()
+        self.api = FakeJobApi()
+        self.registry = FakeRegistry(self.api)
+        self.poller = job_poller.JobPoller(self.registry, interval=0.001,
+                                           max_interval=0.004)
+
+    def test_many_jobs_one_poller(self):
+        self.api.pending_polls = {'1': 3, '2': 1}
+        handles = [self.poller.track('sn1', '1'),
+                   self.poller.track('sn2', '2')]
+
+        self.assertEqual(['OK', 'OK'], [h.wait() for h in handles])
+        self.assertEqual({'1': 4, '2': 2}, self.api.polls)
+        self.assertEqual(set(['sn1', 'sn2']), set(self.registry.targets))
+
+    def test_backoff(self):
+        self.api.pending_polls = {'1': 4}
+        handle = self.poller.track('sn1', '1')
+        handle.wait()
+
+        self.assertEqual(0.004, handle._interval)
+
+    def test_done_callback(self):
+        callback = mock.Mock()
+        handle = self.poller.track('sn1', '1')
+        handle.add_done_callback(callback)
+        handle.wait()
+
+        callback.assert_called_once_with(handle)
+        late_callback = mock.Mock()
+        handle.add_done_callback(late_callback)
+        late_callback.assert_called_once_with(handle)
+
+    def test_failed_commit(self):
+        self.api.results = {'1': 'FAIL'}
+        handle = self.poller.track('sn1', '1')
+
+        e = self.assertRaises(xapi.PanXapiError, handle.wait)
+        self.assertIn('job 1', str(e))
+        self.assertIs(e, handle.exception)
+
+    def test_log_job(self):
+        handle = self.poller.track(None, '7', kind=job_poller.LOG_QUERY)
+
+        self.assertEqual('<log/>', handle.wait())
+
+    def test_timeout(self):
+        self.poller = job_poller.JobPoller(self.registry, interval=0.001,
+                                           timeout=0.001)
+        self.api.pending_polls = {'1': 1000}
+        handle = self.poller.track('sn1', '1')
+
+        self.assertRaises(xapi.PanXapiError, handle.wait)
@@ -0,0 +1,141 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector import metrics
+from neutron.services.l3_router.drivers.pan.connector import pan_connector
+from neutron.tests.benchmark import pan_simulator
+from neutron.tests import base
+
+DEVICE = '007900000001'
+
+
+class Instrumented(object):
+
+    def __init__(self, backend):
+        self._metrics = backend
+
+    @metrics.instrumented
+    def operation(self, fail=False):
+        if fail:
+            raise ValueError()
+        return 'done'
+
+
+class TestMetrics(base.BaseTestCase):
+
+    def test_series_name(self):
+        self.assertEqual('api.requests.config.set.panorama',
+                         metrics.series_name('api.requests',
+                                             ('config', 'set', 'panorama')))
+        self.assertEqual('api.requests.op._.a_b',
+                         metrics.series_name('api.requests',
+                                             ('op', None, 'a.b')))
+
+    def test_in_memory_snapshot(self):
+        backend = metrics.InMemoryMetrics()
+        for i in range(1, 101):
+            backend.timing('api.request_time', i / 1000.0, ('op',))
+        backend.increment('api.requests', ('op',), 3)
+
+        snapshot = backend.snapshot()
+
+        self.assertEqual({'api.requests.op': 3}, snapshot['counters'])
+        timing = snapshot['timings']['api.request_time.op']
+        self.assertEqual(100, timing['count'])
+        self.assertEqual((0.001, 0.1), (timing['min'], timing['max']))
+        self.assertEqual((0.05, 0.09, 0.099),
+                         (timing['p50'], timing['p90'], timing['p99']))
+
+    def test_statsd(self):
+        backend = metrics.StatsdMetrics('statsd.example', 9125, 'pan')
+        with mock.patch.object(backend, '_socket') as sock:
+            backend.increment('commit.jobs', ('panorama',))
+            backend.timing('job.time', 1.5, ('commit', DEVICE))
+
+        self.assertEqual(
+            [mock.call('pan.commit.jobs.panorama:1|c',
+                       ('statsd.example', 9125)),
+             mock.call('pan.job.time.commit.%s:1500.000|ms' % DEVICE,
+                       ('statsd.example', 9125))],
+            sock.sendto.call_args_list)
+
+    def test_instrumented(self):
+        backend = metrics.InMemoryMetrics()
+        obj = Instrumented(backend)
+
+        self.assertEqual('done', obj.operation())
+        self.assertRaises(ValueError, obj.operation, fail=True)
+
+        snapshot = backend.snapshot()
+        self.assertEqual({'connector.calls.operation': 2,
+                          'connector.errors.operation': 1},
+                         snapshot['counters'])
+        self.assertEqual(
+            2, snapshot['timings']['connector.time.operation']['count'])
+
+    def test_instrumented_disabled(self):
+        backend = mock.Mock(enabled=False)
+
+        self.assertEqual('done', Instrumented(backend).operation())
+        self.assertEqual([], backend.increment.call_args_list)
+
+    def test_backend_shared(self):
+        self.assertIs(metrics.get_backend(metrics.MEMORY),
+                      metrics.get_backend(metrics.MEMORY))
+        self.assertFalse(metrics.get_backend().enabled)
+        self.assertRaises(ValueError, metrics.get_backend, 'graphite')
+
+
+class TestConnectorMetrics(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestConnectorMetrics, self).setUp()
+        self.sim = pan_simulator.PanSimulator()
+        self.sim.add_device(DEVICE)
+        port = self.sim.start()
+        self.addCleanup(self.sim.stop)
+        self.config(pan_host='127.0.0.1', pan_port=str(port),
+                    pan_username='admin', pan_password='admin',
+                    pan_api_key=None, pan_commit_window=0,
+                    pan_job_poll_interval=0.01,
+                    pan_metrics_backend=metrics.MEMORY)
+        self.backend = metrics.get_backend(metrics.MEMORY)
+        self.backend.reset()
+        self.connector = pan_connector.PANConnector()
+        self.connector._params['use_http'] = True
+
+    def test_api_and_commit_metrics(self):
+        self.connector.add_vlan_iface(DEVICE, {'port_id': 'p1', 'unit': 1,
+                                               'segmentation_id': 100,
+                                               'ip_address': '10.0.0.1',
+                                               'cidr': '10.0.0.0/24'})
+        self.connector.commit_configuration(DEVICE)
+
+        snapshot = self.backend.snapshot()
+        counters = snapshot['counters']
+        self.assertEqual(1, counters['api.requests.keygen._.%s' % DEVICE])
+        self.assertEqual(
+            1, counters['api.requests.config.multi-config.%s' % DEVICE])
+        self.assertEqual(1, counters['commit.requests.%s' % DEVICE])
+        self.assertEqual(1, counters['commit.jobs.%s' % DEVICE])
+        self.assertEqual(1, counters['connector.calls.add_vlan_iface'])
+        self.assertTrue(
+            counters['api.bytes_received.config.multi-config.%s' % DEVICE])
+        self.assertEqual(self.sim.stats['requests'], sum(
+            value for name, value in counters.items()
+            if name.startswith('api.requests.')))
+        self.assertIn('job.time.commit.%s' % DEVICE, snapshot['timings'])
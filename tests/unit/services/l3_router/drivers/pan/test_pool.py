@@ -0,0 +1,149 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import httplib
+import socket
+import urllib2
+
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector import pool
+from neutron.tests import base
+
+
+def fake_response(status=200, body='<response status="success"/>',
+                  will_close=False):
+    response = mock.Mock()
+    response.status = status
+    response.reason = 'OK' if status < 400 else 'Forbidden'
+    response.will_close = will_close
+    response.read.return_value = body
+    response.msg.getheader.return_value = 'application/xml; charset=utf-8'
+    return response
+
+
+class TestHTTPConnectionPool(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestHTTPConnectionPool, self).setUp()
+        self.pool = pool.HTTPConnectionPool(maxsize=1, idle_timeout=60)
+        self.conn_cls = mock.patch.object(pool.httplib,
+                                          'HTTPSConnection').start()
+        self.time = mock.patch.object(pool.time, 'time',
+                                      return_value=1000).start()
+        self.request = urllib2.Request('https://10.0.0.1/api/', 'type=op')
+
+    def test_connection_reused(self):
+        conn = self.conn_cls.return_value
+        conn.getresponse.return_value = fake_response()
+
+        self.pool.urlopen(self.request)
+        self.pool.urlopen(self.request)
+
+        self.conn_cls.assert_called_once_with('10.0.0.1', None, timeout=None)
+        self.assertEqual(2, conn.request.call_count)
+        conn.request.assert_called_with(
+            'POST', '/api/', 'type=op',
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def test_idle_connection_evicted(self):
+        first, second = mock.Mock(), mock.Mock()
+        first.getresponse.return_value = fake_response()
+        second.getresponse.return_value = fake_response()
+        self.conn_cls.side_effect = [first, second]
+
+        self.pool.urlopen(self.request)
+        self.time.return_value = 1061
+        self.pool.urlopen(self.request)
+
+        first.close.assert_called_once_with()
+        self.assertEqual(2, self.conn_cls.call_count)
+
+    def test_surplus_connection_closed(self):
+        first, second = mock.Mock(), mock.Mock()
+        self.conn_cls.side_effect = [first, second]
+        key = ('https', '10.0.0.1', None)
+
+        self.pool.release(key, self.pool.acquire(key)[0])
+        self.pool.release(key, second)
+
+        second.close.assert_called_once_with()
+        self.assertFalse(first.close.called)
+
+    def _stale_connection(self):
+        stale, fresh = mock.Mock(), mock.Mock()
+        stale.getresponse.side_effect = httplib.BadStatusLine('')
+        fresh.getresponse.return_value = fake_response()
+        self.conn_cls.side_effect = [fresh]
+        self.pool.release(('https', '10.0.0.1', None), stale)
+        return stale, fresh
+
+    def test_stale_connection_retried(self):
+        stale, fresh = self._stale_connection()
+        request = urllib2.Request(
+            'https://10.0.0.1/api/', 'type=config&action=show&xpath=/config')
+
+        result = self.pool.urlopen(request)
+
+        stale.close.assert_called_once_with()
+        self.assertEqual('<response status="success"/>', result.read())
+
+    def test_stale_connection_send_failure_retried(self):
+        stale, fresh = self._stale_connection()
+        stale.request.side_effect = socket.error('Broken pipe')
+
+        result = self.pool.urlopen(self.request)
+
+        self.assertFalse(stale.getresponse.called)
+        self.assertEqual('<response status="success"/>', result.read())
+
+    def test_stale_connection_write_not_retried(self):
+        stale, fresh = self._stale_connection()
+        request = urllib2.Request('https://10.0.0.1/api/',
+                                  'type=commit&cmd=<commit></commit>')
+
+        self.assertRaises(urllib2.URLError, self.pool.urlopen, request)
+        self.assertFalse(fresh.request.called)
+
+    def test_http_error_raised(self):
+        conn = self.conn_cls.return_value
+        conn.getresponse.return_value = fake_response(status=403)
+
+        e = self.assertRaises(urllib2.HTTPError,
+                              self.pool.urlopen, self.request)
+        self.assertEqual(403, e.code)
+
+    def test_streamed_response_releases_connection(self):
+        conn = self.conn_cls.return_value
+        response = fake_response()
+        response.isclosed.return_value = True
+        conn.getresponse.return_value = response
+
+        result = self.pool.urlopen(self.request, stream=True)
+
+        self.assertFalse(response.read.called)
+        self.assertEqual('<response status="success"/>', result.read(8192))
+        self.pool.urlopen(self.request)
+        self.conn_cls.assert_called_once_with('10.0.0.1', None, timeout=None)
+
+    def test_unfinished_streamed_response_closes_connection(self):
+        conn = self.conn_cls.return_value
+        response = fake_response()
+        response.isclosed.return_value = False
+        conn.getresponse.return_value = response
+
+        self.pool.urlopen(self.request, stream=True).close()
+
+        conn.close.assert_called_once_with()
@@ -0,0 +1,129 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.services.l3_router.drivers.pan import reconciler
+from neutron.tests import base
+
+DEVICE = 'fake device serial'
+DEV_RES = {'device_sn': DEVICE, 'router_id': 'fake router id'}
+IP_DICT = {'ip_address': '10.0.0.1', 'cidr': '10.0.0.0/24'}
+GW_DICT = {'ip_address': '172.16.0.5', 'cidr': '172.16.0.0/24'}
+
+
+class TestReconciler(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestReconciler, self).setUp()
+        mock.patch.object(reconciler.neutron_context,
+                          'get_admin_context').start()
+        self.connector = mock.Mock()
+        self.db = mock.Mock()
+        self.db.get_device_reservations.return_value = [DEV_RES]
+        self.db.get_interface_mappings.return_value = [
+            {'port_id': 'port-1', 'device_sn': DEVICE, 'unit': 1,
+             'segmentation_id': 101}]
+        self.db.get_port_ip.return_value = IP_DICT
+        self.db.adopt_interfaces.return_value = set()
+        self.db.get_router_gateway_ip.return_value = GW_DICT
+        self.state = {'units': {1: {'port_id': 'port-1',
+                                    'segmentation_id': 101,
+                                    'ip': '10.0.0.1/24'},
+                                7: {'port_id': None,
+                                    'segmentation_id': 7,
+                                    'ip': '192.168.0.1/24'}},
+                      'external_ip': '172.16.0.5/24',
+                      'nat_ip': '172.16.0.5/24'}
+        self.connector.get_device_state.return_value = self.state
+        self.reconciler = reconciler.Reconciler(self.connector, self.db)
+
+    def _check(self):
+        return self.reconciler.check_device(mock.Mock(), DEV_RES)
+
+    def test_in_sync(self):
+        self.assertEqual(0, self._check())
+
+        self.assertFalse(self.connector.commit_configuration.called)
+        self.assertFalse(self.connector.invalidate_config_cache.called)
+
+    def test_missing_unit_added(self):
+        del self.state['units'][1]
+
+        self.assertEqual(1, self._check())
+
+        self.connector.add_vlan_iface.assert_called_once_with(
+            DEVICE, {'port_id': 'port-1', 'unit': 1, 'segmentation_id': 101,
+                     'ip_address': '10.0.0.1', 'cidr': '10.0.0.0/24'})
+        self.assertFalse(self.connector.remove_vlan_iface.called)
+        self.connector.invalidate_config_cache.assert_called_once_with(DEVICE)
+        self.connector.commit_configuration.assert_called_once_with(
+            DEVICE, wait=False)
+
+    def test_stale_unit_removed(self):
+        self.db.adopt_interfaces.return_value = set(['port-2'])
+        self.state['units'][2] = {'port_id': 'port-2',
+                                  'segmentation_id': 102,
+                                  'ip': '10.0.1.1/24'}
+
+        self.assertEqual(1, self._check())
+
+        self.connector.remove_vlan_iface.assert_called_once_with(
+            DEVICE, {'port_id': 'port-2', 'unit': 2})
+        self.assertFalse(self.connector.add_vlan_iface.called)
+
+    def test_unit_of_existing_port_kept(self):
+        # e.g. made before the mappings were persisted
+        self.state['units'][2] = {'port_id': 'port-2',
+                                  'segmentation_id': 102,
+                                  'ip': '10.0.1.1/24'}
+
+        self.assertEqual(0, self._check())
+
+        self.db.adopt_interfaces.assert_called_once_with(
+            mock.ANY, DEVICE, self.state['units'])
+        self.assertFalse(self.connector.remove_vlan_iface.called)
+
+    def test_port_without_ip_skipped(self):
+        self.db.get_port_ip.return_value = None
+
+        self.assertEqual(0, self._check())
+
+        self.assertFalse(self.connector.remove_vlan_iface.called)
+        self.assertFalse(self.connector.add_vlan_iface.called)
+
+    def test_missing_nat_added(self):
+        self.state['nat_ip'] = None
+
+        self._check()
+
+        self.connector.add_external_nat.assert_called_once_with(DEVICE,
+                                                                GW_DICT)
+        self.assertFalse(self.connector.add_external_ip.called)
+
+    def test_stale_gateway_removed(self):
+        self.db.get_router_gateway_ip.return_value = None
+
+        self._check()
+
+        self.connector.remove_external_nat.assert_called_once_with(DEVICE)
+        self.connector.remove_external_ip.assert_called_once_with(DEVICE)
+        self.assertFalse(self.connector.add_external_ip.called)
+
+    def test_device_checks_rate_limited(self):
+        self.reconciler.run()
+        self.reconciler.run()
+
+        self.connector.get_device_state.assert_called_once_with(DEVICE)
@@ -0,0 +1,122 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import xml.etree.ElementTree as etree
+
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector import job_poller
+from neutron.services.l3_router.drivers.pan.connector import registry
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+from neutron.tests import base
+
+
+class FakeXapi(object):
+
+    keygen_count = 0
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.api_key = kwargs.get('api_key')
+        self.status_code = None
+        self.rejected_keys = set()
+
+    def show(self, xpath=None):
+        if self.api_key is None:
+            FakeXapi.keygen_count += 1
+            self.api_key = 'key-%d' % FakeXapi.keygen_count
+        if self.api_key in self.rejected_keys:
+            self.status_code = '403'
+            raise xapi.PanXapiError('URLError: code: 403 reason: Forbidden')
+        self.status_code = None
+
+    def job_status(self, job_id, log=False):
+        self.show()
+        self.element_root = etree.fromstring(
+            "<response><result><job><status>FIN</status><result>OK</result>"
+            "</job></result></response>")
+        return 'FIN'
+
+
+@mock.patch.object(registry.xapi, 'PanXapi', FakeXapi)
+class TestClientRegistry(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestClientRegistry, self).setUp()
+        FakeXapi.keygen_count = 0
+        self.params = {'hostname': '10.0.0.1',
+                       'api_username': 'admin',
+                       'api_password': 'secret'}
+        self.registry = registry.ClientRegistry(self.params)
+
+    def test_client_reused_per_target(self):
+        with self.registry.client('sn1') as api:
+            first = api._api
+        with self.registry.client('sn1') as api:
+            self.assertIs(first, api._api)
+        with self.registry.client('sn2') as api:
+            self.assertIsNot(first, api._api)
+            self.assertEqual('sn2', api.kwargs['serial'])
+
+    def test_key_generated_once_per_target(self):
+        with self.registry.client('sn1') as api:
+            api.show('/config')
+        with self.registry.client('sn1') as api:
+            with self.registry.client('sn1') as api2:
+                api.show('/config')
+                api2.show('/config')
+                self.assertEqual('key-1', api2.api_key)
+
+        self.assertEqual(1, FakeXapi.keygen_count)
+
+    def test_key_regenerated_after_auth_failure(self):
+        with self.registry.client('sn1') as api:
+            api.show('/config')
+            api._api.rejected_keys.add('key-1')
+        with self.registry.client('sn1') as api:
+            api.show('/config')
+
+        self.assertEqual(2, FakeXapi.keygen_count)
+        self.assertEqual('key-2',
+                         self.registry.get_key(('10.0.0.1', 'sn1')))
+
+    def test_key_expired(self):
+        self.registry = registry.ClientRegistry(self.params, key_lifetime=60)
+        with mock.patch.object(registry.time, 'time', return_value=1000):
+            with self.registry.client('sn1') as api:
+                api.show('/config')
+        with mock.patch.object(registry.time, 'time', return_value=1061):
+            with self.registry.client('sn1') as api:
+                api.show('/config')
+
+        self.assertEqual(2, FakeXapi.keygen_count)
+
+    def test_static_key_not_regenerated(self):
+        self.params = {'hostname': '10.0.0.1', 'api_key': 'static'}
+        self.registry = registry.ClientRegistry(self.params)
+        with self.registry.client('sn1') as api:
+            api._api.rejected_keys.add('static')
+            self.assertRaises(xapi.PanXapiError, api.show, '/config')
+
+        self.assertEqual(0, FakeXapi.keygen_count)
+
+    def test_key_regenerated_while_polling_job(self):
+        with self.registry.client('sn1') as api:
+            api.show('/config')
+            api._api.rejected_keys.add('key-1')
+        poller = job_poller.JobPoller(self.registry, interval=0.001)
+
+        self.assertEqual('OK', poller.track('sn1', '1').wait())
+        self.assertEqual(2, FakeXapi.keygen_count)
@@ -0,0 +1,129 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron.services.l3_router.drivers.pan.connector import pan_connector
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+from neutron.tests.benchmark import pan_simulator
+from neutron.tests import base
+
+DEVICE = '007900000001'
+UNITS = ("/config/devices/entry[@name='localhost.localdomain']"
+         "/network/interface/ethernet/entry[@name='ethernet1/2']"
+         "/layer3/units")
+
+
+class TestPanSimulator(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPanSimulator, self).setUp()
+        self.sim = pan_simulator.PanSimulator()
+        self.sim.add_device(DEVICE)
+        self.port = self.sim.start()
+        self.addCleanup(self.sim.stop)
+        self.api = xapi.PanXapi(hostname='127.0.0.1', port=self.port,
+                                use_http=True, api_username='admin',
+                                api_password='admin', serial=DEVICE)
+
+    def _units(self):
+        return [unit.get('name') for unit in
+                self.sim.config(DEVICE).findall(UNITS[len('/config/'):] +
+                                                '/entry')]
+
+    def test_set_show_delete(self):
+        self.api.set(UNITS + "/entry[@name='ethernet1/2.1']",
+                     "<tag>5</tag><comment>port_id=p1</comment>")
+        self.api.set(UNITS, "<entry name='ethernet1/2.1'><tag>6</tag>"
+                            "</entry>")
+
+        self.api.show(UNITS + "/entry[@name='ethernet1/2.1']")
+        self.assertEqual({'name': 'ethernet1/2.1', 'tag': '6',
+                          'comment': 'port_id=p1'},
+                         self.api.xml_python(True)['entry'])
+
+        self.api.delete(UNITS + "/entry[@name='ethernet1/2.1']")
+        e = self.assertRaises(xapi.PanXapiError, self.api.show,
+                              UNITS + "/entry[@name='ethernet1/2.1']")
+        self.assertEqual('No such node', e.msg)
+
+    def test_multi_config_is_atomic(self):
+        self.assertRaises(
+            xapi.PanXapiError, self.api.multi_config,
+            "<multi-configure-request>"
+            "<set id='1' xpath=\"%s\"><entry name='ethernet1/2.1'/></set>"
+            "<move id='2' xpath=\"%s/entry[@name='missing']\" where='top'/>"
+            "</multi-configure-request>" % (UNITS, UNITS))
+
+        self.assertEqual([], self._units())
+
+    def test_commit_job(self):
+        self.sim.commit_time = 60
+        self.api.set(UNITS, "<entry name='ethernet1/2.1'/>")
+
+        job_id = self.api.commit(cmd='<commit></commit>')
+
+        self.assertEqual('ACT', self.api.job_status(job_id))
+        self.assertIsNone(self.api.commit(cmd='<commit></commit>'))
+        self.sim.commit_time = 0
+        self.sim._jobs[job_id].finish = 0
+        self.assertEqual('FIN', self.api.job_status(job_id))
+        self.assertEqual(1, self.sim.stats['commit_jobs'])
+
+
+class TestPANConnectorOnSimulator(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPANConnectorOnSimulator, self).setUp()
+        self.sim = pan_simulator.PanSimulator()
+        self.sim.add_device(DEVICE)
+        port = self.sim.start()
+        self.addCleanup(self.sim.stop)
+        self.config(pan_host='127.0.0.1', pan_port=str(port),
+                    pan_username='admin', pan_password='admin',
+                    pan_api_key=None, pan_commit_window=0,
+                    pan_job_poll_interval=0.01)
+        self.connector = pan_connector.PANConnector()
+        self.connector._params['use_http'] = True
+
+    def test_list_devices(self):
+        self.assertEqual([DEVICE], self.connector.list_devices())
+
+    def test_vlan_iface_and_commit(self):
+        self.connector.add_vlan_iface(DEVICE, {'port_id': 'p1', 'unit': 1,
+                                               'segmentation_id': 100,
+                                               'ip_address': '10.0.0.1',
+                                               'cidr': '10.0.0.0/24'})
+        self.connector.commit_configuration(DEVICE)
+
+        state = self.connector.get_device_state(DEVICE)
+        self.assertEqual({1: {'port_id': 'p1', 'segmentation_id': 100,
+                              'ip': '10.0.0.1/24'}}, state['units'])
+        running = self.sim.config(DEVICE, running=True)
+        self.assertEqual(['ethernet1/2.1'], [
+            member.text for member in running.findall(
+                "devices/entry/vsys/entry/zone/entry[@name='internal']"
+                "/network/layer3/member")])
+
+    def test_user_id_and_key_regeneration(self):
+        self.connector.register_ip_address(DEVICE, '10.0.0.5', ['a', 'b'])
+        self.sim.revoke_keys()
+        # Registering again is ignored by PAN-OS, not an error
+        self.connector.register_ip_address(DEVICE, '10.0.0.5', ['a'])
+
+        self.assertEqual({'10.0.0.5': set(['a', 'b'])},
+                         self.sim.registered(DEVICE))
+        self.assertEqual(2, self.sim.stats['keygen'])
+
+        self.connector.unregister_ip_address(DEVICE, '10.0.0.5')
+        self.assertEqual({}, self.sim.registered(DEVICE))
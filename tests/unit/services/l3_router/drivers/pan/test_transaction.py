@@ -0,0 +1,107 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector import transaction
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+from neutron.tests import base
+
+
+class TestConfigTransaction(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestConfigTransaction, self).setUp()
+        self.api = mock.Mock()
+        self.txn = transaction.ConfigTransaction(self.api)
+
+    def test_changes_deferred(self):
+        self.txn.set("/config/a", "<x/>")
+        self.txn.delete("/config/b")
+
+        self.assertEqual(2, self.txn.pending())
+        self.assertFalse(self.api.set.called)
+        self.assertFalse(self.api.delete.called)
+
+    def test_reads_pass_through(self):
+        self.txn.show("/config/a")
+
+        self.api.show.assert_called_once_with("/config/a")
+
+    def test_single_change_sent_as_is(self):
+        self.txn.set("/config/a", "<x/>")
+        self.txn.send()
+
+        self.api.set.assert_called_once_with("/config/a", "<x/>")
+        self.assertFalse(self.api.multi_config.called)
+
+    def test_multi_config(self):
+        self.txn.set("/config/entry[@name='a']", "<x/>")
+        self.txn.edit("/config/b", "<y/>")
+        self.txn.delete("/config/c")
+        self.txn.send()
+
+        self.api.multi_config.assert_called_once_with(
+            '<multi-configure-request>'
+            '<set id="1" xpath="/config/entry[@name=\'a\']"><x/></set>'
+            '<edit id="2" xpath="/config/b"><y/></edit>'
+            '<delete id="3" xpath="/config/c"/>'
+            '</multi-configure-request>')
+        self.assertEqual(0, self.txn.pending())
+
+    def test_multi_config_move(self):
+        self.txn.set("/config/rules", "<entry name='b'/>")
+        self.txn.move("/config/rules/entry[@name='b']", 'before', 'a')
+        self.txn.send()
+
+        self.api.multi_config.assert_called_once_with(
+            '<multi-configure-request>'
+            '<set id="1" xpath="/config/rules"><entry name=\'b\'/></set>'
+            '<move id="2" xpath="/config/rules/entry[@name=\'b\']"'
+            ' where="before" dst="a"/>'
+            '</multi-configure-request>')
+
+    def test_multi_config_disabled(self):
+        self.txn = transaction.ConfigTransaction(self.api, multi_config=False)
+        self.txn.set("/config/a", "<x/>")
+        self.txn.delete("/config/b")
+        self.txn.send()
+
+        self.assertFalse(self.api.multi_config.called)
+        self.assertEqual([mock.call.set("/config/a", "<x/>"),
+                          mock.call.delete("/config/b")],
+                         self.api.method_calls)
+
+    def test_multi_config_unsupported(self):
+        self.api.multi_config.side_effect = xapi.PanXapiError(
+            'Unsupported config action multi-config')
+        self.txn.set("/config/a", "<x/>")
+        self.txn.delete("/config/b")
+        self.txn.send()
+
+        self.api.set.assert_called_once_with("/config/a", "<x/>")
+        self.api.delete.assert_called_once_with("/config/b")
+        self.assertFalse(self.txn.multi_config)
+
+    def test_multi_config_error_raised(self):
+        self.api.multi_config.side_effect = xapi.PanXapiError(
+            'edit breaks config validity')
+        self.txn.set("/config/a", "<x/>")
+        self.txn.delete("/config/b")
+
+        self.assertRaises(xapi.PanXapiError, self.txn.send)
+        self.assertFalse(self.api.set.called)
+        self.assertFalse(self.api.delete.called)
+        self.assertTrue(self.txn.multi_config)
@@ -0,0 +1,79 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector import uid_writer
+from neutron.tests import base
+
+
+class TestUserIdWriter(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestUserIdWriter, self).setUp()
+        self.send = mock.Mock()
+        self.writer = uid_writer.UserIdWriter(self.send, max_entries=3,
+                                              flush_interval=0)
+
+    def _sent_ips(self):
+        return [[entry.split('"')[1]
+                 for entry in call[0][1].split('<entry ')[1:]]
+                for call in self.send.call_args_list]
+
+    def test_entries_merged_per_device(self):
+        self.writer.register('sn1', '10.0.0.3', ['a'])
+        self.writer.register('sn2', '10.0.0.3', ['a'])
+        self.writer.unregister('sn1', '10.0.0.4')
+        self.writer.flush()
+
+        self.assertEqual(2, self.send.call_count)
+        self.assertEqual(set(['sn1', 'sn2']),
+                         set(call[0][0] for call in self.send.call_args_list))
+
+    def test_flush_on_size_limit(self):
+        for i in range(7):
+            self.writer.register('sn1', '10.0.0.%d' % i, ['a'])
+
+        self.assertEqual([['10.0.0.0', '10.0.0.1', '10.0.0.2'],
+                          ['10.0.0.3', '10.0.0.4', '10.0.0.5']],
+                         self._sent_ips())
+        self.assertEqual(1, self.writer.pending('sn1'))
+
+    def test_register_tags_merged(self):
+        self.writer.register('sn1', '10.0.0.3', ['b'])
+        self.writer.register('sn1', '10.0.0.3', ['a'])
+        self.writer.flush('sn1')
+
+        self.assertIn('<tag><member>a</member><member>b</member></tag>',
+                      self.send.call_args[0][1])
+
+    def test_conflicting_entry_flushes_first(self):
+        self.writer.register('sn1', '10.0.0.3', ['a'])
+        self.writer.unregister('sn1', '10.0.0.3')
+
+        self.assertEqual(1, self.send.call_count)
+        self.assertIn('<register>', self.send.call_args[0][1])
+        self.writer.flush('sn1')
+        self.assertIn('<unregister>', self.send.call_args[0][1])
+
+    def test_timed_flush(self):
+        self.writer = uid_writer.UserIdWriter(self.send, max_entries=3,
+                                              flush_interval=0.01)
+        self.writer.register('sn1', '10.0.0.3', ['a'])
+        eventlet.sleep(0.05)
+
+        self.assertEqual(1, self.send.call_count)
+        self.assertEqual(0, self.writer.pending('sn1'))
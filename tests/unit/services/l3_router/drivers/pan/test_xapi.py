@@ -0,0 +1,92 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import StringIO
+
+import mock
+
+from neutron.services.l3_router.drivers.pan.connector.xml_api import xapi
+from neutron.tests import base
+
+DEVICES = ('<response status="success"><result><devices>'
+           '<entry name="001"><vsys><entry name="vsys1"/></vsys></entry>'
+           '<entry name="002"/>'
+           '</devices></result></response>')
+
+
+class FakeResponse(StringIO.StringIO):
+
+    def getheader(self, name, default=None):
+        return 'application/xml; charset=utf-8'
+
+    def info(self):
+        return {}
+
+
+class TestPanXapiStreaming(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestPanXapiStreaming, self).setUp()
+        self.pool = mock.Mock()
+        self.api = xapi.PanXapi(hostname='10.0.0.1', api_key='key',
+                                pool=self.pool, keep_document=False)
+
+    def _respond(self, body):
+        response = FakeResponse(body)
+        self.pool.urlopen.return_value = response
+        return response
+
+    def test_iter_show_yields_outermost_entries(self):
+        response = self._respond(DEVICES)
+
+        names = [entry.get('name') for entry in self.api.iter_show('/x')]
+
+        self.assertEqual(['001', '002'], names)
+        self.assertTrue(response.closed)
+        self.assertTrue(self.pool.urlopen.call_args[1]['stream'])
+        self.assertEqual('success', self.api.status)
+        # yielded entries are dropped from the tree
+        self.assertEqual([], self.api.element_root.findall('.//entry'))
+
+    def test_iter_show_nested_entries_kept(self):
+        self._respond(DEVICES)
+
+        vsys = [entry.find('vsys/entry').get('name')
+                for entry in self.api.iter_show('/x')
+                if entry.find('vsys/entry') is not None]
+
+        self.assertEqual(['vsys1'], vsys)
+
+    def test_iter_show_error(self):
+        self._respond('<response status="error" code="7"><msg>'
+                      '<line>No such node</line></msg></response>')
+
+        entries = self.api.iter_show('/x')
+
+        self.assertRaises(xapi.PanXapiError, list, entries)
+        self.assertEqual('7', self.api.status_code)
+
+    def test_iter_show_parse_error(self):
+        self._respond('<response status="success"><result>')
+
+        self.assertRaises(xapi.PanXapiError, list, self.api.iter_show('/x'))
+
+    def test_document_not_kept(self):
+        self._respond(DEVICES)
+
+        self.api.show('/x')
+
+        self.assertIsNone(self.api.xml_document)
+        self.assertEqual(2, len(self.api.element_result.find('devices')))
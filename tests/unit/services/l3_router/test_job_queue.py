@@ -0,0 +1,99 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from neutron import context
+from neutron.db import api as db
+from neutron.db import l3_db
+from neutron.plugins.common import constants
+from neutron.services.l3_router import job_queue
+from neutron.tests import base
+
+ROUTER_ID = 'fake_router_id'
+
+
+class TestJobQueue(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestJobQueue, self).setUp()
+        db.configure_db()
+        self.ctx = context.get_admin_context()
+        self.addCleanup(db.clear_db)
+        with self.ctx.session.begin(subtransactions=True):
+            self.ctx.session.add(l3_db.Router(id=ROUTER_ID,
+                                              tenant_id='fake_tenant',
+                                              name='router',
+                                              status=constants.ACTIVE))
+        self.calls = []
+        self.queue = job_queue.JobQueue(self._run, max_attempts=2)
+
+    def _run(self, context, method, data):
+        self.calls.append((method, data))
+        if data.get('fail'):
+            raise Exception('commit failed')
+
+    def _enqueue(self, method, data, router_status=constants.PENDING_UPDATE):
+        with self.ctx.session.begin(subtransactions=True):
+            job_queue.enqueue(self.ctx, ROUTER_ID, method, data,
+                              router_status=router_status)
+
+    def _router_status(self):
+        return self.ctx.session.query(l3_db.Router).get(ROUTER_ID).status
+
+    def _jobs(self):
+        return self.ctx.session.query(job_queue.L3DriverJob).all()
+
+    def _run_queue(self):
+        self.queue.dispatch()
+        self.queue.wait()
+        self.ctx.session.expire_all()
+
+    def test_enqueue_sets_router_status(self):
+        self._enqueue('create_router_postcommit', {'id': 1},
+                      router_status=constants.PENDING_CREATE)
+
+        self.assertEqual(constants.PENDING_CREATE, self._router_status())
+        self.assertEqual(1, len(self._jobs()))
+        self.assertEqual([], self.calls)
+
+    def test_jobs_run_in_order(self):
+        self._enqueue('create_router_postcommit', {'id': 1})
+        self._enqueue('update_router_postcommit', {'id': 2})
+
+        self._run_queue()
+
+        self.assertEqual([('create_router_postcommit', {'id': 1}),
+                          ('update_router_postcommit', {'id': 2})],
+                         self.calls)
+        self.assertEqual([], self._jobs())
+        self.assertEqual(constants.ACTIVE, self._router_status())
+
+    def test_failed_job_retried(self):
+        self._enqueue('update_router_postcommit', {'fail': True})
+
+        self._run_queue()
+        self.assertEqual(job_queue.JOB_PENDING, self._jobs()[0].status)
+        self.assertEqual(constants.PENDING_UPDATE, self._router_status())
+
+        self._run_queue()
+        self.assertEqual(job_queue.JOB_ERROR, self._jobs()[0].status)
+        self.assertEqual(constants.ERROR, self._router_status())
+        self.assertEqual(2, len(self.calls))
+
+    def test_running_job_not_claimed_twice(self):
+        self._enqueue('update_router_postcommit', {'id': 1})
+        job = self.queue._claim(self.ctx, ROUTER_ID)
+
+        self.assertIsNone(self.queue._claim(self.ctx, ROUTER_ID))
+        self.assertEqual(1, job['attempts'])
@@ -339,3 +339,29 @@ class TestL3RouterWithDriver(base.BaseTestCase):
                 self.router_plugin.driver.remove_router_interface_postcommit.\
                     assert_called_once_with(self.fake_context,
                                             iface_context)
+
+    @mock.patch.object(FakeL3RouterDriver, "create_router_precommit",
+                       mock.Mock())
+    @mock.patch.object(FakeL3RouterDriver, "create_router_postcommit",
+                       mock.Mock())
+    @mock.patch.object(FakeL3Db, "create_router",
+                       mock.Mock(return_value=dict(fake_db_router)))
+    @mock.patch.object(l3_router_plugin.job_queue, "enqueue", mock.Mock())
+    @mock.patch.object(l3_router_plugin, "_context_to_dict",
+                       mock.Mock(return_value={'type': 'RouterContext'}))
+    def test_create_router_async(self):
+        self.router_plugin._job_queue = mock.Mock()
+
+        with mock.patch.object(__builtin__, 'super',
+                               mock.Mock(return_value=FakeL3Db())):
+            r = self.router_plugin.create_router(self.fake_context,
+                                                 fake_user_router)
+
+        self.assertEqual('PENDING_CREATE', r['status'])
+        l3_router_plugin.job_queue.enqueue.assert_called_once_with(
+            self.fake_context, fake_db_router['id'],
+            'create_router_postcommit', {'type': 'RouterContext'},
+            router_status='PENDING_CREATE')
+        self.router_plugin._job_queue.wake.assert_called_once_with()
+        self.assertFalse(
+            self.router_plugin.driver.create_router_postcommit.called)
@@ -0,0 +1,122 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import StringIO
+
+import eventlet
+import mock
+
+from neutron.agent.linux import iptables_coordinator
+from neutron.agent.linux import iptables_manager
+from neutron.openstack.common import jsonutils
+from neutron.tests import base
+
+
+class TestIptablesApplyCoordinator(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestIptablesApplyCoordinator, self).setUp()
+        self.execute = mock.patch(
+            'neutron.agent.linux.utils.execute').start()
+
+    def test_execute(self):
+        coordinator = iptables_coordinator.IptablesApplyCoordinator('sudo')
+        self.execute.return_value = 'saved'
+
+        self.assertEqual('saved', coordinator.execute(
+            'qrouter-1', ['iptables-save', '-c']))
+        self.execute.assert_called_once_with(
+            ['ip', 'netns', 'exec', 'qrouter-1', 'iptables-save', '-c'],
+            root_helper='sudo', process_input=None)
+
+    def test_manager_apply(self):
+        coordinator = mock.Mock()
+        coordinator.execute.return_value = ''
+        manager = iptables_manager.IptablesManager(
+            namespace='qrouter-1', coordinator=coordinator)
+
+        manager.apply()
+
+        self.assertEqual(
+            [mock.call('qrouter-1', ['iptables-save', '-c'],
+                       process_input=None),
+             mock.call('qrouter-1', ['iptables-restore', '-c'],
+                       process_input=mock.ANY)],
+            coordinator.execute.call_args_list)
+
+    def test_helper_batches(self):
+        coordinator = iptables_coordinator.IptablesApplyCoordinator(
+            'sudo', use_helper=True)
+        run_batch = mock.patch.object(coordinator, '_run_batch').start()
+        run_batch.return_value = [[0, 'saved', ''], [1, '', 'failed'],
+                                  [0, '', '']]
+
+        threads = [eventlet.spawn(coordinator.execute, 'qrouter-%d' % i,
+                                  ['iptables-restore', '-c'], 'rules')
+                   for i in range(3)]
+
+        self.assertEqual('saved', threads[0].wait())
+        self.assertRaises(RuntimeError, threads[1].wait)
+        self.assertEqual('', threads[2].wait())
+        run_batch.assert_called_once_with(
+            [{'namespace': 'qrouter-%d' % i,
+              'args': ['iptables-restore', '-c'], 'input': 'rules'}
+             for i in range(3)])
+
+    def test_helper_failure(self):
+        coordinator = iptables_coordinator.IptablesApplyCoordinator(
+            'sudo', use_helper=True)
+        mock.patch.object(coordinator, '_run_batch',
+                          side_effect=IOError('broken pipe')).start()
+
+        self.assertRaises(RuntimeError, coordinator.execute, None,
+                          ['iptables-save', '-c'])
+
+
+class TestIptablesHelper(base.BaseTestCase):
+
+    def test_run_batch(self):
+        with mock.patch('subprocess.Popen') as popen:
+            popen.return_value.communicate.return_value = ('saved', '')
+            popen.return_value.returncode = 0
+            results = iptables_coordinator.run_batch(
+                [{'namespace': 'qrouter-1', 'args': ['iptables-save', '-c'],
+                  'input': None},
+                 {'namespace': None, 'args': ['rm', '-rf', '/'],
+                  'input': None},
+                 {'namespace': 'qrouter-1; rm', 'args': ['iptables-save'],
+                  'input': None},
+                 {'namespace': None, 'args': ['iptables-restore', '-M',
+                                              '/sbin/modprobe'],
+                  'input': 'rules'}])
+
+        self.assertEqual([0, 'saved', ''], results[0])
+        self.assertEqual([1, 1, 1], [result[0] for result in results[1:]])
+        popen.assert_called_once_with(
+            ['ip', 'netns', 'exec', 'qrouter-1', 'iptables-save', '-c'],
+            stdin=mock.ANY, stdout=mock.ANY, stderr=mock.ANY)
+
+    def test_main(self):
+        stdin = StringIO.StringIO(
+            jsonutils.dumps([{'args': ['iptables-save']}]) + '\n' +
+            jsonutils.dumps([]) + '\n')
+        stdout = StringIO.StringIO()
+        with mock.patch.object(iptables_coordinator, 'run_batch',
+                               side_effect=[[[0, 'saved', '']], []]):
+            iptables_coordinator.main(stdin, stdout)
+
+        self.assertEqual([[[0, 'saved', '']], []],
+                         [jsonutils.loads(line)
+                          for line in stdout.getvalue().splitlines()])
@@ -607,29 +607,52 @@ class IptablesManagerStateFulTestCase(base.BaseTestCase):
 
         tools.verify_mock_calls(self.execute, expected_calls_and_values)
 
-    def _test_find_last_entry(self, find_str):
-        filter_list = [':neutron-filter-top - [0:0]',
-                       ':%(bn)s-FORWARD - [0:0]',
-                       ':%(bn)s-INPUT - [0:0]',
-                       ':%(bn)s-local - [0:0]',
-                       ':%(wrap)s - [0:0]',
-                       ':%(bn)s-OUTPUT - [0:0]',
-                       '[0:0] -A FORWARD -j neutron-filter-top',
-                       '[0:0] -A OUTPUT -j neutron-filter-top'
-                       % IPTABLES_ARG]
-
-        return self.iptables._find_last_entry(filter_list, find_str)
-
-    def test_find_last_entry_old_dup(self):
-        find_str = 'neutron-filter-top'
-        match_str = '[0:0] -A OUTPUT -j neutron-filter-top'
-        ret_str = self._test_find_last_entry(find_str)
-        self.assertEqual(ret_str, match_str)
-
-    def test_find_last_entry_none(self):
-        find_str = 'neutron-filter-NOTFOUND'
-        ret_str = self._test_find_last_entry(find_str)
-        self.assertIsNone(ret_str)
+    def _modify_rules(self, current, table_name='filter'):
+        return self.iptables._modify_rules(
+            [line % IPTABLES_ARG for line in current],
+            self.iptables.ipv4[table_name], table_name)
+
+    def test_modify_rules_keeps_counters(self):
+        table = self.iptables.ipv4['nat']
+        table.add_rule('PREROUTING',
+                       '-d 172.24.4.3/32 -j DNAT --to 10.1.0.1')
+        table.add_rule('PREROUTING',
+                       '-d 172.24.4.4/32 -j DNAT --to 10.1.0.12')
+
+        new_nat = self._modify_rules(
+            NAT_DUMP.splitlines()[:8] +
+            ['[5:300] -A PREROUTING -j %(bn)s-PREROUTING',
+             '[3:180] -A %(bn)s-PREROUTING -d 172.24.4.3/32 -j DNAT '
+             '--to 10.1.0.1',
+             '[7:420] -A %(bn)s-PREROUTING -d 172.24.4.4/32 -j DNAT '
+             '--to 10.1.0.12'] +
+            NAT_DUMP.splitlines()[9:], 'nat')
+
+        self.assertIn('[5:300] -A PREROUTING -j %(bn)s-PREROUTING'
+                      % IPTABLES_ARG, new_nat)
+        self.assertIn('[3:180] -A %(bn)s-PREROUTING -d 172.24.4.3/32 '
+                      '-j DNAT --to 10.1.0.1' % IPTABLES_ARG, new_nat)
+        self.assertIn('[7:420] -A %(bn)s-PREROUTING -d 172.24.4.4/32 '
+                      '-j DNAT --to 10.1.0.12' % IPTABLES_ARG, new_nat)
+        self.assertEqual(len(set(new_nat)), len(new_nat))
+
+    def test_modify_rules_flushes_removes(self):
+        table = self.iptables.ipv4['filter']
+        table.add_chain('ext', wrap=False)
+        table.add_rule('ext', '-j DROP', wrap=False)
+        table.add_rule('ext', '-j ACCEPT', wrap=False)
+        table.add_rule('ext', '-j REJECT', wrap=False)
+        table.remove_chain('ext', wrap=False)
+
+        new_filter = self._modify_rules(
+            FILTER_DUMP.splitlines()[:7] +
+            [':ext - [0:0]', '[1:60] -A ext -j DROP'] +
+            FILTER_DUMP.splitlines()[7:])
+
+        self.assertNotIn(':ext - [0:0]', new_filter)
+        self.assertNotIn('[1:60] -A ext -j DROP', new_filter)
+        self.assertEqual(set(), table.remove_chains)
+        self.assertEqual([], table.remove_rules)
 
 
 class IptablesManagerStateLessTestCase(base.BaseTestCase):
@@ -640,3 +663,95 @@ class IptablesManagerStateLessTestCase(base.BaseTestCase):
 
     def test_nat_not_found(self):
         self.assertNotIn('nat', self.iptables.ipv4)
+
+
+class IptablesManagerIncrementalTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(IptablesManagerIncrementalTestCase, self).setUp()
+        self.config(iptables_incremental_apply=True)
+        self.iptables = iptables_manager.IptablesManager(root_helper='sudo')
+        self.execute = mock.patch.object(self.iptables, "execute").start()
+        self.execute.return_value = ''
+        self.filter = self.iptables.ipv4['filter']
+        self.filter.add_chain('filter')
+        self.filter.add_rule('filter', '-j DROP')
+        self.iptables.apply()
+        self.execute.reset_mock()
+
+    def _restore_input(self):
+        self.assertEqual(
+            [mock.call(['iptables-restore', '--noflush'],
+                       process_input=mock.ANY, root_helper='sudo')],
+            self.execute.call_args_list)
+        return self.execute.call_args[1]['process_input'].splitlines()
+
+    def test_apply_changed_chains(self):
+        self.filter.add_chain('sg')
+        self.filter.add_rule('sg', '-s 10.0.0.2 -j ACCEPT')
+        self.filter.add_rule('filter', '-s 10.0.0.1 -j ACCEPT', top=True)
+        self.filter.add_rule('filter', '-j $sg')
+
+        self.iptables.apply()
+
+        self.assertEqual(['*filter',
+                          ':%(bn)s-sg - [0:0]' % IPTABLES_ARG,
+                          '-I %(bn)s-filter 1 -s 10.0.0.1 -j ACCEPT'
+                          % IPTABLES_ARG,
+                          '-A %(bn)s-filter -j %(bn)s-sg' % IPTABLES_ARG,
+                          '-A %(bn)s-sg -s 10.0.0.2 -j ACCEPT'
+                          % IPTABLES_ARG,
+                          'COMMIT'], self._restore_input())
+
+        self.execute.reset_mock()
+        self.filter.remove_chain('sg')
+        self.iptables.apply()
+
+        self.assertEqual(['*filter',
+                          '-D %(bn)s-filter -j %(bn)s-sg' % IPTABLES_ARG,
+                          '-F %(bn)s-sg' % IPTABLES_ARG,
+                          '-X %(bn)s-sg' % IPTABLES_ARG,
+                          'COMMIT'], self._restore_input())
+
+    def test_apply_unchanged(self):
+        self.iptables.apply()
+
+        self.assertFalse(self.execute.called)
+
+    def test_apply_unwrapped_change(self):
+        self.filter.add_rule('INPUT', '-j DROP', wrap=False)
+
+        self.iptables.apply()
+
+        self.assertEqual(['iptables-save', 'iptables-restore'],
+                         [args[0][0][0]
+                          for args in self.execute.call_args_list])
+
+    def test_apply_resync(self):
+        self.filter.add_rule('filter', '-j ACCEPT')
+        self.execute.side_effect = [RuntimeError(), '', '']
+
+        self.iptables.apply()
+
+        self.assertEqual([['iptables-restore', '--noflush'],
+                          ['iptables-save', '-c'],
+                          ['iptables-restore', '-c']],
+                         [args[0][0]
+                          for args in self.execute.call_args_list])
+
+        self.execute.reset_mock()
+        self.execute.side_effect = None
+        self.iptables._synced_at['iptables'] -= self.iptables.resync_interval
+        self.iptables.apply()
+
+        self.assertEqual(['iptables-save', 'iptables-restore'],
+                         [args[0][0][0]
+                          for args in self.execute.call_args_list])
+
+    def test_chain_delta(self):
+        self.assertEqual(['-D c -j B', '-I c 1 -j X', '-A c -j Y'],
+                         iptables_manager._chain_delta(
+                             'c', ('-j A', '-j B'), ('-j X', '-j A', '-j Y')))
+        self.assertEqual(['-F c', '-A c -j B', '-A c -j A'],
+                         iptables_manager._chain_delta(
+                             'c', ('-j A', '-j B'), ('-j B', '-j A')))
@@ -0,0 +1,83 @@
+# Copyright 2014 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import threading
+
+import fixtures
+import mock
+from oslo.config import cfg
+from oslo.rootwrap import wrapper
+
+from neutron.agent.common import config
+from neutron.agent.linux import rootwrap_daemon
+from neutron.agent.linux import utils
+from neutron.tests import base
+
+
+class TestRootwrapDaemon(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestRootwrapDaemon, self).setUp()
+        socket_path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                   'rootwrap.sock')
+        rootwrap_config = mock.Mock(exec_dirs=['/bin', '/usr/bin'])
+        filters = [wrapper.build_filter('CommandFilter', 'cat', 'root'),
+                   wrapper.build_filter('EnvFilter', 'env', 'root', 'A=',
+                                        'sh')]
+        for name, fltr in zip(['cat', 'env'], filters):
+            fltr.name = name
+        self.server = rootwrap_daemon.RootwrapDaemon(
+            socket_path, rootwrap_config, filters)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.client = rootwrap_daemon.RootwrapDaemonClient('daemon')
+        self.client._daemon = mock.Mock()
+        self.client._daemon.poll.return_value = None
+        self.client._socket_path = socket_path
+
+    def test_execute(self):
+        data = ''.join(chr(i) for i in range(256)) * 1000
+
+        self.assertEqual((0, data, ''),
+                         self.client.execute(['cat'], process_input=data))
+        self.assertEqual((0, 'x\n', ''),
+                         self.client.execute(['cat'], process_input='x\n'))
+        self.assertEqual(1, len(self.client._idle))
+
+    def test_execute_unauthorized(self):
+        code, stdout, stderr = self.client.execute(['rm', '-rf', '/'])
+
+        self.assertEqual(rootwrap_daemon.RC_UNAUTHORIZED, code)
+        self.assertIn('Unauthorized command: rm -rf /', stderr)
+
+    def test_execute_addl_env(self):
+        self.assertEqual((0, 'b\n', ''), self.client.execute(
+            ['sh', '-c', 'echo $A'], addl_env={'A': 'b'}))
+
+    def test_utils_execute(self):
+        config.register_root_helper(cfg.CONF)
+        self.config(root_helper_daemon='daemon', group='AGENT')
+        rootwrap_daemon._clients['daemon'] = self.client
+        self.addCleanup(rootwrap_daemon._clients.clear)
+
+        self.assertEqual('x', utils.execute(['cat'], root_helper='sudo',
+                                            process_input='x'))
+        self.assertRaises(RuntimeError, utils.execute, ['false'],
+                          root_helper='sudo')